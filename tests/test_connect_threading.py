@@ -0,0 +1,117 @@
+# coding:utf-8
+'''Connectを複数スレッドから同時に使った場合の、レスポンスの振り分けと送信の排他の確認
+
+シリアルポートの代わりにSimulatedBoardを使い、レスポンスは別スレッドから少し遅らせて(送信順のまま)返す。
+'''
+import collections
+import random
+import threading
+import time
+import unittest
+
+import vsido
+from vsido.simulator import SimulatedBoard
+
+THREAD_NUM = 8
+QUERY_NUM = 200
+SID_SET = tuple(range(1, THREAD_NUM + 1))
+
+
+class _DelayedBoard(SimulatedBoard):
+    '''レスポンスを別スレッドから遅らせて返すSimulatedBoard
+
+    実際のシリアル通信と同じく、レスポンスは受け取ったコマンドの順に返す。
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.malformed_count = 0
+        self._pending = collections.deque()
+        self._pending_condition = threading.Condition()
+        self._delivery_thread = threading.Thread(target=self._deliver)
+        self._delivery_thread.daemon = True
+        self._delivery_thread.start()
+
+    def write(self, data):
+        data = bytes(data)
+        if not (len(data) >= 4 and data[0] == 0xff and data[2] == len(data)):
+            self.malformed_count += 1
+        with self._pending_condition:
+            self._pending.append(data)
+            self._pending_condition.notify()
+        return len(data)
+
+    def _deliver(self):
+        while True:
+            with self._pending_condition:
+                while not self._pending:
+                    self._pending_condition.wait()
+                data = self._pending.popleft()
+            time.sleep(random.uniform(0, 0.0005))
+            SimulatedBoard.write(self, data)
+
+
+class ConnectThreadingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.board = _DelayedBoard(sid_set=SID_SET)
+        for sid in SID_SET:
+            # サーボごとに異なる角度にして、どのサーボのレスポンスかを見分けられるようにする
+            self.board.set_angle(sid, sid * 10)
+        self.board.set_acceleration(11, 22, 33)
+        self.connect = vsido.Connect()
+        self.connect.connect(self.board)
+        self.firmware_version = self.connect.get_vid_version()
+
+    def tearDown(self):
+        self.connect.disconnect()
+
+    def test_responses_are_routed_to_their_callers(self):
+        connect = self.connect
+        errors = []
+        counts = collections.Counter()
+        counts_lock = threading.Lock()
+        start_event = threading.Event()
+
+        def worker(sid):
+            local_counts = collections.Counter()
+            start_event.wait()
+            try:
+                for i in range(QUERY_NUM):
+                    kind = (sid + i) % 3
+                    if kind == 0:
+                        servo_data = connect.get_servo_info({'sid':sid, 'address':19, 'length':2}, timeout=5)[0]
+                        self.assertEqual(servo_data['sid'], sid)
+                        self.assertEqual(servo_data['data'], connect.make_2bytes_data(sid * 100))
+                        local_counts['d'] += 1
+                    elif kind == 1:
+                        self.assertEqual(connect.get_vid_value(254, timeout=5), ({'vid':254, 'vdt':self.firmware_version},))
+                        local_counts['g'] += 1
+                    else:
+                        acceleration_data = connect.get_acceleration(timeout=5)
+                        self.assertEqual((acceleration_data['ax'], acceleration_data['ay'], acceleration_data['az']), (11, 22, 33))
+                        local_counts['a'] += 1
+            except Exception as error:
+                errors.append(error)
+            with counts_lock:
+                counts.update(local_counts)
+
+        threads = [threading.Thread(target=worker, args=(sid,)) for sid in SID_SET]
+        for thread in threads:
+            thread.start()
+        start_event.set()
+        for thread in threads:
+            thread.join(60)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(counts.values()), THREAD_NUM * QUERY_NUM)
+        # フレームの途中に他のスレッドのデータが混ざっていれば、形式かチェックサムの誤りで受け付けられない
+        self.assertEqual(self.board.malformed_count, 0)
+        # 送信したフレームは全て(再送した分も含めて)基板に届いている
+        response_stats = connect.get_response_stats()
+        self.assertEqual(self.board.get_received_count(0x64), counts['d'] + response_stats['d']['retries'])
+        self.assertEqual(self.board.get_received_count(0x61), counts['a'] + response_stats['a']['retries'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# coding:utf-8
+'''Connect(io_process=True)で、送受信とその処理、周期処理が子プロセスで行われることの確認
+
+シリアルポートの代わりにpyserialのloop://(書き込んだデータがそのまま読める)を使う。
+送信したコマンドがそのままレスポンスとして返るので、要求したVIDやIK情報がそのまま受信される。
+'''
+import time
+import unittest
+
+import serial
+
+import vsido
+from vsido.io_process import ProcessConnect
+
+
+class IOProcessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.vc = vsido.Connect(io_process=True)
+        self.vc.open('loop://')
+
+    def tearDown(self):
+        self.vc.close()
+
+    def _wait_latest_ik(self, kid):
+        deadline = time.time() + 2
+        while time.time() < deadline:
+            ik_data_set = self.vc.get_latest_ik(kid)
+            if ik_data_set:
+                return ik_data_set[0]
+            time.sleep(0.01)
+        return None
+
+    def test_connect_runs_in_child_process(self):
+        self.assertIsInstance(self.vc, ProcessConnect)
+        self.assertTrue(self.vc.is_connected())
+        self.assertIsNotNone(self.vc.get_firmware_version())
+
+    def test_response_and_error_from_child(self):
+        self.assertEqual(self.vc.get_vid_value(1, 2), ({'vid':1, 'vdt':1}, {'vid':2, 'vdt':2}))
+        with self.assertRaises(ValueError):
+            self.vc.set_servo_angle({'sid':0, 'angle':0})
+        self.assertEqual(self.vc.get_response_stats()['g']['samples'], 2)
+
+    def test_latest_ik_is_read_from_shared_memory(self):
+        self.vc.set_ik({'kid':2, 'kdt':{'x':1, 'y':2, 'z':3}}, feedback=True)
+        ik_data = self._wait_latest_ik(2)
+        self.assertIsNotNone(ik_data)
+        self.assertEqual(ik_data['kdt'], {'x':1, 'y':2, 'z':3})
+        reader = vsido.StateReader(self.vc.publish_state(), shared_tracker=True)
+        try:
+            self.assertEqual(reader.get_ik(2), ik_data)
+        finally:
+            reader.close()
+
+    def test_ik_stream_runs_in_child_process(self):
+        stream = vsido.IKStream(self.vc, rate=100)
+        self.assertIsNotNone(stream._remote)
+        stream.set_target({'kid':4, 'kdt':{'x':5, 'y':6, 'z':7}})
+        with self.assertRaises(ValueError):
+            stream.set_target({'kid':16, 'kdt':{'x':5, 'y':6, 'z':7}})
+        stream.start()
+        try:
+            self.assertTrue(stream.is_running())
+            ik_data = self._wait_latest_ik(4)
+        finally:
+            stream.stop()
+        self.assertFalse(stream.is_running())
+        self.assertEqual(ik_data['kdt'], {'x':5, 'y':6, 'z':7})
+        self.assertEqual(stream.get_send_error_count(), 0)
+
+    def test_close(self):
+        stream = vsido.IKStream(self.vc, rate=100)
+        self.vc.close()
+        self.assertFalse(self.vc.is_connected())
+        self.assertFalse(stream.is_running())
+        self.assertEqual(self.vc.get_latest_ik(), tuple())
+        with self.assertRaises(ConnectionError):
+            self.vc.get_vid_value(1)
+        with self.assertRaises(ConnectionError):
+            stream.start()
+
+    def test_open_error(self):
+        vc = vsido.Connect(io_process=True)
+        with self.assertRaises(serial.SerialException):
+            vc.open('/dev/vsido_nonexistent_port')
+        self.assertFalse(vc.is_connected())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+# coding:utf-8
+'''定義表(OpcodeSpec)から生成したコマンドの送信データ、パース、エラーメッセージの確認
+
+送信データは定義表に移す前のConnectの_make_*_command()が作っていたものを、そのまま期待値として書いている。
+'''
+import unittest
+
+import vsido
+from vsido.simulator import SimulatedBoard
+
+PWM_CYCLE = 20000
+
+# (メソッド名, 引数, キーワード引数, 定義表に移す前と同じ送信データ)
+FRAME_CASES = (
+    # 負の角度の2Byteデータ、CYCの10msec単位への丸め
+    ('_make_set_servo_angle_command', ({'sid':1, 'angle':12.3}, {'sid':2, 'angle':-12.3}, {'sid':254, 'angle':-180}), {'cycle_time':1000},
+        [0xff, 0x6f, 14, 100, 1, 246, 0, 2, 10, 254, 254, 240, 226, 23]),
+    ('_make_set_servo_angle_command', ({'sid':3, 'angle':0.05},), {'cycle_time':15},
+        [0xff, 0x6f, 8, 2, 3, 0, 0, 153]),
+    ('_make_set_servo_angle_command', ({'sid':3, 'angle':180},), {'cycle_time':14},
+        [0xff, 0x6f, 8, 1, 3, 16, 28, 150]),
+    ('_make_set_servo_compliance_command', ({'sid':1, 'compliance_cw':1, 'compliance_ccw':254}, {'sid':2, 'compliance_cw':100, 'compliance_ccw':50}), {},
+        [0xff, 0x63, 10, 1, 1, 254, 2, 100, 50, 60]),
+    ('_make_set_servo_min_max_angle_command', ({'sid':1, 'min':-90, 'max':90.5}, {'sid':0, 'min':-180, 'max':-0.1}), {},
+        [0xff, 0x6d, 14, 1, 248, 240, 18, 14, 0, 240, 226, 254, 254, 155]),
+    ('_make_get_servo_info_command', ({'sid':1, 'address':0, 'length':54}, {'sid':5, 'address':53, 'length':1}), {},
+        [0xff, 0x64, 10, 1, 0, 54, 5, 53, 1, 151]),
+    ('_make_set_feedback_id_command', (1, 2, 254), {},
+        [0xff, 0x66, 7, 1, 2, 254, 99]),
+    ('_make_get_servo_feedback_command', (19, 2), {},
+        [0xff, 0x72, 6, 19, 2, 154]),
+    ('_make_set_vid_value_command', ({'vid':5, 'vdt':1}, {'vid':254, 'vdt':0}), {},
+        [0xff, 0x73, 8, 5, 1, 254, 0, 126]),
+    ('_make_get_vid_value_command', (0, 5, 254), {},
+        [0xff, 0x67, 7, 0, 5, 254, 100]),
+    ('_make_write_flash_command', (), {},
+        [0xff, 0x77, 4, 140]),
+    ('_make_set_gpio_value_command', ({'iid':4, 'value':1}, {'iid':7, 'value':0}), {},
+        [0xff, 0x69, 8, 4, 1, 7, 0, 156]),
+    # パルス幅は4で割って(切り捨てて)送る
+    ('_make_set_pwm_pulse_width_command', ({'iid':6, 'pulse':16383}, {'iid':7, 'pulse':5}), {},
+        [0xff, 0x70, 10, 6, 0, 64, 7, 2, 0, 198]),
+    ('_make_check_connected_servo_command', (), {},
+        [0xff, 0x6a, 4, 145]),
+    ('_make_get_ik_command', (0, 2, 15), {},
+        [0xff, 0x6b, 8, 8, 0, 2, 15, 153]),
+    # 速度ならびに旋回は-100～100を0～200で送る
+    ('_make_walk_command', (100, -100), {},
+        [0xff, 0x74, 8, 0, 2, 200, 0, 73]),
+    ('_make_walk_command', (-37, 0), {},
+        [0xff, 0x74, 8, 0, 2, 63, 100, 218]),
+    ('_make_get_acceleration_command', (), {},
+        [0xff, 0x61, 4, 154]),
+)
+
+# 公開メソッドで送った場合に基板に届く送信データ
+SEND_CASES = (
+    ('set_servo_angle', ({'sid':1, 'angle':12.3}, {'sid':2, 'angle':-12.3}, {'sid':254, 'angle':-180}), {'cycle_time':1000},
+        [0xff, 0x6f, 14, 100, 1, 246, 0, 2, 10, 254, 254, 240, 226, 23]),
+    ('set_servo_compliance', ({'sid':1, 'compliance_cw':1, 'compliance_ccw':254}, {'sid':2, 'compliance_cw':100, 'compliance_ccw':50}), {},
+        [0xff, 0x63, 10, 1, 1, 254, 2, 100, 50, 60]),
+    ('set_servo_min_max_angle', ({'sid':1, 'min':-90, 'max':90.5}, {'sid':0, 'min':-180, 'max':-0.1}), {},
+        [0xff, 0x6d, 14, 1, 248, 240, 18, 14, 0, 240, 226, 254, 254, 155]),
+    ('set_feedback_id', (1, 2, 254), {},
+        [0xff, 0x66, 7, 1, 2, 254, 99]),
+    ('set_vid_value', ({'vid':5, 'vdt':1}, {'vid':254, 'vdt':0}), {},
+        [0xff, 0x73, 8, 5, 1, 254, 0, 126]),
+    ('set_gpio_value', ({'iid':4, 'value':1}, {'iid':7, 'value':0}), {},
+        [0xff, 0x69, 8, 4, 1, 7, 0, 156]),
+    ('set_pwm_pulse_width', ({'iid':6, 'pulse':16383}, {'iid':7, 'pulse':5}), {},
+        [0xff, 0x70, 10, 6, 0, 64, 7, 2, 0, 198]),
+    ('walk', (-37, 0), {},
+        [0xff, 0x74, 8, 0, 2, 63, 100, 218]),
+    ('set_ik', ({'kid':2, 'kdt':{'x':-100, 'y':0, 'z':100}},), {},
+        [0xff, 0x6b, 9, 1, 2, 0, 100, 200, 50]),
+)
+
+# (メソッド名, 引数, キーワード引数, 受信データ, 定義表に移す前と同じパース結果)
+PARSE_CASES = (
+    ('_parse_servo_info_response', ({'sid':1, 'address':19, 'length':2}, {'sid':2, 'address':0, 'length':1}), {},
+        [0xff, 0x64, 9, 1, 10, 254, 2, 0, 0],
+        ({'sid':1, 'address':19, 'length':2, 'data':[10, 254]}, {'sid':2, 'address':0, 'length':1, 'data':[0]})),
+    ('_parse_servo_feedback_response', (19, 2), {},
+        [0xff, 0x72, 7, 1, 10, 254, 0],
+        ({'sid':1, 'address':19, 'length':2, 'data':[10, 254]},)),
+    ('_parse_vid_response', (5, 254), {},
+        [0xff, 0x67, 6, 1, 0x22, 0],
+        ({'vid':5, 'vdt':1}, {'vid':254, 'vdt':0x22})),
+    ('_parse_check_connected_servo_response', (), {},
+        [0xff, 0x6a, 8, 1, 48, 2, 48, 158],
+        ({'sid':1, 'time':48}, {'sid':2, 'time':48})),
+    ('_parse_ik_response', (), {},
+        [0xff, 0x6b, 13, 8, 2, 0, 100, 200, 0, 100, 100, 100, 91],
+        ({'kid':2, 'kdt':{'x':-100, 'y':0, 'z':100}}, {'kid':0, 'kdt':{'x':0, 'y':0, 'z':0}})),
+    ('_parse_acceleration_response', (), {},
+        [0xff, 0x61, 7, 1, 128, 253, 229],
+        {'ax':1, 'ay':128, 'az':253}),
+)
+
+# (メソッド名, 引数, キーワード引数, 受信データ, エラーメッセージ)
+PARSE_ERROR_CASES = (
+    ('_parse_servo_feedback_response', (19, 2), {}, (0xff, 0x72, 7, 1, 10, 254, 0), 'response_data must be list'),
+    ('_parse_servo_feedback_response', (19, 2), {}, [0xff, 0x72, 3], 'Invalid response_data length'),
+    ('_parse_servo_feedback_response', (19, 2), {}, [0xff, 0x73, 7, 1, 10, 254, 0], 'Invalid response_data OP'),
+    ('_parse_acceleration_response', (), {}, (0xff, 0x61, 7, 1, 128, 253, 229), 'response_data must be list'),
+    ('_parse_acceleration_response', (), {}, [0xff, 0x61, 6, 1, 128, 229], 'invalid response_data length'),
+    ('_parse_acceleration_response', (), {}, [0xff, 0x62, 7, 1, 128, 253, 229], 'invalid response_data OP'),
+)
+
+# (メソッド名, 引数, キーワード引数, 定義表に移す前と同じエラーメッセージ)
+VALUE_ERROR_CASES = (
+    ('set_servo_angle', ({'sid':1, 'angle':0},), {'cycle_time':1.5}, 'cycle_time must be int'),
+    ('set_servo_angle', ({'sid':1, 'angle':0},), {'cycle_time':1001}, 'cycle_time must be 0 - 1000'),
+    ('set_servo_angle', ([1, 0],), {}, 'angle_data_set must contain dict data'),
+    ('set_servo_angle', ({'angle':0},), {}, 'missing sid in angle_data_set'),
+    ('set_servo_angle', ({'sid':0, 'angle':0},), {}, 'sid must be 1 - 254'),
+    ('set_servo_angle', ({'sid':1, 'angle':'0'},), {}, 'angle must be int or float'),
+    ('set_servo_angle', ({'sid':1, 'angle':180.1},), {}, 'angle must be -180 - 180'),
+    ('set_servo_angle', ({'sid':1},), {}, 'missing angle in angle_data_set'),
+    ('set_servo_compliance', ({'sid':1, 'compliance_cw':0, 'compliance_ccw':1},), {}, 'compliance_cw must be 1 - 254'),
+    ('set_servo_compliance', ({'sid':1, 'compliance_cw':1},), {}, 'missing compliance_ccw in compliance_data_set'),
+    ('set_servo_min_max_angle', ({'sid':1, 'min':10, 'max':9.9},), {}, 'max must be bigger than min'),
+    ('set_servo_min_max_angle', ({'sid':255, 'min':0, 'max':10},), {}, 'sid must be 0 - 254'),
+    ('get_servo_info', ({'sid':1, 'address':1.0, 'length':1},), {}, 'adress must be int'),
+    ('get_servo_info', ({'sid':1, 'address':54, 'length':1},), {}, 'adress must be 0 - 53'),
+    ('get_servo_info', ({'sid':1, 'address':0, 'length':55},), {}, 'length must be 1 - 54'),
+    ('get_servo_info', ({'sid':1, 'address':0, 'length':1},), {'timeout':'1'}, 'timeout must be int or float'),
+    ('set_feedback_id', (255,), {}, 'sid must be 1 - 254'),
+    ('set_feedback_id', ('1',), {}, 'sid must be int'),
+    ('get_servo_feedback', (54, 1), {}, 'address must be 0 - 53'),
+    ('get_servo_feedback', (0, 0), {}, 'length must be int'),
+    ('set_vid_value', ({'vid':255, 'vdt':0},), {}, 'vid must be 0 - 254'),
+    ('set_vid_value', ({'vid':1, 'vdt':-1},), {}, 'vdt must be 0 - 254'),
+    ('get_vid_value', (255,), {}, 'vid must be int'),
+    ('get_vid_value', (1.0,), {}, 'vid must be int'),
+    ('set_gpio_value', ({'iid':3, 'value':0},), {}, 'iid must be 4 - 7'),
+    ('set_gpio_value', ({'iid':4, 'value':2},), {}, 'value must be 0 or 1'),
+    ('set_gpio_value', ({'iid':4},), {}, 'missing value in gpio_data_set'),
+    ('set_pwm_pulse_width', ({'iid':5, 'pulse':0},), {}, 'iid must be 6 or 7'),
+    ('set_pwm_pulse_width', ({'iid':6, 'pulse':PWM_CYCLE + 1},), {}, 'pulse must be 0 - PWM_CYCLE'),
+    ('set_pwm_pulse_width', ({'iid':6},), {}, 'missing pulse in pwm_data'),
+    ('set_pwm_pulse_width', ([6, 0],), {}, 'pwm_data_set must contain dict data'),
+    ('get_ik', (16,), {}, 'kid must be 0 - 15'),
+    ('get_ik', ('1',), {}, 'kid must be int'),
+    ('walk', (101, 0), {}, 'forward must be -100 - 100'),
+    ('walk', (0, -101), {}, 'turn_cw must be -100 - 100'),
+    ('walk', (0.5, 0), {}, 'forward must be int'),
+)
+
+
+class _RecordingBoard(SimulatedBoard):
+    '''受け取った送信データを記録するSimulatedBoard
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.written = []
+
+    def write(self, data):
+        self.written.append(list(data))
+        return super().write(data)
+
+
+class OpcodeFrameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connect = vsido.Connect()
+
+    def test_make_command_frames(self):
+        for name, args, kwargs, frame in FRAME_CASES:
+            with self.subTest(name=name, args=args, kwargs=kwargs):
+                self.assertEqual(list(getattr(self.connect, name)(*args, **kwargs)), frame)
+
+    def test_parse_responses(self):
+        for name, args, kwargs, response_data, result in PARSE_CASES:
+            with self.subTest(name=name, args=args):
+                self.assertEqual(getattr(self.connect, name)(*args, response_data=response_data, **kwargs), result)
+
+    def test_parse_error_messages(self):
+        for name, args, kwargs, response_data, message in PARSE_ERROR_CASES:
+            with self.subTest(name=name, response_data=response_data):
+                with self.assertRaises(ValueError) as context:
+                    getattr(self.connect, name)(*args, response_data=response_data, **kwargs)
+                self.assertEqual(str(context.exception), message)
+
+
+class OpcodeRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.board = _RecordingBoard(sid_set=(1, 2))
+        self.board.set_angle(1, -12.3)
+        self.board.set_angle(2, 45)
+        self.board.set_acceleration(1, 128, 253)
+        self.connect = vsido.Connect()
+        self.connect.connect(self.board)
+        self.connect.set_vid_pwm_cycle(PWM_CYCLE)
+
+    def tearDown(self):
+        self.connect.disconnect()
+
+    def test_sent_frames(self):
+        for name, args, kwargs, frame in SEND_CASES:
+            with self.subTest(name=name, args=args, kwargs=kwargs):
+                getattr(self.connect, name)(*args, **kwargs)
+                self.assertEqual(self.board.written[-1], frame)
+
+    def test_query_round_trips(self):
+        connect = self.connect
+        self.assertEqual(connect.get_servo_info({'sid':1, 'address':19, 'length':2}, {'sid':2, 'address':19, 'length':2}),
+            ({'sid':1, 'address':19, 'length':2, 'data':[10, 254]}, {'sid':2, 'address':19, 'length':2, 'data':[132, 6]}))
+        connect.set_feedback_id(1, 2)
+        # 複数サーボの場合はサーボごとにSIDとデータが並ぶ(定義表に移す前はデータの位置がずれていた)
+        self.assertEqual(connect.get_servo_feedback(19, 2),
+            ({'sid':1, 'address':19, 'length':2, 'data':[10, 254]}, {'sid':2, 'address':19, 'length':2, 'data':[132, 6]}))
+        connect.set_vid_value({'vid':5, 'vdt':1})
+        self.assertEqual(connect.get_vid_value(5, 254), ({'vid':5, 'vdt':1}, {'vid':254, 'vdt':0x22}))
+        self.assertEqual(connect.check_connected_servo(), ({'sid':1, 'time':48}, {'sid':2, 'time':48}))
+        connect.set_ik({'kid':2, 'kdt':{'x':-100, 'y':0, 'z':100}})
+        self.assertEqual(connect.get_ik(2), ({'kid':2, 'kdt':{'x':-100, 'y':0, 'z':100}},))
+        self.assertEqual(connect.get_acceleration(), {'ax':1, 'ay':128, 'az':253})
+        self.assertEqual(self.board.get_walk(), (0, 0))
+        connect.walk(100, -100)
+        self.assertEqual(self.board.get_walk(), (100, -100))
+
+    def test_value_error_messages(self):
+        for name, args, kwargs, message in VALUE_ERROR_CASES:
+            with self.subTest(name=name, args=args, kwargs=kwargs):
+                written_count = len(self.board.written)
+                with self.assertRaises(ValueError) as context:
+                    getattr(self.connect, name)(*args, **kwargs)
+                self.assertEqual(str(context.exception), message)
+                # 検証で失敗した場合は何も送らない
+                self.assertEqual(len(self.board.written), written_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
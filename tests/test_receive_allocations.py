@@ -0,0 +1,106 @@
+# coding:utf-8
+'''受信処理のメモリ確保の計測(tracemalloc)
+
+フィードバックを受信し続けた場合を想定し、104Byteのフレームを分割して受信処理に渡して、
+受信中に確保されたメモリの最大値(peak)を、リストを作る切り出し(_FrameReader)とリングバッファ(_FrameRing)で比べる。
+リングバッファの最大値は、受信フレーム数を変えて計っても変わらないことを確認する。
+スクリプトとして実行すると、計測結果を表示する。
+'''
+import time
+import tracemalloc
+import unittest
+
+import vsido
+from vsido.connect import _FrameReader, _FrameRing
+
+# 受信フレーム数(少ない場合と多い場合)
+FRAME_NUM_SET = (1000, 10000)
+FRAME_LENGTH = 104
+CHUNK_SIZE = 64
+# リングバッファでの受信中に確保してよいメモリの上限(Byte、受信フレーム数によらない)
+RING_PEAK_LIMIT = 2048
+# 受信フレーム数を変えた場合のリングバッファでの最大値の差の許容範囲(Byte)
+RING_PEAK_TOLERANCE = 256
+
+
+def _make_stream(frame_num):
+    '''104Byteの「サーボ情報要求」のレスポンスをframe_num個並べた受信データを、CHUNK_SIZEずつに分けて返す
+    '''
+    frame = [0xff, 0x64, FRAME_LENGTH] + [i % 0x7f for i in range(0, FRAME_LENGTH - 4)] + [0]
+    for value in frame[:-1]:
+        frame[-1] ^= value
+    stream = bytes(frame) * frame_num
+    return [stream[i:i + CHUNK_SIZE] for i in range(0, len(stream), CHUNK_SIZE)]
+
+
+def _measure(receive, frame_num):
+    '''frame_num個のフレームをreceive(chunks)で受信処理し、(1フレームあたりの処理時間(usec), 確保したメモリの最大値(Byte))を返す
+
+    処理時間はtracemallocを止めた状態で計る。
+    '''
+    chunks = _make_stream(frame_num)
+    receive(chunks[:FRAME_LENGTH]) # 初回だけ作るオブジェクト(memoryviewの使い回し用など)を計測から外す
+    start = time.perf_counter()
+    receive(chunks)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        receive(chunks)
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return elapsed / frame_num * 1000000, peak
+
+
+def _receive_with_reader(connect):
+    frame_reader = _FrameReader()
+    handle_received_frame = connect._handle_received_frame
+
+    def receive(chunks):
+        for chunk in chunks:
+            for frame in frame_reader.feed(chunk, 0.0):
+                handle_received_frame(frame)
+    return receive
+
+
+def _receive_with_ring(connect):
+    frame_ring = _FrameRing()
+    handle_received_frame = connect._handle_received_frame
+
+    def receive(chunks):
+        for chunk in chunks:
+            frame_ring.feed(chunk, 0.0, handle_received_frame)
+    return receive
+
+
+class ReceiveAllocationTest(unittest.TestCase):
+
+    def test_ring_peak_does_not_grow_with_frames(self):
+        connect = vsido.Connect()
+        frame_lengths = set()
+        connect._post_receive_handler = lambda receive_data: frame_lengths.add(len(receive_data))
+        ring_peaks = []
+        for frame_num in FRAME_NUM_SET:
+            ring_time, ring_peak = _measure(_receive_with_ring(connect), frame_num)
+            reader_time, reader_peak = _measure(_receive_with_reader(connect), frame_num)
+            self.assertLess(ring_peak, RING_PEAK_LIMIT)
+            self.assertLess(ring_peak, reader_peak)
+            ring_peaks.append(ring_peak)
+        self.assertEqual(frame_lengths, {FRAME_LENGTH})
+        self.assertLessEqual(max(ring_peaks) - min(ring_peaks), RING_PEAK_TOLERANCE)
+
+
+def main():
+    connect = vsido.Connect()
+    connect._post_receive_handler = lambda receive_data: None
+    for frame_num in FRAME_NUM_SET:
+        print('tracemalloc, %d x %d-byte frames in %d-byte chunks:' % (frame_num, FRAME_LENGTH, CHUNK_SIZE))
+        for name, make_receive in (('list (_FrameReader)', _receive_with_reader), ('ring (_FrameRing)', _receive_with_ring)):
+            frame_time, peak = _measure(make_receive(connect), frame_num)
+            print('  %-20s %6.1f us/frame, peak %6d B' % (name, frame_time, peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,4 +12,18 @@ __author__ = 'Daisuke IMAI <hine.gdw@gmail.com>'
 __version__ = '0.1.6'
 __date__ = '22 Jul. 2019'
 
-from vsido.connect import Connect
+from vsido.connect import Connect, LinkLostError
+from vsido.ik_stream import IKStream
+from vsido.acceleration import AccelerationSampler
+from vsido.shared_state import StateReader
+from vsido.bridge import Bridge
+from vsido.profile import RobotProfile
+from vsido.pose_blender import PoseBlender
+from vsido.output_scheduler import OutputScheduler
+from vsido.tracer import Tracer
+from vsido.opcodes import Field, OpcodeSpec, register_opcode
+from vsido.motion_recorder import MotionRecorder, MotionRecording
+from vsido.realtime import ThreadPolicy, JitterProbe
+from vsido.clock import SystemClock, VirtualClock
+from vsido.simulator import SimulatedBoard
+from vsido.board_group import BoardGroup
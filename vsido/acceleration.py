@@ -0,0 +1,198 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ 加速度センサーの連続取得
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import array
+import math
+import threading
+
+import serial
+
+from vsido.periodic import PeriodicTask
+
+
+class AccelerationSampler(PeriodicTask):
+    '''加速度センサー値を一定周期で取得してリングバッファに蓄積するクラス
+
+    バックグラウンドのスレッドで「加速度センサー値要求」を一定周期で送信し、
+    (通信路の使用率が予算を超えている間は、Connect.get_background_rate_scale()に従って周期を落とす)
+    (時刻, ax, ay, az)を事前に確保したリングバッファに格納する。
+    リングバッファは列ごとのarray('d')なので、窓単位の読み出しはスライスのコピーだけで済む。
+    cutoffを指定した場合は1次のローパスフィルタを通した値も合わせて格納する。
+    Connect(io_process=True)の場合は子プロセスで取得と格納を行い、読み出しは子プロセスのリングバッファから行う。
+
+    example:
+        sampler = vsido.AccelerationSampler(vc, rate=100, capacity=1000, cutoff=5)
+        sampler.start()
+        t, ax, ay, az = sampler.get_window(100, filtered=True)
+    '''
+
+    def __init__(self, connect, rate=100, capacity=1024, cutoff=None):
+        '''初期化処理
+
+        Args:
+            connect(Connect): 接続済みのV-Sido CONNECTのインスタンス
+            rate(Optional[int/float]): 1秒あたりの取得回数(省略した場合は100Hz)
+            capacity(Optional[int]): リングバッファに保持するサンプル数(省略した場合は1024)
+            cutoff(Optional[int/float]): ローパスフィルタのカットオフ周波数(Hz)(省略した場合はフィルタなし)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        super().__init__(rate, connect.get_clock())
+        if not isinstance(capacity, int):
+            raise ValueError('capacity must be int')
+        if not capacity > 0:
+            raise ValueError('capacity must be bigger than 0')
+        if cutoff is not None:
+            if not (isinstance(cutoff, int) or isinstance(cutoff, float)):
+                raise ValueError('cutoff must be int or float')
+            if not 0 < cutoff < rate / 2:
+                raise ValueError('cutoff must be 0 - rate / 2')
+        self._connect = connect
+        self._capacity = capacity
+        self._cutoff = cutoff
+        # ローパスフィルタの時定数(フィルタの係数は、周期を落とした場合に合わせて前回のサンプルからの経過時間で求める)
+        self._rc = 1.0 / (2 * math.pi * cutoff) if cutoff is not None else None
+        # 列ごとにバッファを確保する(時刻, ax, ay, az, フィルタ後のax, ay, az)
+        self._columns = tuple(array.array('d', bytes(8 * capacity)) for i in range(0, 7))
+        self._filtered = None
+        self._filtered_time = None
+        self._write_pos = 0
+        self._sample_count = 0
+        self._dropped_count = 0
+        self._buffer_lock = threading.Lock()
+        self._remote = connect._create_remote_task('AccelerationSampler', {'rate':rate, 'capacity':capacity, 'cutoff':cutoff})
+
+    def get_capacity(self):
+        '''リングバッファに保持できるサンプル数を返す
+        '''
+        return self._capacity
+
+    def get_sample_count(self):
+        '''開始してから格納したサンプル数を返す
+        '''
+        if self._remote is not None:
+            return self._remote.call('get_sample_count')
+        return self._sample_count
+
+    def get_dropped_count(self):
+        '''取得できなかったサンプル数(タイムアウトと周期遅れによる実行の飛ばし)を返す
+        '''
+        if self._remote is not None:
+            return self._remote.call('get_dropped_count')
+        return self._dropped_count + self._overrun_count
+
+    def clear(self):
+        '''リングバッファの内容と各カウンタのクリア
+        '''
+        if self._remote is not None:
+            self._remote.call('clear')
+            return
+        with self._buffer_lock:
+            self._write_pos = 0
+            self._sample_count = 0
+            self._dropped_count = 0
+            self._overrun_count = 0
+            self._filtered = None
+
+    def get_latest(self, filtered=False):
+        '''最新のサンプルを返す
+
+        Args:
+            filtered(Optional[bool]): ローパスフィルタ後の値を返すかどうか(省略した場合はフィルタ前の値)
+
+        Returns:
+            dict: 加速度センサー値の辞書データ(まだサンプルがない場合はNone)
+                example:
+                {'time': 1437557212.52, 'ax': 125, 'ay': 158, 'az': 118}
+        '''
+        t, ax, ay, az = self.get_window(1, filtered=filtered)
+        if len(t) == 0:
+            return None
+        return {'time':t[0], 'ax':ax[0], 'ay':ay[0], 'az':az[0]}
+
+    def get_window(self, length=None, filtered=False):
+        '''直近のサンプルを時系列順にまとめて返す
+
+        Args:
+            length(Optional[int]): 取得するサンプル数(省略した場合はバッファ内の全サンプル)
+            filtered(Optional[bool]): ローパスフィルタ後の値を返すかどうか(省略した場合はフィルタ前の値)
+
+        Returns:
+            tuple: 時刻、ax、ay、azそれぞれのarray('d')のタプル(古い順)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if self._remote is not None:
+            return self._remote.call('get_window', length, filtered=filtered)
+        if length is not None:
+            if not isinstance(length, int):
+                raise ValueError('length must be int')
+            if not length >= 0:
+                raise ValueError('length must be 0 or more')
+        if not isinstance(filtered, bool):
+            raise ValueError('filtered must be bool')
+        if filtered and self._rc is None:
+            raise ValueError('cutoff is not set')
+        columns = self._columns
+        column_indexes = (0, 4, 5, 6) if filtered else (0, 1, 2, 3)
+        with self._buffer_lock:
+            stored = min(self._sample_count, self._capacity)
+            if length is None or length > stored:
+                length = stored
+            start = self._write_pos - length
+            if start >= 0:
+                return tuple(columns[i][start:self._write_pos] for i in column_indexes)
+            # バッファの末尾をまたぐ場合は2つのスライスをつなげる
+            return tuple(columns[i][start:] + columns[i][:self._write_pos] for i in column_indexes)
+
+    def _store(self, sample_time, ax, ay, az):
+        '''サンプルをリングバッファに格納
+        '''
+        if self._rc is None:
+            fax, fay, faz = ax, ay, az
+        elif self._filtered is None:
+            fax, fay, faz = self._filtered = (ax, ay, az)
+            self._filtered_time = sample_time
+        else:
+            elapsed = max(0.0, sample_time - self._filtered_time)
+            alpha = elapsed / (self._rc + elapsed)
+            self._filtered_time = sample_time
+            prev = self._filtered
+            fax = prev[0] + alpha * (ax - prev[0])
+            fay = prev[1] + alpha * (ay - prev[1])
+            faz = prev[2] + alpha * (az - prev[2])
+            self._filtered = (fax, fay, faz)
+        with self._buffer_lock:
+            pos = self._write_pos
+            columns = self._columns
+            columns[0][pos] = sample_time
+            columns[1][pos] = ax
+            columns[2][pos] = ay
+            columns[3][pos] = az
+            columns[4][pos] = fax
+            columns[5][pos] = fay
+            columns[6][pos] = faz
+            self._write_pos = (pos + 1) % self._capacity
+            self._sample_count += 1
+
+    def _get_rate_scale(self):
+        '''通信路が混んでいる間は、動作系の通信を優先するために取得レートを落とす
+        '''
+        return self._connect.get_background_rate_scale()
+
+    def _tick(self, now):
+        '''周期ごとの加速度センサー値取得
+        '''
+        try:
+            acceleration_data = self._connect.get_acceleration(timeout=self._period)
+        except (TimeoutError, ConnectionError, ValueError, serial.SerialException):
+            self._dropped_count += 1
+            return
+        self._store(self._clock.time(), acceleration_data['ax'], acceleration_data['ay'], acceleration_data['az'])
@@ -0,0 +1,278 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ 複数基板の同時送信
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+import serial
+
+from vsido.connect import Connect
+
+# 基板間のずれの記録を保持する数(パーセンタイルの計算用)
+_SKEW_HISTORY = 1000
+# 予約の時刻からこれ以上遅れた送信を遅れとして数える(秒)
+_LATE_TOLERANCE = 0.001
+
+
+class _Release(object):
+    '''送信データを作成済みの、1回分の同時送信
+    '''
+    __slots__ = ('board_frames', 'board_angles')
+
+    def __init__(self, board_frames, board_angles):
+        # 基板ごとの送信データのリストと、(サーボIDの並び, 角度の並び)
+        self.board_frames = board_frames
+        self.board_angles = board_angles
+
+
+class BoardGroup(object):
+    '''サーボを複数のV-Sido CONNECTに分けて接続したロボットの、目標角度の同時送信を行うクラス
+
+    姿勢を基板ごとの分に分け、送信データを先に作っておき、送信時刻になったら1つのスレッドから全基板に続けて書き込む。
+    書き込む前に全基板の送信中のフレームが終わるのを待って送信の権利を得るので、
+    送信レーンに積まれた他のデータや送信中のフレームの後ろに並ぶことはなく、基板ごとに順に呼び出すよりずれが小さくなる。
+    基板ごとに書き込みを終えた時刻(実時間)の差をずれとして記録し、get_skew_stats()で返す。
+    時刻の管理には最初の基板のConnectの時計を使う。
+
+    example:
+        group = vsido.BoardGroup({'connect':vc_upper, 'sid_set':range(1, 13)}, {'connect':vc_lower, 'sid_set':range(13, 25)})
+        group.set_servo_angle({'sid':1, 'angle':10}, {'sid':13, 'angle':-10}, cycle_time=100)
+        group.schedule_servo_angle({'sid':2, 'angle':20}, {'sid':14, 'angle':-20}, deadline=group.get_clock().time() + 0.02)
+        print(group.get_skew_stats())
+    '''
+
+    def __init__(self, *board_set):
+        '''初期化処理
+
+        Args:
+            *board_set(dict): 基板の情報を書いた辞書データ
+                connect(Connect): 接続済みのV-Sido CONNECTのインスタンス(io_process=Trueのものは使えない)
+                sid_set(list/tuple/range): その基板に接続されているサーボID
+                example:
+                {'connect':vc_upper, 'sid_set':(1, 2, 3)}, {'connect':vc_lower, 'sid_set':(4, 5, 6)}
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not board_set:
+            raise ValueError('board_set must not be empty')
+        self._connects = []
+        self._sid_boards = {}
+        for board in board_set:
+            if not isinstance(board, dict):
+                raise ValueError('board_set must contain dict data')
+            if 'connect' not in board:
+                raise ValueError('missing connect in board_set')
+            if not isinstance(board['connect'], Connect):
+                raise ValueError('connect must be Connect')
+            if board['connect']._io_process:
+                # 送信スレッドを直接止めて書き込むので、送受信を子プロセスで行うConnectは使えない
+                raise ValueError('connect must not use io_process')
+            if board['connect'] in self._connects:
+                raise ValueError('connect must not be duplicated')
+            if 'sid_set' not in board:
+                raise ValueError('missing sid_set in board_set')
+            for sid in board['sid_set']:
+                if not isinstance(sid, int):
+                    raise ValueError('sid must be int')
+                if not 1 <= sid <= 254:
+                    raise ValueError('sid must be 1 - 254')
+                if sid in self._sid_boards:
+                    raise ValueError('sid ' + str(sid) + ' is assigned to more than one board')
+                self._sid_boards[sid] = len(self._connects)
+            self._connects.append(board['connect'])
+        self._clock = self._connects[0].get_clock()
+        self._lock = threading.Lock()
+        self._schedule = []
+        self._sequence = itertools.count()
+        self._wakeup = threading.Event()
+        self._scheduler_thread = None
+        self._scheduler_alive = False
+        self._skews = collections.deque(maxlen=_SKEW_HISTORY)
+        self._skew_stats = {'count':0, 'total':0.0, 'max':0.0, 'late_count':0, 'late_max':0.0}
+        self._send_error_count = 0
+
+    def get_clock(self):
+        '''時刻の管理に使う時計を返す
+        '''
+        return self._clock
+
+    def set_servo_angle(self, *angle_data_set, cycle_time=0):
+        '''全基板に「目標角度設定」をすぐに同時送信する
+
+        Args:
+            *angle_data_set(dict): サーボの角度情報を書いた辞書データ(Connect.set_servo_angle()と同じ形式)
+            cycle_time(Optional[int]): 目標角度に移行するまでの時間(範囲は0～1000msec)(省略した場合は0)
+
+        Raises:
+            ValueError: invalid argument
+            ConnectionError: V-Sido CONNECT is not connected
+        '''
+        release = self._prepare(angle_data_set, cycle_time)
+        self._release(release, self._clock.time())
+
+    def schedule_servo_angle(self, *angle_data_set, cycle_time=0, deadline=None):
+        '''全基板への「目標角度設定」の同時送信を予約する
+
+        送信データはこの時点で作成し、deadlineの時刻に送信スレッドから全基板に書き込む。
+        時刻が過ぎている予約はすぐに送信し、遅れとして記録する。
+
+        Args:
+            *angle_data_set(dict): サーボの角度情報を書いた辞書データ(Connect.set_servo_angle()と同じ形式)
+            cycle_time(Optional[int]): 目標角度に移行するまでの時間(範囲は0～1000msec)(省略した場合は0)
+            deadline(Optional[int/float]): 送信する時刻(get_clock().time()の値、省略した場合はすぐに送信する)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if deadline is not None and not (isinstance(deadline, int) or isinstance(deadline, float)):
+            raise ValueError('deadline must be int or float')
+        release = self._prepare(angle_data_set, cycle_time)
+        if deadline is None:
+            deadline = self._clock.time()
+        with self._lock:
+            heapq.heappush(self._schedule, (deadline, next(self._sequence), release))
+            if not self._scheduler_alive:
+                self._scheduler_alive = True
+                self._scheduler_thread = threading.Thread(target=self._scheduler)
+                self._scheduler_thread.daemon = True
+                self._scheduler_thread.start()
+        self._wakeup.set()
+
+    def cancel_schedule(self):
+        '''送信していない予約を全て取り消す
+        '''
+        with self._lock:
+            self._schedule = []
+
+    def close(self):
+        '''送信スレッドの停止(送信していない予約は取り消す)
+        '''
+        with self._lock:
+            self._schedule = []
+            self._scheduler_alive = False
+            scheduler_thread = self._scheduler_thread
+            self._scheduler_thread = None
+        self._wakeup.set()
+        if scheduler_thread is not None and scheduler_thread is not threading.current_thread():
+            scheduler_thread.join()
+
+    def get_skew_stats(self):
+        '''基板間のずれと送信の遅れの統計を返す
+
+        Returns:
+            dict: 統計の辞書データ(時間は秒)
+                count(int): 同時送信の回数
+                last(float): 最後の送信の、最初の基板と最後の基板の書き込みを終えた時刻の差
+                average(float): ずれの平均
+                p99(float): 直近1000回のずれの99パーセンタイル
+                max(float): ずれの最大値
+                late_count(int): 予約の時刻より1msec以上遅れて送信した回数
+                late_max(float): 予約の時刻からの遅れの最大値
+                send_error_count(int): 送信に失敗した回数
+        '''
+        with self._lock:
+            stats = dict(self._skew_stats)
+            skews = sorted(self._skews)
+            last = self._skews[-1] if self._skews else 0.0
+        return {
+            'count':stats['count'],
+            'last':last,
+            'average':stats['total'] / stats['count'] if stats['count'] > 0 else 0.0,
+            'p99':skews[min(len(skews) - 1, int(len(skews) * 0.99))] if skews else 0.0,
+            'max':stats['max'],
+            'late_count':stats['late_count'],
+            'late_max':stats['late_max'],
+            'send_error_count':self._send_error_count,
+        }
+
+    def _prepare(self, angle_data_set, cycle_time):
+        '''引数を検証し、基板ごとの送信データを作成する
+        '''
+        Connect._OPCODES['set_servo_angle'].validate(angle_data_set, cycle_time=cycle_time)
+        board_sid_sets = [[] for connect in self._connects]
+        board_angle_sets = [[] for connect in self._connects]
+        for angle_data in angle_data_set:
+            board_number = self._sid_boards.get(angle_data['sid'])
+            if board_number is None:
+                raise ValueError('sid ' + str(angle_data['sid']) + ' is not assigned to any board')
+            board_sid_sets[board_number].append(angle_data['sid'])
+            board_angle_sets[board_number].append(angle_data['angle'])
+        board_frames = []
+        board_angles = []
+        for connect, sid_set, angle_set in zip(self._connects, board_sid_sets, board_angle_sets):
+            board_frames.append([bytes(command_data) for command_data in connect._make_servo_angle_array_frames(sid_set, angle_set, cycle_time)] if sid_set else [])
+            board_angles.append((sid_set, angle_set))
+        return _Release(board_frames, board_angles)
+
+    def _release(self, release, deadline):
+        '''作成済みの送信データを全基板に続けて書き込み、ずれを記録する
+        '''
+        targets = [(connect, frames) for connect, frames in zip(self._connects, release.board_frames) if frames]
+        if not targets:
+            return
+        acquired = []
+        finish_times = []
+        try:
+            # 全基板の送信中のフレームが終わるのを待ってから、まとめて書き込む
+            for connect, frames in targets:
+                connect._acquire_transmitter()
+                acquired.append(connect)
+            release_time = self._clock.time()
+            for connect, frames in targets:
+                connect._write_acquired(frames, release_time)
+                finish_times.append(time.perf_counter())
+        finally:
+            for connect in acquired:
+                connect._release_transmitter()
+        for connect, frames, (sid_set, angle_set) in zip(self._connects, release.board_frames, release.board_angles):
+            if frames:
+                connect._record_servo_angle_array(sid_set, angle_set)
+        skew = finish_times[-1] - finish_times[0]
+        lateness = release_time - deadline
+        with self._lock:
+            self._skews.append(skew)
+            stats = self._skew_stats
+            stats['count'] += 1
+            stats['total'] += skew
+            if skew > stats['max']:
+                stats['max'] = skew
+            if lateness > _LATE_TOLERANCE:
+                stats['late_count'] += 1
+            if lateness > stats['late_max']:
+                stats['late_max'] = lateness
+
+    def _scheduler(self):
+        '''予約した同時送信を時刻順に送信するスレッドの処理
+        '''
+        clock = self._clock
+        while self._scheduler_alive:
+            with self._lock:
+                # 予約の確認より前に消しておき、確認後に入った予約の通知を取りこぼさないようにする
+                self._wakeup.clear()
+                if self._schedule:
+                    deadline, sequence, release = self._schedule[0]
+                    delay = deadline - clock.time()
+                    if delay <= 0:
+                        heapq.heappop(self._schedule)
+                else:
+                    deadline = None
+                    delay = None
+            if delay is not None and delay <= 0:
+                try:
+                    self._release(release, deadline)
+                except (ConnectionError, ValueError, serial.SerialException):
+                    self._send_error_count += 1
+                continue
+            if delay is None:
+                self._wakeup.wait()
+            else:
+                clock.wait(self._wakeup, delay)
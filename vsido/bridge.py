@@ -0,0 +1,279 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ TCPブリッジ
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import asyncio
+import collections
+import concurrent.futures
+import socket
+import threading
+
+import serial
+
+from vsido.connect import Connect, _FrameReader
+
+DEFAULT_BRIDGE_PORT = 55555
+
+
+class _BridgeClient(object):
+    '''ブリッジに接続しているクライアント
+    '''
+    __slots__ = ('reader', 'writer', 'write_lock', 'frames', 'readable', 'frame_reader', 'name')
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # レスポンスの書き込みと送信バッファが空くのを待つ処理を、クライアントごとに1つずつ行う
+        self.write_lock = asyncio.Lock()
+        self.frames = collections.deque()
+        # 送信待ちのフレームが多い間はクライアントからの読み込みを止める(スケジューラが減らしたらセットする)
+        self.readable = asyncio.Event()
+        self.readable.set()
+        self.frame_reader = _FrameReader()
+        self.name = writer.get_extra_info('peername')
+
+
+class Bridge(object):
+    '''1つのV-Sido CONNECTを複数のTCPクライアントで共有するためのブリッジ
+
+    シリアルポートを持つConnectのインスタンスを使い、TCPで接続してきた複数のクライアントのコマンドを送信する。
+    クライアントから受け取ったデータはライブラリと同じ方法でフレームに切り出し、クライアント間で1フレームずつ順番に送信する。
+    レスポンスが返ってくるコマンドは、送信元のクライアントにだけレスポンスを返す。
+    シリアルポートへの書き込みは専用のスレッドで行うので、書き込みの間もイベントループは他のクライアントの処理を続けられる。
+    送信待ちのフレームがクライアントごとの上限を超えると、そのクライアントからの読み込みを止めるので、
+    送信が追いつかないほど速く送ってくるクライアントがあっても、ブリッジのメモリは増え続けない(TCPの受信バッファで待たせる)。
+    クライアントからはConnect.open('socket://localhost:55555')のようにして接続できる。
+
+    example:
+        vc = vsido.Connect()
+        vc.open('COM3')
+        bridge = vsido.Bridge(vc)
+        bridge.start()
+    '''
+    # クライアントごとの送信待ちフレーム数の上限(1回の読み込みで切り出した分はまとめて積むので、その分だけ超えることがある)
+    _MAX_CLIENT_FRAMES = 16
+
+    def __init__(self, connect, host='127.0.0.1', port=DEFAULT_BRIDGE_PORT, response_timeout=1):
+        '''初期化処理
+
+        Args:
+            connect(Connect): 接続済みのV-Sido CONNECTのインスタンス
+            host(Optional[str]): 待ち受けるアドレス(省略した場合は'127.0.0.1')
+            port(Optional[int]): 待ち受けるポート番号(省略した場合は55555)
+            response_timeout(Optional[int/float]): レスポンスを待つ秒数(省略した場合は1秒)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not isinstance(connect, Connect):
+            raise ValueError('connect must be Connect')
+        if not isinstance(host, str):
+            raise ValueError('host must be str')
+        if not isinstance(port, int):
+            raise ValueError('port must be int')
+        if not 0 <= port <= 65535:
+            raise ValueError('port must be 0 - 65535')
+        if not (isinstance(response_timeout, int) or isinstance(response_timeout, float)):
+            raise ValueError('response_timeout must be int or float')
+        self._connect = connect
+        self._host = host
+        self._port = port
+        self._response_timeout = response_timeout
+        self._clients = []
+        self._loop = None
+        self._server = None
+        self._frames_ready = None
+        self._executor = None
+        self._thread = None
+        self._started = threading.Event()
+        self._start_error = None
+
+    def start(self):
+        '''バックグラウンドのスレッドでブリッジを開始
+
+        Raises:
+            OSError: 待ち受けを開始できなかった場合発生
+        '''
+        if self._thread is not None:
+            return
+        self._started.clear()
+        self._start_error = None
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait()
+        if self._start_error is not None:
+            self._thread.join()
+            self._thread = None
+            raise self._start_error
+
+    def stop(self):
+        '''ブリッジの停止
+        '''
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
+
+    def serve_forever(self):
+        '''ブリッジを開始し、stop()されるまで処理を続ける(呼び出したスレッドをブロックする)
+        '''
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        # 書き込みの順序を保つため、書き込み用のスレッドは1つにする
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            self._frames_ready = asyncio.Event()
+            try:
+                self._server = loop.run_until_complete(asyncio.start_server(self._handle_client, self._host, self._port))
+            except OSError as error:
+                self._start_error = error
+                self._started.set()
+                return
+            self._port = self._server.sockets[0].getsockname()[1]
+            scheduler = loop.create_task(self._scheduler())
+            self._started.set()
+            loop.run_forever()
+            scheduler.cancel()
+            self._server.close()
+            for client in list(self._clients):
+                client.writer.close()
+            loop.run_until_complete(self._server.wait_closed())
+        finally:
+            loop.close()
+            self._loop = None
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def get_port(self):
+        '''待ち受けているポート番号を返す(port=0で開始した場合は割り当てられた番号)
+        '''
+        return self._port
+
+    def get_client_count(self):
+        '''接続しているクライアント数を返す
+        '''
+        return len(self._clients)
+
+    async def _handle_client(self, reader, writer):
+        '''クライアントごとの受信処理
+        '''
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            # 小さなフレームをすぐに送るためにNagleアルゴリズムを止める
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _BridgeClient(reader, writer)
+        self._clients.append(client)
+        try:
+            while True:
+                await client.readable.wait()
+                data = await reader.read(4096)
+                if not data:
+                    break
+                frames = client.frame_reader.feed(data, self._loop.time())
+                if frames:
+                    client.frames.extend(frames)
+                    if len(client.frames) >= Bridge._MAX_CLIENT_FRAMES:
+                        client.readable.clear()
+                    self._frames_ready.set()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.remove(client)
+            client.frames.clear()
+            writer.close()
+
+    async def _scheduler(self):
+        '''クライアントのフレームを1つずつ順番にV-Sido CONNECTに送信する
+        '''
+        while True:
+            await self._frames_ready.wait()
+            self._frames_ready.clear()
+            while True:
+                # フレームのあるクライアントから1つずつ取り出したものを1回分として送る
+                commands = [(client, client.frames.popleft()) for client in list(self._clients) if client.frames]
+                if not commands:
+                    break
+                for client, command_data in commands:
+                    if len(client.frames) < Bridge._MAX_CLIENT_FRAMES:
+                        client.readable.set()
+                await self._forward_commands(commands)
+
+    async def _forward_commands(self, commands):
+        '''クライアントのフレームを順に送信し、レスポンスがあれば送信元に返すよう登録する
+
+        送信はシリアルポートへの書き込みを待つことがあるので、イベントループを止めないように書き込み用のスレッドで行う。
+        '''
+        pending_responses = await self._loop.run_in_executor(self._executor, self._write_commands, [command_data for client, command_data in commands])
+        for (client, command_data), pending_response in zip(commands, pending_responses):
+            if pending_response is not None:
+                self._loop.create_task(self._forward_response(client, pending_response))
+
+    def _write_commands(self, command_data_set):
+        '''フレームを順に送信し、それぞれのレスポンス待ちを返す(書き込み用のスレッドで呼ばれる)
+
+        通信量の予算で送信レーンに保留された場合も、次の回の分を積む前に送信し終えるのを待つので、
+        多くのフレームを送ってくるクライアントがいても、他のクライアントのフレームがその後ろに長く並ぶことはない。
+        '''
+        pending_responses = []
+        for command_data in command_data_set:
+            try:
+                pending_responses.append(self._connect._write_command(command_data, self._response_timeout))
+            except (ConnectionError, ValueError, serial.SerialException):
+                pending_responses.append(None)
+        self._connect._wait_transmit_idle(self._response_timeout)
+        return pending_responses
+
+    async def _forward_response(self, client, pending_response):
+        '''レスポンスを送信元のクライアントに返す
+        '''
+        try:
+            response_data = await asyncio.wait_for(asyncio.wrap_future(pending_response.future), self._response_timeout)
+        except (asyncio.TimeoutError, TimeoutError, ConnectionError, serial.SerialException):
+            return
+        if client not in self._clients:
+            return
+        async with client.write_lock:
+            try:
+                client.writer.write(bytes(response_data))
+                # 受け取りの遅いクライアントの送信バッファが際限なく増えないように、空くのを待つ
+                await client.writer.drain()
+            except ConnectionError:
+                pass
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+if __name__ == '__main__':
+
+    import sys
+
+    from vsido.connect import DEFAULT_BAUTRATE
+
+    DEFAULT_PORT = 'com3'
+
+    print('=== Python V-Sido Bridge ===')
+
+    # 引数からシリアルポートと待ち受けポートを決定する
+    serial_port = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PORT
+    bridge_port = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BRIDGE_PORT
+
+    vsidoconnect = Connect()
+    print('Connecting to robot...', end='')
+    try:
+        vsidoconnect.open(serial_port, DEFAULT_BAUTRATE)
+    except serial.SerialException:
+        print('fail.')
+        sys.exit(1)
+    print('done.')
+
+    print('listening on port %d (exit: Ctrl-C)' % bridge_port)
+    try:
+        Bridge(vsidoconnect, port=bridge_port).serve_forever()
+    except KeyboardInterrupt:
+        vsidoconnect.disconnect()
@@ -0,0 +1,215 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ 時計
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import concurrent.futures
+import threading
+import time
+
+# 仮想時計の待ちで、イベントの発生を確かめる間隔(実時間の秒)
+_POLL_INTERVAL = 0.01
+
+
+class SystemClock(object):
+    '''実時間の時計(Connect、PeriodicTaskの既定)
+
+    ライブラリの時刻の取得、周期処理の待ち、レスポンス待ちのタイムアウトはすべて時計を通して行う。
+    '''
+
+    def time(self):
+        '''現在時刻(秒)を返す
+        '''
+        return time.time()
+
+    def sleep(self, seconds):
+        '''指定した秒数だけ待つ
+        '''
+        time.sleep(seconds)
+
+    def wait(self, event, timeout):
+        '''イベントが発生するか、timeout秒過ぎるまで待つ
+
+        Args:
+            event(threading.Event): 待つイベント
+            timeout(int/float): 秒数
+
+        Returns:
+            bool: イベントが発生した場合はTrue
+        '''
+        return event.wait(timeout)
+
+    def wait_future(self, future, timeout):
+        '''Futureの結果を待つ
+
+        Args:
+            future(concurrent.futures.Future): 待つFuture
+            timeout(int/float): 秒数(Noneの場合は無制限)
+
+        Returns:
+            結果
+
+        Raises:
+            concurrent.futures.TimeoutError: timeout秒過ぎても結果が出ない場合発生
+        '''
+        return future.result(timeout)
+
+
+SYSTEM_CLOCK = SystemClock()
+
+
+class VirtualClock(SystemClock):
+    '''操作できる仮想時間の時計
+
+    Connect(clock=...)とPeriodicTaskに渡すと、時刻、周期処理の待ち、レスポンス待ちのタイムアウトが仮想時間で進む。
+    時間はadvance()かsleep()を呼んだスレッドが進める。進める時は、待っているスレッドの起床時刻を順にたどり、
+    起こしたスレッドが次の待ちに入る(または終了する)のを確かめてから次の起床時刻に進むので、
+    周期処理は実時間によらず予定どおりの順序と回数で実行される。
+    SimulatedBoardと組み合わせれば、長いシナリオを実時間よりはるかに速く実行できる。
+
+    レスポンスが返ってこない場合は、待っているスレッドが実時間でstall_timeout秒待った後に、
+    自分でタイムアウトの時刻まで時間を進める(時間を進めるスレッドが待っている場合に止まらないようにするため)。
+
+    example:
+        clock = vsido.VirtualClock()
+        board = vsido.SimulatedBoard(clock)
+        vc = vsido.Connect(clock=clock)
+        vc.connect(board)
+        blender = vsido.PoseBlender(vc, rate=50)
+        blender.start()
+        clock.sleep(600) # 10分間のシナリオを数秒で実行する
+    '''
+
+    def __init__(self, start=0.0, stall_timeout=1.0):
+        '''初期化処理
+
+        Args:
+            start(Optional[int/float]): 最初の時刻(秒、省略した場合は0)
+            stall_timeout(Optional[int/float]): 時間を進めるスレッドが、起こしたスレッドを待つ実時間の上限(秒、省略した場合は1秒)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not (isinstance(start, int) or isinstance(start, float)):
+            raise ValueError('start must be int or float')
+        if not (isinstance(stall_timeout, int) or isinstance(stall_timeout, float)):
+            raise ValueError('stall_timeout must be int or float')
+        if not stall_timeout > 0:
+            raise ValueError('stall_timeout must be bigger than 0')
+        self._now = float(start)
+        self._stall_timeout = stall_timeout
+        self._condition = threading.Condition()
+        # 待っているスレッド(待ちごとの識別子をキーにした(起床時刻, スレッド))
+        self._waiters = {}
+        self._advance_lock = threading.Lock()
+        self._advancing = False
+
+    def time(self):
+        '''現在の仮想時刻(秒)を返す
+        '''
+        return self._now
+
+    def sleep(self, seconds):
+        '''仮想時間をseconds秒進める(advance()と同じ)
+        '''
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        '''仮想時間をseconds秒進める
+
+        途中に起床時刻があるスレッドは、起床時刻の順に起こし、次の待ちに入るまで実行させる。
+        周期処理の_tick()の中からは呼ばないこと。
+
+        Args:
+            seconds(int/float): 進める秒数
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not (isinstance(seconds, int) or isinstance(seconds, float)):
+            raise ValueError('seconds must be int or float')
+        if not seconds >= 0:
+            raise ValueError('seconds must be 0 or more')
+        with self._advance_lock:
+            with self._condition:
+                self._advancing = True
+                try:
+                    target = self._now + seconds
+                    while True:
+                        due_set = [deadline for deadline, thread in self._waiters.values() if deadline <= target]
+                        self._now = max(self._now, min(due_set) if due_set else target)
+                        woken_threads = set(thread for deadline, thread in self._waiters.values() if deadline <= self._now)
+                        self._condition.notify_all()
+                        self._settle(woken_threads)
+                        if not due_set:
+                            break
+                finally:
+                    self._advancing = False
+
+    def wait(self, event, timeout):
+        '''イベントが発生するか、仮想時間でtimeout秒過ぎるまで待つ
+        '''
+        if event.is_set():
+            return True
+        if timeout is None:
+            return event.wait()
+        return self._wait_until(event.is_set, timeout, False)
+
+    def wait_future(self, future, timeout):
+        '''Futureの結果を、仮想時間でtimeout秒まで待つ
+        '''
+        if not future.done() and timeout is not None:
+            future.add_done_callback(self._notify)
+            if not self._wait_until(future.done, timeout, True):
+                raise concurrent.futures.TimeoutError()
+        return future.result(None)
+
+    def _notify(self, future=None):
+        with self._condition:
+            self._condition.notify_all()
+
+    def _wait_until(self, predicate, timeout, self_advance):
+        '''predicate()がTrueになるか、仮想時刻が起床時刻になるまで待つ
+        '''
+        token = object()
+        with self._condition:
+            deadline = self._now + timeout
+            if self._now >= deadline:
+                return predicate()
+            self._waiters[token] = (deadline, threading.current_thread())
+            # 時間を進めているスレッドに、このスレッドが待ちに入ったことを知らせる
+            self._condition.notify_all()
+            try:
+                stall_start = time.monotonic()
+                last_now = self._now
+                while not predicate():
+                    if self._now >= deadline:
+                        return False
+                    self._condition.wait(_POLL_INTERVAL)
+                    if not self._now == last_now or self._advancing:
+                        stall_start = time.monotonic()
+                        last_now = self._now
+                    elif self_advance and time.monotonic() - stall_start > self._stall_timeout:
+                        # 時間を進めるスレッドがいないので、自分でタイムアウトの時刻まで進める
+                        break
+                else:
+                    return True
+            finally:
+                del self._waiters[token]
+                self._condition.notify_all()
+        self.advance(max(0.0, deadline - self._now))
+        return predicate()
+
+    def _settle(self, woken_threads):
+        '''起こしたスレッドが次の待ちに入るか終了するまで待つ(_conditionのロック内で呼ぶ)
+        '''
+        stall_start = time.monotonic()
+        while woken_threads:
+            waiting_threads = set(thread for deadline, thread in self._waiters.values() if deadline > self._now)
+            woken_threads = set(thread for thread in woken_threads if thread.is_alive() and thread not in waiting_threads)
+            if not woken_threads or time.monotonic() - stall_start > self._stall_timeout:
+                return
+            self._condition.wait(_POLL_INTERVAL)
@@ -6,6 +6,12 @@ Copyright (c) 2015 Daisuke IMAI
 This software is released under the MIT License.
 http://opensource.org/licenses/mit-license.php
 '''
+import array
+import collections
+import concurrent.futures
+import json
+import math
+import os
 import sys
 import time
 import threading
@@ -13,7 +19,329 @@ import types
 
 import serial
 
+from vsido.opcodes import Field, OpcodeSpec, get_opcode, is_response_op, register_opcode, _decode_2bytes_array, _encode_2bytes_array
+from vsido.clock import SYSTEM_CLOCK, SystemClock
+from vsido.realtime import ThreadPolicy
+
 DEFAULT_BAUTRATE = 115200
+# サーボ一覧のキャッシュを置くディレクトリ
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.pyvsido')
+
+
+class LinkLostError(ConnectionError):
+    '''V-Sido CONNECTとの通信路が途中で切れたことを表す例外
+
+    シリアルポートの異常や無応答を検出した時点で、レスポンス待ちの呼び出しをこの例外ですぐに終了させる。
+    ウォッチドッグが再接続するまでの間に送信しようとした場合もこの例外が発生する。
+    '''
+    pass
+
+
+class _FrameReader(object):
+    '''受信データからV-Sido CONNECTのフレームを切り出す
+
+    ST(0xff)から始まり、LNで示された長さに達したところで1フレームとする。
+    フレームの途中で受信が途切れた場合は、LNから決まる時間が過ぎた時点で受信途中のデータを捨てる。
+    '''
+    __slots__ = ('_buffer', '_start', '_timeout')
+
+    _TIMEOUT_PER_BYTE = 0.05 # データ1Byte受信想定のタイムアウト値で、実際には1Byteごとには行わない
+
+    def __init__(self):
+        self._buffer = []
+        self._start = 0.0
+        self._timeout = _FrameReader._TIMEOUT_PER_BYTE * 4 # 最低4Byteのデータが帰って来るのは確実なので、LNが拾えたタイミングで変更
+
+    def feed(self, data, now):
+        '''受信データを渡して、切り出せたフレームを返す
+
+        Args:
+            data(bytes): 受信データ
+            now(float): 受信時刻
+
+        Returns:
+            list: 切り出せたフレーム(intのリスト)のリスト
+        '''
+        frames = []
+        receive_buffer = self._buffer
+        if len(receive_buffer) > 0 and now > self._start + self._timeout:
+            receive_buffer = []
+        for value in data:
+            receive_buffer.append(value)
+            if len(receive_buffer) == 1:
+                if receive_buffer[0] == 255:
+                    self._start = now
+                    self._timeout = _FrameReader._TIMEOUT_PER_BYTE * 4
+                else:
+                    receive_buffer = []
+            if len(receive_buffer) == 3:
+                self._timeout = _FrameReader._TIMEOUT_PER_BYTE * receive_buffer[2]
+            if len(receive_buffer) > 3:
+                if len(receive_buffer) == receive_buffer[2]:
+                    frames.append(receive_buffer)
+                    receive_buffer = []
+        self._buffer = receive_buffer
+        return frames
+
+
+class _FrameRing(object):
+    '''受信データからフレームを切り出し、あらかじめ確保したリングバッファに格納する
+
+    切り出しの規則は_FrameReaderと同じ。フレームごとに256Byteの区画を持つリングバッファに直接書き込み、
+    フレームは区画の読み出し専用のmemoryviewとして渡す。memoryviewは区画と長さごとに作ったものを使い回すので、
+    受信が続いても新しいオブジェクトをほとんど作らない。
+
+    渡したmemoryviewの内容は、その後slot_count - 1個のフレームを受信するまで有効で、
+    リングバッファが一周すると次のフレームで上書きされる。それより長く使う場合はbytes()やlist()で複製すること。
+    '''
+    __slots__ = ('_buffer', '_view', '_views', '_slot_count', '_slot', '_length', '_start', '_timeout')
+
+    _SLOT_SIZE = 256 # LNは最大255なので1フレームは必ず1区画に収まる
+
+    def __init__(self, slot_count=16):
+        self._buffer = bytearray(_FrameRing._SLOT_SIZE * slot_count)
+        self._view = memoryview(self._buffer).toreadonly()
+        self._views = [[None] * _FrameRing._SLOT_SIZE for i in range(0, slot_count)]
+        self._slot_count = slot_count
+        self._slot = 0
+        self._length = 0
+        self._start = 0.0
+        self._timeout = _FrameReader._TIMEOUT_PER_BYTE * 4
+
+    def feed(self, data, now, handler):
+        '''受信データを渡して、切り出せたフレームごとにhandlerを呼ぶ
+
+        Args:
+            data(bytes): 受信データ
+            now(float): 受信時刻
+            handler(function/method): フレーム(読み出し専用のmemoryview)を引数に呼ぶ関数
+        '''
+        buffer = self._buffer
+        offset = self._slot * _FrameRing._SLOT_SIZE
+        length = self._length
+        if length > 0 and now > self._start + self._timeout:
+            length = 0
+        pos = 0
+        size = len(data)
+        while pos < size:
+            if length == 0:
+                # STまで読み飛ばす
+                pos = data.find(b'\xff', pos)
+                if pos < 0:
+                    break
+                self._start = now
+                self._timeout = _FrameReader._TIMEOUT_PER_BYTE * 4
+            if length < 3:
+                buffer[offset + length] = data[pos]
+                length += 1
+                pos += 1
+                if length == 3:
+                    if buffer[offset + 2] < 4:
+                        # LNが4未満の壊れたフレームは捨てる
+                        length = 0
+                    else:
+                        self._timeout = _FrameReader._TIMEOUT_PER_BYTE * buffer[offset + 2]
+                continue
+            # LNまでの残りをまとめて区画に写す
+            count = min(buffer[offset + 2] - length, size - pos)
+            buffer[offset + length:offset + length + count] = data[pos:pos + count]
+            length += count
+            pos += count
+            if length == buffer[offset + 2]:
+                self._length = 0
+                handler(self._get_view(length))
+                self._slot = (self._slot + 1) % self._slot_count
+                offset = self._slot * _FrameRing._SLOT_SIZE
+                length = 0
+        self._length = length
+
+    def _get_view(self, length):
+        '''現在の区画の先頭からlengthByteのmemoryviewを返す(作成済みのものがあれば使い回す)
+        '''
+        views = self._views[self._slot]
+        view = views[length]
+        if view is None:
+            offset = self._slot * _FrameRing._SLOT_SIZE
+            view = self._view[offset:offset + length]
+            views[length] = view
+        return view
+
+
+class _LinkMeter(object):
+    '''通信路の使用率の計測
+
+    フレームの通信時間を、指定した時間幅で指数的に減衰させながら積算し、使用率を求める。
+    '''
+    __slots__ = ('_window', '_busy_time', '_last_time')
+
+    def __init__(self, window):
+        self._window = window
+        self._busy_time = 0.0
+        self._last_time = 0.0
+
+    def add(self, now, wire_time):
+        '''通信時間の積算
+        '''
+        self._decay(now)
+        self._busy_time += wire_time
+
+    def get_utilization(self, now):
+        '''使用率(0.0～)を返す
+        '''
+        self._decay(now)
+        return self._busy_time / self._window
+
+    def _decay(self, now):
+        elapsed = now - self._last_time
+        if elapsed > 0:
+            self._busy_time *= math.exp(-elapsed / self._window)
+            self._last_time = now
+
+
+class _RttEstimator(object):
+    '''レスポンスの往復時間の推定(OPごと)
+
+    RFC 6298と同じく、平滑化した往復時間(SRTT)とそのばらつき(RTTVAR)を更新し、
+    1回の送信でレスポンスを待つ時間をSRTT + 4 * RTTVARとする。
+    '''
+    __slots__ = ('srtt', 'rttvar', 'samples', 'retries', 'timeouts')
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        self.retries = 0
+        self.timeouts = 0
+
+    def add(self, rtt):
+        '''往復時間の計測値の追加
+        '''
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += (abs(self.srtt - rtt) - self.rttvar) / 4
+            self.srtt += (rtt - self.srtt) / 8
+        self.samples += 1
+
+    def get_timeout(self, initial_timeout, min_timeout):
+        '''1回の送信でレスポンスを待つ時間を返す(計測値がない場合はinitial_timeout)
+        '''
+        if self.srtt is None:
+            return initial_timeout
+        return max(min_timeout, self.srtt + 4 * self.rttvar)
+
+
+class _TransmitItem(object):
+    '''送信待ちのデータ
+    '''
+    __slots__ = ('command_data', 'pending_response', 'lane', 'queued_time')
+
+    def __init__(self, command_data, pending_response, lane, queued_time):
+        self.command_data = command_data
+        self.pending_response = pending_response
+        self.lane = lane
+        self.queued_time = queued_time
+
+
+class _ServoInfoBatch(object):
+    '''まとめて送信する「サーボ情報要求」
+
+    同時期に呼ばれたget_servo_info()の要求を集め、1フレームで送信してから呼び出し元ごとの結果に分ける。
+    '''
+    __slots__ = ('requests', 'command_length', 'response_length', 'ready')
+
+    def __init__(self):
+        self.requests = []
+        self.command_length = 4 # ST, OP, LN, SUM
+        self.response_length = 4
+        self.ready = threading.Event()
+
+    def fits(self, servo_data_set, max_length):
+        '''要求を追加しても1フレームに収まるかどうか
+        '''
+        command_length = self.command_length + 3 * len(servo_data_set)
+        response_length = self.response_length + sum(1 + servo_data['length'] for servo_data in servo_data_set)
+        return command_length <= max_length and response_length <= max_length
+
+    def add(self, servo_data_set, future):
+        self.requests.append((servo_data_set, future))
+        self.command_length += 3 * len(servo_data_set)
+        self.response_length += sum(1 + servo_data['length'] for servo_data in servo_data_set)
+
+
+class _PendingResponse(object):
+    '''レスポンス待ちの送信データ
+
+    レスポンスが返ってくるコマンドを送信するたびに作られ、OPごとの待ち行列に送信順に並ぶ。
+    '''
+    __slots__ = ('future', 'command_data', 'timeout', 'sent_time', 'expire_time', 'sample_rtt')
+
+    def __init__(self, command_data, timeout, sample_rtt=True):
+        self.future = concurrent.futures.Future()
+        self.command_data = command_data
+        self.timeout = timeout
+        self.sent_time = None
+        self.expire_time = None
+        # 往復時間の計測に使うかどうか(再送したデータは、どの送信へのレスポンスか分からないので使わない)
+        self.sample_rtt = sample_rtt
+
+    def set_sent_time(self, sent_time):
+        '''送信時刻の記録と、待ち行列での保持期限の設定
+        '''
+        self.sent_time = sent_time
+        self.expire_time = sent_time + self.timeout if self.timeout > 0 else float('inf')
+
+
+class _FrameCache(object):
+    '''作成済みの送信データを保持するLRUキャッシュ
+
+    キーはOPと、送信データに書き込む値に正規化した引数のタプルで、同じキーからは必ず同じ送信データができる。
+    送信データは書き換えられないようにbytesで保持する。
+    '''
+
+    def __init__(self, max_size):
+        self._frames = collections.OrderedDict()
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, make_command, *args, **kwargs):
+        '''キーに対応する送信データを返す(なければmake_commandで作って保持する)
+        '''
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                return frame
+            self.misses += 1
+        frame = bytes(make_command(*args, **kwargs))
+        if self._max_size > 0:
+            with self._lock:
+                self._frames[key] = frame
+                self._frames.move_to_end(key)
+                while len(self._frames) > self._max_size:
+                    self._frames.popitem(last=False)
+        return frame
+
+    def set_max_size(self, max_size):
+        with self._lock:
+            self._max_size = max_size
+            while len(self._frames) > max_size:
+                self._frames.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {'size':len(self._frames), 'max_size':self._max_size, 'hits':self.hits, 'misses':self.misses}
+
 
 class Connect(object):
     '''V-Sido CONNECTのためのクラス
@@ -35,16 +363,84 @@ class Connect(object):
     _COMMAND_OP_WALK = 0x74 # 't'
     _COMMAND_OP_ACCELERATION = 0x61 # 'a'
     _COMMAND_OP_ACK = 0x21 # '!'
+    _COMMAND_MAX_LENGTH = 254 # LNは1Byteで、0xffは使えない
+    _SERVO_INFO_LENGTH = 54 # サーボ情報のデータ長(アドレス0～53)
+    # コマンドの定義(クラス定義の後で定義表から登録する)
+    _OPCODES = {}
+    # 呼び出し元がタイムアウトした後も、遅れて届いたレスポンスを吸収するために待ち行列に残しておく時間(秒)
+    _RESPONSE_GRACE_TIME = 0.1
+    # 受信用リングバッファのフレーム数(post_receive_handlerに渡したフレームが上書きされるまでの受信数)
+    _RECEIVE_RING_SLOTS = 16
+    # 結果を待たない送信でレスポンスが返ってくる場合の待ち行列での保持時間(秒)
+    _DEFAULT_RESPONSE_TIMEOUT = 1
+    # 往復時間の計測値がない場合に、再送する情報要求が1回の送信でレスポンスを待つ時間(秒)
+    _INITIAL_RESPONSE_TIMEOUT = 0.25
+    # 送信データのキャッシュに保持するフレーム数の初期値
+    _FRAME_CACHE_SIZE = 256
+    # ウォッチドッグの再接続の最初の待ち時間(秒、失敗するごとに倍にする)
+    _RECONNECT_BACKOFF = 0.05
+    # 1フレームに入るサーボ数(LN最大254Byteから、ST、OP、LN、SUMの4Byteと、目標角度設定はCYCの1Byteを引いたもの)
+    _ANGLE_PER_FRAME = (254 - 5) // 3
+    _COMPLIANCE_PER_FRAME = (254 - 4) // 3
+    _MIN_MAX_PER_FRAME = (254 - 4) // 5
+
+    # 送信レーン(数字が小さいほど優先度が高く、フレームの切れ目で割り込む)
+    LANE_MOTION = 0 # 安全・動作系(停止、姿勢保持、歩行、IK)
+    LANE_CONTROL = 1 # 制御系(コンプライアンス、フィードバックID、VID、IO、PWM)
+    LANE_BACKGROUND = 2 # テレメトリ・設定系(各種情報要求、最大・最小角設定、フラッシュ書き込み)
+    _LANE_NUM = 3
+    # 1Byteあたりのビット数(スタートビット、8bitデータ、ストップビット)
+    _BITS_PER_BYTE = 10
+    # 使用率を計測する時間幅(秒)
+    _LINK_METER_WINDOW = 1.0
+    # 通信量が予算を超えた場合にライブラリのバックグラウンド取得を落とす下限の割合
+    _MIN_BACKGROUND_RATE_SCALE = 0.1
+    # バックグラウンド取得の割合を見直す間隔(秒)
+    _BACKGROUND_RATE_UPDATE_INTERVAL = 0.1
+    _OP_LANES = {
+        _COMMAND_OP_ANGLE: LANE_MOTION,
+        _COMMAND_OP_IK: LANE_MOTION,
+        _COMMAND_OP_WALK: LANE_MOTION,
+        _COMMAND_OP_COMPLIANCE: LANE_CONTROL,
+        _COMMAND_OP_FEEDBACK_ID: LANE_CONTROL,
+        _COMMAND_OP_SET_VID_VALUE: LANE_CONTROL,
+        _COMMAND_OP_GPIO: LANE_CONTROL,
+        _COMMAND_OP_PWM: LANE_CONTROL,
+    }
+
+    # シリアルポートごとのサーボ一覧のキャッシュ(discover_servos()で使う)
+    _servo_inventory_cache = {}
+
+    def __new__(cls, *args, **kwargs):
+        '''インスタンスの生成
+
+        io_process=Trueの場合は、送受信とその処理を子プロセスで行うProcessConnectのインスタンスを作る。
+        '''
+        io_process = kwargs.get('io_process', args[3] if len(args) > 3 else False)
+        if cls is Connect and io_process is True:
+            from vsido.io_process import ProcessConnect
+            return super().__new__(ProcessConnect)
+        return super().__new__(cls)
 
-    def __init__(self, post_receive_handler=None, post_send_handler=None, debug=False):
+    def __init__(self, post_receive_handler=None, post_send_handler=None, debug=False, io_process=False, io_thread_policy=None, clock=None):
         '''初期化処理
 
         インスタンス生成に伴う処理
 
         Args:
             post_receive_handler(function/method): 受信後実行する関数
+                (受信したフレームを読み出し専用のmemoryviewで渡す。内容は受信用リングバッファが一周するまで有効なので、
+                 それより長く保持する場合はbytes()やlist()で複製すること)
             post_send_handler(function/method): 送信後実行する関数
             debug(Optional[bool]): debag(送受信の履歴表示)モードはTrue、そうでない時はFalseを指定
+            io_process(Optional[bool]): 送受信とその処理を別プロセスで行う場合はTrueを指定
+                (アプリケーション側のスレッドの負荷で受信や送信が遅れるのを防ぐ。フレームの処理、レスポンス待ち、
+                 サーボ情報やIK情報の最新値の保持と、このConnectで作ったIKStream、AccelerationSamplerの周期処理を子プロセスで行い、
+                 最新値は共有メモリから読み出す。openのportはシリアルポート文字列のみで、clockは実時間のみ。省略した場合はFalse)
+            io_thread_policy(Optional[ThreadPolicy]): 受信スレッドと送信スレッド(io_processの場合は子プロセスの送受信スレッド)に
+                適用するCPUアフィニティとリアルタイム優先度(省略した場合は既定のまま)
+            clock(Optional[SystemClock]): 時刻の取得、レスポンス待ちのタイムアウト、ウォッチドッグの待ちに使う時計
+                (VirtualClockを渡すと仮想時間で動く。省略した場合は実時間)
 
         Raises:
             ValueError: invalid argument
@@ -54,6 +450,25 @@ class Connect(object):
             raise ValueError('debug must be bool')
         self._debug = debug
 
+        # 送受信を別プロセスで行うかどうかの設定
+        if not isinstance(io_process, bool):
+            raise ValueError('io_process must be bool')
+        self._io_process = io_process
+
+        # 時計
+        if clock is not None and not isinstance(clock, SystemClock):
+            raise ValueError('clock must be SystemClock or VirtualClock')
+        self._clock = clock if clock is not None else SYSTEM_CLOCK
+
+        # 送受信スレッドの実行設定と、適用結果(スレッドの役割ごと)
+        if io_thread_policy is not None and not isinstance(io_thread_policy, ThreadPolicy):
+            raise ValueError('io_thread_policy must be ThreadPolicy')
+        self._io_thread_policy = io_thread_policy
+        self._io_thread_status = {}
+        # 起床遅れの計測(JitterProbe.attach()で設定)
+        self._jitter_probe = None
+        self._jitter_name = 'receiver'
+
         # 送受信後に呼び出される関数の初期設定
         if post_receive_handler is not None:
             if not (isinstance(post_receive_handler, types.FunctionType) or isinstance(post_receive_handler, types.MethodType)):
@@ -64,8 +479,55 @@ class Connect(object):
         self._post_receive_handler = post_receive_handler or self._default_post_receive_handler
         self._post_send_handler = post_send_handler or self._default_post_send_handler
 
-        # 受信用のバッファ用意
-        self._response_waiting_buffer = []
+        # 送信の排他と、レスポンス待ちの待ち行列(OPごと)の用意
+        self._send_lock = threading.Lock()
+        self._pending_responses = {}
+
+        # OPごとの往復時間の推定と、情報要求の再送の設定
+        self._rtt_estimators = {}
+        self._query_max_retries = 2
+        self._query_min_timeout = 0.02
+
+        # 状態公開用の共有メモリ(publish_state()で作成)
+        self._state_publisher = None
+
+        # サーボ情報の写し(サーボIDごとに54Byteのデータと、Byteごとの受信時刻)
+        self._servo_mirror_lock = threading.Lock()
+
+        # 「サーボ情報要求」をまとめて送るための待ち時間(0の場合はまとめない)
+        self._servo_info_batch_window = 0
+        self._servo_info_batch_lock = threading.Lock()
+        self._servo_info_batch = None
+
+        # 同じ引数で繰り返し送る送信データのキャッシュ
+        self._frame_cache = _FrameCache(Connect._FRAME_CACHE_SIZE)
+
+        # 送信レーンの用意
+        self._tx_condition = threading.Condition()
+        self._tx_lanes = tuple(collections.deque() for i in range(0, Connect._LANE_NUM))
+        self._tx_busy = False
+        self._tx_alive = False
+        self._tx_stats = tuple({'queued':0, 'sent':0, 'wait_total':0.0, 'wait_max':0.0} for i in range(0, Connect._LANE_NUM))
+
+        # 通信路の使用率の計測と予算の用意
+        self._baudrate = DEFAULT_BAUTRATE
+        self._link_lock = threading.Lock()
+        self._link_budget = 0.9
+        self._tx_meters = tuple(_LinkMeter(Connect._LINK_METER_WINDOW) for i in range(0, Connect._LANE_NUM))
+        self._rx_meter = _LinkMeter(Connect._LINK_METER_WINDOW)
+        self._background_rate_scale = 1.0
+        self._background_rate_updated = 0.0
+
+        # ウォッチドッグ(start_watchdog()で開始)
+        self._watchdog_thread = None
+        self._watchdog_alive = False
+        self._watchdog_timeout = 0.1
+        self._watchdog_max_backoff = 1.0
+        self._watchdog_wakeup = threading.Event()
+        self._watchdog_stats = {'lost':0, 'recovered':0, 'reconnect_attempts':0, 'last_downtime':0.0}
+        self._link_lost = False
+        self._link_down = False
+        self._last_receive_time = 0.0
 
         # 接続状態などの保持値をクリア
         self._reset_values()
@@ -76,6 +538,13 @@ class Connect(object):
         self._connected = False
         self._firmware_version = None
         self._pwm_cycle = None
+        self._ik_state = {}
+        self._port = None
+        self._servo_settings = {}
+        self._servo_mirror = {}
+        self._feedback_sid_set = None
+        self._vid_settings = {}
+        self._last_angles = {}
 
     def _default_post_receive_handler(self, received_data):
         '''受信後処理のデフォルト関数
@@ -102,7 +571,7 @@ class Connect(object):
         色々なコマンドを投げる前にまず実行しなければならない。
 
         Args:
-            port(str): シリアルポート文字列
+            port(str/object): シリアルポート文字列、またはSimulatedBoardなどのシリアルポート互換のオブジェクト
                 Example: 'COM3', '/dev/tty.usbserial'
             baudrate(Optional[int]): 通信速度
 
@@ -111,12 +580,16 @@ class Connect(object):
         '''
         if not self._connected:
             try:
-                self._serial = serial.serial_for_url(port, baudrate, timeout=1)
+                self._serial = self._open_serial(port, baudrate)
+                self._baudrate = baudrate
+                self._port = port
             except serial.SerialException as error:
                 sys.stderr.write('could not open port %r: %s\n' % (port, error))
                 raise
+            self._last_receive_time = self._clock.time()
             self._connected = True
             self._start_receiver()
+            self._start_transmitter()
             while self._firmware_version is None:
                 try:
                     self._firmware_version = self.get_vid_version(timeout=1)
@@ -128,15 +601,31 @@ class Connect(object):
         '''
         self.open(port, baudrate)
 
+    def _open_serial(self, port, baudrate):
+        '''シリアルポートを開く
+        '''
+        if not isinstance(port, str):
+            # SimulatedBoardなどのシリアルポート互換のオブジェクトはそのまま使う
+            port.open()
+            return port
+        return serial.serial_for_url(port, baudrate, timeout=1)
+
     def close(self):
         '''V-Sido CONNECTからの切断
 
         V-Sido CONNECTと接続しているシリアルポートを明示的に閉じ切断する。
         シリアルポートは通常はプログラムが終了した時に自動的に閉じる。
         '''
-        if self._connected:
+        self.stop_watchdog()
+        if self._connected or self._link_down:
+            with self._send_lock:
+                self._connected = False
+            self._link_down = False
+            self._link_lost = False
+            self._stop_transmitter()
             self._stop_receiver()
             self._serial.close()
+            self._fail_pending_responses(ConnectionError('V-Sido CONNECT is not connected'))
             self._reset_values()
 
     def disconnect(self):
@@ -154,6 +643,34 @@ class Connect(object):
         '''
         return self._connected
 
+    def get_clock(self):
+        '''時計を返す(周期処理のクラスはこの時計を使う)
+        '''
+        return self._clock
+
+    def _create_remote_task(self, class_name, kwargs):
+        '''周期処理を子プロセスで動かす場合は、その呼び出し口を返す
+
+        io_processの場合だけ子プロセスで周期処理(IKStream、AccelerationSampler)を作る。
+        それ以外の場合は周期処理をこのプロセスで動かすのでNoneを返す。
+        '''
+        return None
+
+    def get_io_thread_status(self):
+        '''送受信スレッドへのio_thread_policyの適用結果を返す
+
+        Returns:
+            dict: スレッドの役割('receiver'、'transmitter')をキーにした、ThreadPolicy.apply()の結果
+                (io_thread_policyを指定していない場合は空)
+        '''
+        return dict(self._io_thread_status)
+
+    def _apply_io_thread_policy(self, role):
+        '''呼び出したスレッドにio_thread_policyを適用する
+        '''
+        if self._io_thread_policy is not None:
+            self._io_thread_status[role] = self._io_thread_policy.apply()
+
     def _start_receiver(self):
         '''受信スレッドの立ち上げ
         '''
@@ -162,44 +679,653 @@ class Connect(object):
         self._receiver_thread.setDaemon(True)
         self._receiver_thread.start()
 
-    def _stop_receiver(self):
+    def _stop_receiver(self, timeout=None):
         '''受信スレッドの停止
         '''
         self._receiver_alive = False
-        self._receiver_thread.join()
+        if hasattr(self._serial, 'cancel_read'):
+            # 読み込みのタイムアウトを待たずに受信スレッドを抜けさせる
+            try:
+                self._serial.cancel_read()
+            except (serial.SerialException, OSError):
+                pass
+        self._receiver_thread.join(timeout)
+
+    def _start_transmitter(self):
+        '''送信スレッドの立ち上げ
+        '''
+        self._tx_alive = True
+        self._transmitter_thread = threading.Thread(target=self._transmitter)
+        self._transmitter_thread.daemon = True
+        self._transmitter_thread.start()
+
+    def _stop_transmitter(self):
+        '''送信スレッドの停止(送信待ちのデータは破棄する)
+        '''
+        with self._tx_condition:
+            self._tx_alive = False
+            dropped_items = []
+            for lane_items in self._tx_lanes:
+                dropped_items.extend(lane_items)
+                lane_items.clear()
+            self._tx_condition.notify_all()
+        self._transmitter_thread.join()
+        for item in dropped_items:
+            if item.pending_response is not None and not item.pending_response.future.done():
+                item.pending_response.future.set_exception(ConnectionError('V-Sido CONNECT is not connected'))
+
+    def _transmitter(self):
+        '''送信スレッドの処理
+
+        優先度の高いレーンから1フレームずつ取り出して送信する。
+        '''
+        self._apply_io_thread_policy('transmitter')
+        while True:
+            with self._tx_condition:
+                item = self._pop_transmit_item()
+                while item is None:
+                    if not self._tx_alive:
+                        return
+                    # 予算超過で保留しているデータがあれば、使用率が下がるまでの時間だけ待つ
+                    self._tx_condition.wait(self._get_budget_wait_time())
+                    item = self._pop_transmit_item()
+                self._tx_busy = True
+            try:
+                self._transmit(item)
+            except (ConnectionError, ValueError, serial.SerialException):
+                # 例外はレスポンス待ちに渡してあるので、送信スレッドは止めずに続ける
+                pass
+            finally:
+                with self._tx_condition:
+                    self._tx_busy = False
+                    self._tx_condition.notify_all()
+
+    def _pop_transmit_item(self):
+        '''優先度の高いレーンから送信待ちデータを1つ取り出す(_tx_conditionのロック内で呼ぶこと)
+        '''
+        if self._tx_busy:
+            return None
+        for lane, lane_items in enumerate(self._tx_lanes):
+            if lane_items:
+                if lane == Connect.LANE_BACKGROUND and self._is_over_budget():
+                    # バックグラウンドのデータだけは予算を超えている間は送らない
+                    return None
+                return lane_items.popleft()
+        return None
+
+    def get_wire_time(self, length):
+        '''指定したByte数のデータを送受信するのにかかる時間(秒)を返す
+
+        Args:
+            length(int): データのByte数
+
+        Returns:
+            float: 現在の通信速度での通信時間(秒)
+        '''
+        return length * Connect._BITS_PER_BYTE / self._baudrate
+
+    def set_link_budget(self, budget):
+        '''通信路の使用率の予算の設定
+
+        送信、受信いずれかの使用率が予算を超えている間は、バックグラウンドのレーンのデータの送信を保留する。
+        動作系、制御系のレーンのデータは予算に関わらず送信する。
+
+        Args:
+            budget(int/float): 使用率の予算(範囲は0.1～1.0、初期値は0.9)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not (isinstance(budget, int) or isinstance(budget, float)):
+            raise ValueError('budget must be int or float')
+        if not 0.1 <= budget <= 1.0:
+            raise ValueError('budget must be 0.1 - 1.0')
+        self._link_budget = budget
+        with self._tx_condition:
+            self._tx_condition.notify_all()
+
+    def get_link_stats(self):
+        '''通信路の使用率を返す
+
+        Returns:
+            dict: 通信路の使用率の辞書データ
+                baudrate(int): 通信速度
+                budget(float): 使用率の予算
+                tx(float): 送信の使用率
+                tx_lanes(tuple): 送信レーンごとの使用率
+                rx(float): 受信の使用率
+                background_rate_scale(float): バックグラウンド取得の周期に掛かっている割合
+        '''
+        now = self._clock.time()
+        with self._link_lock:
+            tx_lanes = tuple(meter.get_utilization(now) for meter in self._tx_meters)
+            rx = self._rx_meter.get_utilization(now)
+        return {
+            'baudrate':self._baudrate,
+            'budget':self._link_budget,
+            'tx':sum(tx_lanes),
+            'tx_lanes':tx_lanes,
+            'rx':rx,
+            'background_rate_scale':self._background_rate_scale,
+        }
+
+    def get_background_rate_scale(self):
+        '''ライブラリのバックグラウンド取得の周期に掛ける割合を返す
+
+        使用率が予算を超えている間は割合を下げ、余裕ができると少しずつ1.0に戻す。
+        AccelerationSamplerなどライブラリの周期取得は、この割合で取得レートを落とす。
+
+        Returns:
+            float: 割合(範囲は0.1～1.0)
+        '''
+        now = self._clock.time()
+        if now - self._background_rate_updated >= Connect._BACKGROUND_RATE_UPDATE_INTERVAL:
+            self._background_rate_updated = now
+            utilization = self._get_utilization(now)
+            if utilization > self._link_budget:
+                self._background_rate_scale = max(Connect._MIN_BACKGROUND_RATE_SCALE, self._background_rate_scale * 0.7)
+            elif utilization < self._link_budget * 0.8:
+                self._background_rate_scale = min(1.0, self._background_rate_scale + 0.1)
+        return self._background_rate_scale
+
+    def _get_utilization(self, now):
+        '''送信、受信のうち大きい方の使用率を返す
+        '''
+        with self._link_lock:
+            tx = 0.0
+            for meter in self._tx_meters:
+                tx += meter.get_utilization(now)
+            return max(tx, self._rx_meter.get_utilization(now))
+
+    def _is_over_budget(self):
+        '''使用率が予算を超えているかどうか
+        '''
+        return self._get_utilization(self._clock.time()) > self._link_budget
+
+    def _get_budget_wait_time(self):
+        '''保留中のバックグラウンドのデータが送れるようになるまでの時間(秒)を返す(_tx_conditionのロック内で呼ぶこと)
+
+        保留中のデータがない場合はNoneを返す。
+        '''
+        if self._tx_busy or not self._tx_lanes[Connect.LANE_BACKGROUND]:
+            return None
+        utilization = self._get_utilization(self._clock.time())
+        if utilization <= self._link_budget:
+            return 0.001
+        # 使用率は指数的に減衰するので、予算まで下がるまでの時間を求める
+        return max(0.001, Connect._LINK_METER_WINDOW * math.log(utilization / self._link_budget))
+
+    def set_frame_cache_size(self, max_size):
+        '''送信データのキャッシュに保持するフレーム数の設定
+
+        目標角度設定、歩行、各種情報要求などは、送信データに書き込む値が同じであれば作成済みのフレームを使い回す。
+
+        Args:
+            max_size(int): 保持するフレーム数(0の場合はキャッシュしない、初期値は256)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not isinstance(max_size, int):
+            raise ValueError('max_size must be int')
+        if not max_size >= 0:
+            raise ValueError('max_size must be 0 or more')
+        self._frame_cache.set_max_size(max_size)
+
+    def get_frame_cache_stats(self):
+        '''送信データのキャッシュの統計を返す
+
+        Returns:
+            dict: 統計の辞書データ
+                size(int): 保持しているフレーム数
+                max_size(int): 保持するフレーム数の上限
+                hits(int): キャッシュのフレームを使った回数
+                misses(int): フレームを作成した回数
+        '''
+        return self._frame_cache.get_stats()
+
+    def clear_frame_cache(self):
+        '''送信データのキャッシュと統計のクリア
+        '''
+        self._frame_cache.clear()
+
+    def get_tx_lane_stats(self):
+        '''送信レーンごとの統計情報を返す
+
+        Returns:
+            tuple: レーンごとの統計情報の辞書データ(LANE_MOTION, LANE_CONTROL, LANE_BACKGROUNDの順)
+                depth(int): 現在の送信待ち数
+                queued(int): 送信を受け付けた数
+                sent(int): 送信した数
+                wait_average(float): 送信待ち時間の平均(秒)
+                wait_max(float): 送信待ち時間の最大(秒)
+        '''
+        lane_stats = tuple()
+        with self._tx_condition:
+            for lane in range(0, Connect._LANE_NUM):
+                stats = self._tx_stats[lane]
+                lane_stats += ({
+                    'lane':lane,
+                    'depth':len(self._tx_lanes[lane]),
+                    'queued':stats['queued'],
+                    'sent':stats['sent'],
+                    'wait_average':stats['wait_total'] / stats['sent'] if stats['sent'] > 0 else 0.0,
+                    'wait_max':stats['wait_max'],
+                },)
+        return lane_stats
+
+    def set_query_retry(self, max_retries=2, min_timeout=0.02):
+        '''情報要求の再送の設定
+
+        get_servo_info()、get_vid_value()、get_ik()、get_acceleration()は、レスポンスが返ってこない場合に
+        呼び出し元のtimeoutの範囲内で同じデータを再送する。
+        1回の送信でレスポンスを待つ時間はOPごとの往復時間の推定から求め、再送するたびに倍にする。
+
+        Args:
+            max_retries(Optional[int]): 再送の最大回数(0の場合は再送せずにtimeout秒待つ、省略した場合は2回)
+            min_timeout(Optional[int/float]): 1回の送信でレスポンスを待つ時間の下限(秒、省略した場合は0.02秒)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not isinstance(max_retries, int):
+            raise ValueError('max_retries must be int')
+        if not max_retries >= 0:
+            raise ValueError('max_retries must be 0 or more')
+        if not (isinstance(min_timeout, int) or isinstance(min_timeout, float)):
+            raise ValueError('min_timeout must be int or float')
+        if not min_timeout > 0:
+            raise ValueError('min_timeout must be bigger than 0')
+        self._query_max_retries = max_retries
+        self._query_min_timeout = min_timeout
+
+    def get_response_stats(self):
+        '''OPごとのレスポンスの往復時間の推定と、再送、タイムアウトの回数を返す
+
+        Returns:
+            dict: OPの文字('d'、'g'など)をキーにした統計の辞書データ(時間は秒)
+                srtt(float): 平滑化した往復時間(計測値がない場合はNone)
+                rttvar(float): 往復時間のばらつき(計測値がない場合はNone)
+                timeout(float): 再送する情報要求が次に1回の送信でレスポンスを待つ時間
+                samples(int): 往復時間の計測数
+                retries(int): 再送した回数
+                timeouts(int): 呼び出し元にタイムアウトを返した回数
+        '''
+        response_stats = {}
+        with self._send_lock:
+            for op, estimator in self._rtt_estimators.items():
+                response_stats[chr(op)] = {
+                    'srtt':estimator.srtt,
+                    'rttvar':estimator.rttvar,
+                    'timeout':estimator.get_timeout(Connect._INITIAL_RESPONSE_TIMEOUT, self._query_min_timeout),
+                    'samples':estimator.samples,
+                    'retries':estimator.retries,
+                    'timeouts':estimator.timeouts,
+                }
+        return response_stats
+
+    def _get_rtt_estimator(self, op):
+        '''OPの往復時間の推定を返す(_send_lockのロック内で呼ぶこと)
+        '''
+        estimator = self._rtt_estimators.get(op)
+        if estimator is None:
+            estimator = _RttEstimator()
+            self._rtt_estimators[op] = estimator
+        return estimator
 
     def _receiver(self):
         '''受信スレッドの処理
         '''
-        receive_buffer = []
-        timeout_par_byte = 0.05 #データ1Byte受信想定のタイムアウト値で、実際には1Byteごとには行わない
-        timeout = timeout_par_byte * 4 # 最低4Byteのデータが帰って来るのは確実なので、下でLNが拾えたタイミングで変更
-        receive_start = time.time()
+        # 再接続後に古いスレッドが新しいシリアルポートを読まないように、開始時のポートだけを使う
+        serial_port = self._serial
+        self._apply_io_thread_policy('receiver')
+        frame_ring = _FrameRing(Connect._RECEIVE_RING_SLOTS)
+        handle_received_frame = self._handle_received_frame
+        read_timeout = getattr(serial_port, 'timeout', None)
         try:
-            while self._receiver_alive:
-                if len(receive_buffer) > 0 and time.time() > receive_start + timeout:
-                    receive_buffer = []
-                data = self._serial.read(1)
+            while self._receiver_alive and self._serial is serial_port:
+                jitter_probe = self._jitter_probe
+                if jitter_probe is None or read_timeout is None:
+                    data = serial_port.read(max(1, serial_port.in_waiting))
+                else:
+                    read_start = time.time()
+                    data = serial_port.read(max(1, serial_port.in_waiting))
+                    if len(data) == 0:
+                        # データがなくタイムアウトした場合は、タイムアウト値を超えて待った分が起床遅れ
+                        jitter_probe._record(self._jitter_name, time.time() - read_start - read_timeout)
                 if len(data) > 0:
-                    receive_buffer.append(int.from_bytes(data, byteorder='big'))
-                    if len(receive_buffer) == 1:
-                        if receive_buffer[0] == 255:
-                            receive_start = time.time()
-                            timeout = timeout_par_byte * 4
-                        else:
-                            receive_buffer = []
-                    if len(receive_buffer) == 3:
-                        timeout = timeout_par_byte * receive_buffer[2]
-                    if len(receive_buffer) > 3:
-                        if len(receive_buffer) == receive_buffer[2]:
-                            if not receive_buffer[1] == Connect._COMMAND_OP_ACK:
-                                # ackじゃなかった場合はレスポンス待ちのデータということで格納する
-                                self._response_waiting_buffer = receive_buffer
-                            self._post_receive_handler(receive_buffer)
-                            receive_buffer = []
-        except serial.SerialException:
+                    frame_ring.feed(data, self._clock.time(), handle_received_frame)
+        except (serial.SerialException, OSError) as error:
+            if not self._receiver_alive or self._serial is not serial_port:
+                # 停止のためにポートを閉じた場合
+                return
             self._receiver_alive = False
-            raise
+            self._notify_link_lost(error)
+            if not self._watchdog_alive:
+                raise
+
+    def _handle_received_frame(self, receive_data):
+        '''受信したフレームの処理
+
+        receive_dataは受信用リングバッファの読み出し専用のmemoryviewで、この処理の間だけ使う。
+        別のスレッドに渡すものや保持するもの(レスポンス待ち、IK情報)だけをその場で複製する。
+        '''
+        pending_response = None
+        if not receive_data[1] == Connect._COMMAND_OP_ACK:
+            # ackじゃなかった場合はレスポンス待ちの送信元に渡す
+            pending_response = self._dispatch_response(receive_data)
+        if receive_data[1] == Connect._COMMAND_OP_IK:
+            # IK情報は待ち受けの有無に関わらずKIDごとの最新値として保持する
+            self._update_ik_state(list(receive_data))
+        register_data = None
+        if pending_response is not None and (receive_data[1] == Connect._COMMAND_OP_SERVO_INFO or receive_data[1] == Connect._COMMAND_OP_GET_FEEDBACK):
+            # 誰の要求に対するレスポンスでもサーボ情報の写しを更新する
+            try:
+                register_data = self._iter_servo_register_data(pending_response.command_data, receive_data)
+            except (ValueError, IndexError):
+                register_data = None
+            if register_data:
+                self._update_servo_mirror(register_data, self._clock.time())
+        if self._state_publisher is not None:
+            self._publish_received_state(receive_data, register_data)
+        received_time = self._clock.time()
+        self._last_receive_time = received_time
+        with self._link_lock:
+            self._rx_meter.add(received_time, self.get_wire_time(len(receive_data)))
+        self._post_receive_handler(receive_data)
+
+    def start_watchdog(self, timeout=0.1, max_backoff=1):
+        '''通信路の監視と自動再接続の開始
+
+        受信スレッドや送信でシリアルポートの異常を検出した場合はすぐに、
+        timeout秒間何も受信しない場合は確認のための「VID要求」を送り、さらにtimeout秒応答がなければ通信路が切れたと判断する。
+        切れたと判断した時点でレスポンス待ちの呼び出しをLinkLostErrorで終了させ、
+        シリアルポートを開き直す(失敗した場合は待ち時間を倍にしながらmax_backoff秒まで延ばして繰り返す)。
+        再接続後は、接続中に送信したVID設定、サーボの設定値、フィードバックID、最後の目標角度を送り直す。
+
+        Args:
+            timeout(Optional[int/float]): 無応答を切断とみなす秒数(省略した場合は0.1秒)
+            max_backoff(Optional[int/float]): 再接続を繰り返す間隔の最大秒数(省略した場合は1秒)
+
+        Raises:
+            ValueError: invalid argument
+            ConnectionError: V-Sido CONNECT is not connected
+        '''
+        if not (isinstance(timeout, int) or isinstance(timeout, float)):
+            raise ValueError('timeout must be int or float')
+        if not timeout > 0:
+            raise ValueError('timeout must be bigger than 0')
+        if not (isinstance(max_backoff, int) or isinstance(max_backoff, float)):
+            raise ValueError('max_backoff must be int or float')
+        if not max_backoff >= Connect._RECONNECT_BACKOFF:
+            raise ValueError('max_backoff must be ' + str(Connect._RECONNECT_BACKOFF) + ' or more')
+        if not self._connected:
+            raise ConnectionError('V-Sido CONNECT is not connected')
+        self._watchdog_timeout = timeout
+        self._watchdog_max_backoff = max_backoff
+        if self._watchdog_thread is not None:
+            return
+        self._watchdog_alive = True
+        self._watchdog_wakeup.clear()
+        self._watchdog_thread = threading.Thread(target=self._watchdog)
+        self._watchdog_thread.daemon = True
+        self._watchdog_thread.start()
+
+    def stop_watchdog(self):
+        '''通信路の監視の停止
+        '''
+        if self._watchdog_thread is None:
+            return
+        self._watchdog_alive = False
+        self._watchdog_wakeup.set()
+        if self._watchdog_thread is not threading.current_thread():
+            self._watchdog_thread.join()
+        self._watchdog_thread = None
+
+    def get_watchdog_stats(self):
+        '''通信路の監視の統計を返す
+
+        Returns:
+            dict: 統計の辞書データ
+                lost(int): 通信路が切れたと判断した回数
+                recovered(int): 再接続できた回数
+                reconnect_attempts(int): シリアルポートを開き直そうとした回数
+                last_downtime(float): 最後に切れてから再接続して設定を送り直すまでの秒数
+        '''
+        return dict(self._watchdog_stats)
+
+    def _notify_link_lost(self, error):
+        '''通信路が切れたことを検出した時の処理
+
+        レスポンス待ちをすぐにLinkLostErrorで終了させ、ウォッチドッグに再接続させる。
+        '''
+        self._link_lost = True
+        self._fail_pending_responses(LinkLostError('V-Sido CONNECT link lost: ' + str(error)))
+        self._watchdog_wakeup.set()
+
+    def _watchdog(self):
+        '''ウォッチドッグのスレッドの処理
+        '''
+        probe_time = 0.0
+        while self._watchdog_alive:
+            self._clock.wait(self._watchdog_wakeup, self._watchdog_timeout / 2)
+            self._watchdog_wakeup.clear()
+            if not self._watchdog_alive:
+                return
+            if not self._link_lost:
+                now = self._clock.time()
+                if now - self._last_receive_time < self._watchdog_timeout:
+                    continue
+                if probe_time <= self._last_receive_time:
+                    # しばらく何も受信していないので、応答を確かめる
+                    probe_time = now
+                    try:
+                        self._write_command(self._make_get_vid_value_command(254), self._watchdog_timeout, Connect.LANE_CONTROL)
+                    except (ConnectionError, ValueError, serial.SerialException):
+                        pass
+                    continue
+                if now - probe_time < self._watchdog_timeout:
+                    continue
+                self._notify_link_lost(TimeoutError('V-Sido CONNECT response timeout'))
+            self._recover_link()
+            probe_time = 0.0
+
+    def _recover_link(self):
+        '''シリアルポートを開き直し、送信済みの設定と目標角度を送り直す
+        '''
+        lost_time = self._clock.time()
+        self._watchdog_stats['lost'] += 1
+        with self._send_lock:
+            self._connected = False
+            self._link_down = True
+        # 検出してから切断までの間に登録されたレスポンス待ちも終了させる
+        self._fail_pending_responses(LinkLostError('V-Sido CONNECT link lost'))
+        self._stop_receiver(self._watchdog_timeout)
+        try:
+            self._serial.close()
+        except (serial.SerialException, OSError):
+            pass
+        backoff = Connect._RECONNECT_BACKOFF
+        while self._watchdog_alive:
+            self._watchdog_stats['reconnect_attempts'] += 1
+            try:
+                self._serial = self._open_serial(self._port, self._baudrate)
+                break
+            except serial.SerialException:
+                if self._clock.wait(self._watchdog_wakeup, backoff):
+                    self._watchdog_wakeup.clear()
+                backoff = min(backoff * 2, self._watchdog_max_backoff)
+        else:
+            return
+        self._link_lost = False
+        self._last_receive_time = self._clock.time()
+        self._start_receiver()
+        with self._send_lock:
+            self._connected = True
+            self._link_down = False
+        self._restore_state()
+        self._watchdog_stats['recovered'] += 1
+        self._watchdog_stats['last_downtime'] = self._clock.time() - lost_time
+
+    def _restore_state(self):
+        '''再接続後に、接続中に送信したVID設定、サーボの設定値、フィードバックID、最後の目標角度を送り直す
+        '''
+        try:
+            if self._vid_settings:
+                self._send_data(self._make_set_vid_value_command(*[{'vid':vid, 'vdt':self._vid_settings[vid]} for vid in sorted(self._vid_settings)]))
+            compliance_data_set = []
+            min_max_data_set = []
+            for sid in sorted(self._servo_settings):
+                servo_settings = self._servo_settings[sid]
+                if 'compliance_cw' in servo_settings:
+                    compliance_data_set.append({'sid':sid, 'compliance_cw':servo_settings['compliance_cw'], 'compliance_ccw':servo_settings['compliance_ccw']})
+                if 'min' in servo_settings:
+                    min_max_data_set.append({'sid':sid, 'min':servo_settings['min'], 'max':servo_settings['max']})
+            for i in range(0, len(compliance_data_set), Connect._COMPLIANCE_PER_FRAME):
+                self._send_data(self._make_set_servo_compliance_command(*compliance_data_set[i:i + Connect._COMPLIANCE_PER_FRAME]))
+            for i in range(0, len(min_max_data_set), Connect._MIN_MAX_PER_FRAME):
+                self._send_data(self._make_set_servo_min_max_angle_command(*min_max_data_set[i:i + Connect._MIN_MAX_PER_FRAME]))
+            if self._feedback_sid_set:
+                self._send_data(self._make_set_feedback_id_command(*self._feedback_sid_set))
+            angle_data_set = [{'sid':sid, 'angle':self._last_angles[sid]} for sid in sorted(self._last_angles)]
+            for i in range(0, len(angle_data_set), Connect._ANGLE_PER_FRAME):
+                self._send_data(self._make_set_servo_angle_command(*angle_data_set[i:i + Connect._ANGLE_PER_FRAME], cycle_time=0))
+        except (ConnectionError, ValueError, serial.SerialException):
+            # 送り直している間に再び切れた場合は、次の再接続で送り直す
+            pass
+
+    def publish_state(self, name=None):
+        '''ロボットの最新状態の共有メモリへの公開の開始
+
+        受信したサーボ情報、IK情報、加速度と、送信した目標角度を名前付き共有メモリに書き込む。
+        同じマシンの他のプロセスからはStateReaderで読み出すことができる。
+
+        Args:
+            name(Optional[str]): 共有メモリの名前(省略した場合は自動で決める)
+
+        Returns:
+            str: 共有メモリの名前
+
+        Raises:
+            ValueError: invalid argument
+            FileExistsError: 同じ名前の共有メモリが既にある場合発生
+        '''
+        from vsido.shared_state import StatePublisher
+        if self._state_publisher is not None:
+            raise ValueError('state is already published')
+        self._state_publisher = StatePublisher(name)
+        return self._state_publisher.get_name()
+
+    def stop_publishing_state(self):
+        '''ロボットの最新状態の公開の停止(共有メモリは削除される)
+        '''
+        state_publisher = self._state_publisher
+        if state_publisher is not None:
+            # 受信スレッドが新しく書き込みを始めないように、先に切り離してから閉じる
+            self._state_publisher = None
+            state_publisher.close()
+
+    def _publish_received_state(self, receive_data, register_data):
+        '''受信したデータを共有メモリに書き込む
+        '''
+        state_publisher = self._state_publisher
+        if state_publisher is None:
+            return
+        received_time = self._clock.time()
+        try:
+            if receive_data[1] == Connect._COMMAND_OP_ACCELERATION:
+                acceleration_data = self._parse_acceleration_response(list(receive_data))
+                state_publisher.publish_acceleration(acceleration_data['ax'], acceleration_data['ay'], acceleration_data['az'], received_time)
+            elif receive_data[1] == Connect._COMMAND_OP_IK:
+                for ik_data in self._parse_ik_response(list(receive_data)):
+                    state_publisher.publish_ik(ik_data['kid'], ik_data['kdt'], received_time)
+            elif register_data:
+                for sid, address, data in register_data:
+                    state_publisher.publish_servo(sid, address, data, received_time)
+        except (ValueError, IndexError):
+            pass
+
+    def _iter_servo_register_data(self, command_data, response_data):
+        '''「サーボ情報要求」「フィードバック要求」のレスポンスをサーボごとのデータに分ける
+
+        レスポンスにはアドレスとデータ長が含まれないので、送信データと組み合わせて読み解く。
+
+        Returns:
+            list: (サーボID, 先頭アドレス, データ)のタプルのリスト
+        '''
+        register_data = []
+        if response_data[1] == Connect._COMMAND_OP_SERVO_INFO and command_data[1] == Connect._COMMAND_OP_SERVO_INFO:
+            data_pos = 3
+            for i in range(3, len(command_data) - 1, 3):
+                sid, address, length = command_data[i], command_data[i + 1], command_data[i + 2]
+                if not response_data[data_pos] == sid or address + length > 54:
+                    raise ValueError('invalid response_data')
+                register_data.append((sid, address, response_data[data_pos + 1:data_pos + 1 + length]))
+                data_pos += 1 + length
+        elif response_data[1] == Connect._COMMAND_OP_GET_FEEDBACK and command_data[1] == Connect._COMMAND_OP_GET_FEEDBACK:
+            address, length = command_data[3], command_data[4]
+            if address + length > 54:
+                raise ValueError('invalid response_data')
+            for data_pos in range(3, len(response_data) - length - 1, length + 1):
+                register_data.append((response_data[data_pos], address, response_data[data_pos + 1:data_pos + 1 + length]))
+        return register_data
+
+    def _update_servo_mirror(self, register_data, received_time):
+        '''受信したサーボ情報を写しに書き込み、書き込んだByteの受信時刻を更新する
+        '''
+        with self._servo_mirror_lock:
+            for sid, address, data in register_data:
+                mirror = self._servo_mirror.get(sid)
+                if mirror is None:
+                    mirror = (bytearray(Connect._SERVO_INFO_LENGTH), array.array('d', bytes(8 * Connect._SERVO_INFO_LENGTH)))
+                    self._servo_mirror[sid] = mirror
+                mirror[0][address:address + len(data)] = bytes(data)
+                for i in range(address, address + len(data)):
+                    mirror[1][i] = received_time
+
+    def _read_servo_mirror(self, sid, address, length, max_age):
+        '''サーボ情報の写しから、指定範囲が全てmax_age秒以内に受信したものであれば読み出す
+
+        Returns:
+            list: サーボ情報(古いByteがある場合はNone)
+        '''
+        oldest_time = self._clock.time() - max_age
+        with self._servo_mirror_lock:
+            mirror = self._servo_mirror.get(sid)
+            if mirror is None or address + length > Connect._SERVO_INFO_LENGTH:
+                return None
+            for i in range(address, address + length):
+                if mirror[1][i] == 0 or mirror[1][i] < oldest_time:
+                    return None
+            return list(mirror[0][address:address + length])
+
+    def get_servo_mirror(self, sid):
+        '''サーボ情報の写しを返す
+
+        get_servo_info()、get_servo_feedback()のレスポンスから更新される、サーボごとの54Byteのサーボ情報の写しを返す。
+        他のスレッドやブリッジのクライアントが要求したレスポンスも反映される。V-Sido CONNECTへの問い合わせは行わない。
+
+        Args:
+            sid(int): サーボID
+
+        Returns:
+            dict: サーボ情報の写しの辞書データ(一度も受信していない場合はNone)
+                sid(int): サーボID
+                data(list): サーボ情報(アドレス0～53)
+                time(tuple): アドレスごとの受信時刻(未受信のアドレスは0)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not isinstance(sid, int):
+            raise ValueError('sid must be int')
+        if not 0 <= sid <= 254:
+            raise ValueError('sid must be 0 - 254')
+        with self._servo_mirror_lock:
+            mirror = self._servo_mirror.get(sid)
+            if mirror is None:
+                return None
+            return {'sid':sid, 'data':list(mirror[0]), 'time':tuple(mirror[1])}
 
     def set_servo_angle(self, *angle_data_set, cycle_time=0):
         '''V-Sido CONNECTに「目標角度設定」コマンドの送信
@@ -221,43 +1347,70 @@ class Connect(object):
             ValueError: invalid argument
             ConnectionError: V-Sido CONNECT is not connected
         '''
-        if not isinstance(cycle_time, int):
-            raise ValueError('cycle_time must be int')
-        if not 0 <= cycle_time <= 1000:
-            raise ValueError('cycle_time must be 0 - 1000')
+        Connect._OPCODES['set_servo_angle'].validate(angle_data_set, cycle_time=cycle_time)
+        key = [Connect._COMMAND_OP_ANGLE, round(cycle_time / 10)]
         for angle_data in angle_data_set:
-            if not isinstance(angle_data, dict):
-                raise ValueError('angle_data_set must contain dict data')
-            if 'sid' not in angle_data:
-                raise ValueError('missing sid in angle_data_set')
-            if not isinstance(angle_data['sid'], int):
-                raise ValueError('sid must be int')
-            if not 1 <= angle_data['sid'] <= 254:
-                raise ValueError('sid must be 1 - 254')
-            if 'angle' not in angle_data:
-                raise ValueError('missing angle in angle_data_set')
-            if not (isinstance(angle_data['angle'], int) or isinstance(angle_data['angle'], float)):
-                raise ValueError('angle must be int or float')
-            if not -180.0 <= angle_data['angle'] <= 180.0:
-                raise ValueError('angle must be -180 - 180')
-        self._send_data(self._make_set_servo_angle_command(*angle_data_set, cycle_time=cycle_time))
+            key.append(angle_data['sid'])
+            key.append(round(angle_data['angle'] * 10))
+        self._send_data(self._frame_cache.get(tuple(key), self._make_set_servo_angle_command, *angle_data_set, cycle_time=cycle_time))
+        for angle_data in angle_data_set:
+            self._last_angles[angle_data['sid']] = angle_data['angle']
+        state_publisher = self._state_publisher
+        if state_publisher is not None:
+            state_publisher.publish_angles(angle_data_set, self._clock.time())
 
     def _make_set_servo_angle_command(self, *angle_data_set, cycle_time):
         '''「目標角度設定」コマンドのデータ生成
         '''
+        return Connect._OPCODES['set_servo_angle'].encode(angle_data_set, cycle_time=cycle_time)
+
+    def _make_servo_angle_array_command(self, sid_set, angle_values, cycle_time):
+        '''サーボIDの並びと角度(0.1度単位の'h'型の配列)から「目標角度設定」コマンドのデータ生成
+        '''
         data = []
         data.append(Connect._COMMAND_ST) # ST
         data.append(Connect._COMMAND_OP_ANGLE) # OP
         data.append(0x00) # LN仮置き
         data.append(round(cycle_time / 10)) # CYC(引数はmsec単位で来るが、データは10msec単位で送る)
-        for angle_data in angle_data_set:
-            data.append(angle_data['sid']) # SID
-            angle_data = self.make_2bytes_data(round(angle_data['angle'] * 10))
-            data.append(angle_data[0]) # ANGLE
-            data.append(angle_data[1]) # ANGLE
+        angle_bytes = _encode_2bytes_array(angle_values)
+        servo_data = [0] * (len(sid_set) * 3)
+        servo_data[0::3] = sid_set # SID
+        servo_data[1::3] = angle_bytes[0::2] # ANGLE
+        servo_data[2::3] = angle_bytes[1::2] # ANGLE
+        data.extend(servo_data)
         data.append(0x00) # SUM仮置き
         return self._adjust_ln_sum(data)
 
+    def _send_servo_angle_array(self, sid_set, angle_set, cycle_time=0):
+        '''検証済みのサーボIDと角度の並びから「目標角度設定」を送信する(PoseBlenderなどの周期送信用)
+
+        1フレームに入らない場合は分けて送信する。送信した角度は最後の目標角度として記録する。
+
+        Args:
+            sid_set(list): サーボIDの並び
+            angle_set(list/array.array): 角度の並び(範囲は-180.0～180.0度)
+            cycle_time(Optional[int]): 目標角度に移行するまでの時間(msec)
+        '''
+        for command_data in self._make_servo_angle_array_frames(sid_set, angle_set, cycle_time):
+            self._send_data(command_data)
+        self._record_servo_angle_array(sid_set, angle_set)
+
+    def _make_servo_angle_array_frames(self, sid_set, angle_set, cycle_time):
+        '''検証済みのサーボIDと角度の並びから「目標角度設定」コマンドのデータを1フレームに収まる分ずつ生成する
+        '''
+        angle_values = array.array('h', [round(angle * 10) for angle in angle_set])
+        return [self._make_servo_angle_array_command(sid_set[i:i + Connect._ANGLE_PER_FRAME], angle_values[i:i + Connect._ANGLE_PER_FRAME], cycle_time) for i in range(0, len(sid_set), Connect._ANGLE_PER_FRAME)]
+
+    def _record_servo_angle_array(self, sid_set, angle_set):
+        '''送信した角度を最後の目標角度として記録する
+        '''
+        last_angles = self._last_angles
+        for sid, angle in zip(sid_set, angle_set):
+            last_angles[sid] = angle
+        state_publisher = self._state_publisher
+        if state_publisher is not None:
+            state_publisher.publish_angles([{'sid':sid, 'angle':angle} for sid, angle in zip(sid_set, angle_set)], self._clock.time())
+
     def set_servo_compliance(self, *compliance_data_set):
         '''V-Sido CONNECTに「コンプライアンス設定」コマンドの送信
 
@@ -277,42 +1430,17 @@ class Connect(object):
             ValueError: invalid argument
             ConnectionError: V-Sido CONNECT is not connected
         '''
-        for compliance_data in compliance_data_set:
-            if not isinstance(compliance_data, dict):
-                raise ValueError('compliance_data_set must contain dict data')
-            if 'sid' not in compliance_data:
-                raise ValueError('missing sid in compliance_data_set')
-            if not isinstance(compliance_data['sid'], int):
-                raise ValueError('sid must be int')
-            if not 1 <= compliance_data['sid'] <= 254:
-                raise ValueError('sid must be 1 - 254')
-            if 'compliance_cw' not in compliance_data:
-                raise ValueError('missing compliance_cw in compliance_data_set')
-            if not isinstance(compliance_data['compliance_cw'], int):
-                raise ValueError('compliance_cw must be int')
-            if not 1 <= compliance_data['compliance_cw'] <= 254:
-                raise ValueError('compliance_cw must be 1 - 254')
-            if 'compliance_ccw' not in compliance_data:
-                raise ValueError('missing compliance_ccw in compliance_data_set')
-            if not isinstance(compliance_data['compliance_ccw'], int):
-                raise ValueError('compliance_ccw must be int')
-            if not 1 <= compliance_data['compliance_ccw'] <= 254:
-                raise ValueError('compliance_ccw must be 1 - 254')
+        Connect._OPCODES['set_servo_compliance'].validate(compliance_data_set)
         self._send_data(self._make_set_servo_compliance_command(*compliance_data_set))
+        for compliance_data in compliance_data_set:
+            servo_settings = self._servo_settings.setdefault(compliance_data['sid'], {})
+            servo_settings['compliance_cw'] = compliance_data['compliance_cw']
+            servo_settings['compliance_ccw'] = compliance_data['compliance_ccw']
 
     def _make_set_servo_compliance_command(self, *compliance_data_set):
         '''「コンプライアンス設定」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_COMPLIANCE) # OP
-        data.append(0x00) # LN仮置き
-        for compliance_data in compliance_data_set:
-            data.append(compliance_data['sid']) # SID
-            data.append(compliance_data['compliance_cw']) # CP1
-            data.append(compliance_data['compliance_ccw']) # CP2
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['set_servo_compliance'].encode(compliance_data_set)
 
     def set_servo_min_max_angle(self, *min_max_data_set):
         '''V-Sido CONNECTに「最大・最小角設定」コマンドの送信
@@ -333,56 +1461,75 @@ class Connect(object):
             ValueError: invalid argument
             ConnectionError: V-Sido CONNECT is not connected
         '''
+        Connect._OPCODES['set_servo_min_max_angle'].validate(min_max_data_set)
+        self._send_data(self._make_set_servo_min_max_angle_command(*min_max_data_set))
         for min_max_data in min_max_data_set:
-            if not isinstance(min_max_data, dict):
-                raise ValueError('min_max_data_set must contain dict data')
-            if 'sid' not in min_max_data:
-                raise ValueError('missing sid in min_max_data_set')
-            if not isinstance(min_max_data['sid'], int):
+            servo_settings = self._servo_settings.setdefault(min_max_data['sid'], {})
+            servo_settings['min'] = min_max_data['min']
+            servo_settings['max'] = min_max_data['max']
+
+    def get_servo_settings(self, *sid_set):
+        '''接続後に送信したサーボの設定値を返す
+
+        set_servo_compliance()、set_servo_min_max_angle()で送信した値をサーボごとに返す。
+        V-Sido CONNECTへの問い合わせは行わないので、接続後に一度も送信していない値は含まれない。
+
+        Args:
+            *sid_set(int): サーボID(省略した場合は送信済みの全サーボ)
+
+        Returns:
+            tuple: サーボの設定値の辞書データ(送信済みの値のみ)
+                example:
+                ({'sid':1, 'compliance_cw':100, 'compliance_ccw':100, 'min':-100, 'max':100},)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        for sid in sid_set:
+            if not isinstance(sid, int):
                 raise ValueError('sid must be int')
-            if not 0 <= min_max_data['sid'] <= 254:
+            if not 0 <= sid <= 254:
                 raise ValueError('sid must be 0 - 254')
-            if 'min' not in min_max_data:
-                raise ValueError('missing min in min_max_data_set')
-            if not (isinstance(min_max_data['min'], int) or isinstance(min_max_data['min'], float)):
-                raise ValueError('min must be int or float')
-            if not -180.0 <= min_max_data['min'] <= 180.0:
-                raise ValueError('min must be -180 - 180')
-            if 'max' not in min_max_data:
-                raise ValueError('missing max in min_max_data_set')
-            if not (isinstance(min_max_data['max'], int) or isinstance(min_max_data['max'], float)):
-                raise ValueError('max must be int or float')
-            if not -180.0 <= min_max_data['max'] <= 180.0:
-                raise ValueError('max must be -180 - 180')
-            if min_max_data['max'] < min_max_data['min']:
-                raise ValueError('max must be bigger than min')
-        self._send_data(self._make_set_servo_min_max_angle_command(*min_max_data_set))
+        if not sid_set:
+            sid_set = sorted(self._servo_settings.keys())
+        servo_settings_set = tuple()
+        for sid in sid_set:
+            if sid in self._servo_settings:
+                servo_settings = {'sid':sid}
+                servo_settings.update(self._servo_settings[sid])
+                servo_settings_set += (servo_settings,)
+        return servo_settings_set
+
+    def get_servo_angle_limits(self):
+        '''接続後に送信したサーボの最大・最小角を返す
+
+        set_servo_min_max_angle()で送信した値を、目標角度の制限に使いやすい形で返す。
+
+        Returns:
+            dict: サーボIDをキーにした(最小角, 最大角)のタプル(送信済みのサーボのみ)
+                example:
+                {1:(-100, 100), 2:(-150, 50)}
+        '''
+        angle_limits = {}
+        for sid, servo_settings in list(self._servo_settings.items()):
+            if 'min' in servo_settings:
+                angle_limits[sid] = (servo_settings['min'], servo_settings['max'])
+        return angle_limits
 
     def _make_set_servo_min_max_angle_command(self, *min_max_data_set):
         '''「最大・最小角設定」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_MIN_MAX) # OP
-        data.append(0x00) # LN仮置き
-        for min_max_data in min_max_data_set:
-            data.append(min_max_data['sid']) # SID
-            angle_data = self.make_2bytes_data(round(min_max_data['min'] * 10))
-            data.append(angle_data[0]) # MIN
-            data.append(angle_data[1]) # MIN
-            angle_data = self.make_2bytes_data(round(min_max_data['max'] * 10))
-            data.append(angle_data[0]) # MAX
-            data.append(angle_data[1]) # MAX
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['set_servo_min_max_angle'].encode(min_max_data_set)
 
-    def get_servo_info(self, *servo_data_set, timeout=1):
+    def get_servo_info(self, *servo_data_set, timeout=1, max_age=None):
         '''
         V-Sido CONNECTに「サーボ情報要求」コマンドを送信
 
         サーボの現在情報を取得する。
         複数のサーボへの要求をまとめて送ることができる。
         取得するサーボ情報は、開始アドレスと取得したいデータ長を決める。
+        max_ageを指定した場合は、サーボ情報の写しがmax_age秒以内に受信したものであれば写しから返し、
+        古いサーボの分だけを要求する。
 
         Args:
             servo_data_set(dict): サーボ情報を書いた辞書データ
@@ -391,7 +1538,8 @@ class Connect(object):
                 length(int): サーボ情報読み出しデータ長(範囲は1～54)
                 example:
                 {'sid':3, 'address':1, 'length':20}, {'sid':4, 'address':1, 'length':20}
-            timeout(Optional[int/float]): 受信タイムアウトするまでの秒数(省略した場合は1秒)
+            timeout(Optional[int/float]): 受信タイムアウトするまでの秒数(レスポンスがない場合はこの中で再送する、省略した場合は1秒)
+            max_age(Optional[int/float]): 写しから返してよい経過秒数(省略した場合は必ず要求する)
         Returns:
             tuple: サーボ現在情報を書いた辞書データ(引数servo_data_setにdataを加えたもの)
                 example:
@@ -402,44 +1550,111 @@ class Connect(object):
             ConnectionError: V-Sido CONNECT is not connected
             TimeoutError: V-Sido CONNECT response timeout
         '''
-        for servo_data in servo_data_set:
-            if not isinstance(servo_data, dict):
-                raise ValueError('servo_data_set must contain dict data')
-            if 'sid' not in servo_data:
-                raise ValueError('missing sid in servo_data_set')
-            if not isinstance(servo_data['sid'], int):
-                raise ValueError('sid must be int')
-            if not 0 <= servo_data['sid'] <= 254:
-                raise ValueError('sid must be 0 - 254')
-            if 'address' not in servo_data:
-                raise ValueError('missing address in servo_data_set')
-            if not isinstance(servo_data['address'], int):
-                raise ValueError('adress must be int')
-            if not 0 <= servo_data['address'] <= 53:
-                raise ValueError('adress must be 0 - 53')
-            if 'length' not in servo_data:
-                raise ValueError('missing length in servo_data_set')
-            if not isinstance(servo_data['length'], int):
-                raise ValueError('length must be int')
-            if not 1 <= servo_data['length'] <= 54:
-                raise ValueError('length must be 1 - 54')
+        Connect._OPCODES['get_servo_info'].validate(servo_data_set)
         if not (isinstance(timeout, int) or isinstance(timeout, float)):
             raise ValueError('timeout must be int or float')
-        return self._parse_servo_info_response(*servo_data_set, response_data=self._send_data_wait_response(self._make_get_servo_info_command(*servo_data_set), timeout))
+        if max_age is not None:
+            if not (isinstance(max_age, int) or isinstance(max_age, float)):
+                raise ValueError('max_age must be int or float')
+            stale_data_set = []
+            for servo_data in servo_data_set:
+                mirror_data = self._read_servo_mirror(servo_data['sid'], servo_data['address'], servo_data['length'], max_age)
+                if mirror_data is None:
+                    stale_data_set.append(servo_data)
+                else:
+                    servo_data['data'] = mirror_data
+            if stale_data_set:
+                # 要求した分の辞書データにdataが加わるので、引数をそのまま返す
+                self._request_servo_info(tuple(stale_data_set), timeout)
+            return servo_data_set
+        return self._request_servo_info(servo_data_set, timeout)
+
+    def _request_servo_info(self, servo_data_set, timeout):
+        '''「サーボ情報要求」を送信してレスポンスを受け取る
+        '''
+        if self._servo_info_batch_window > 0:
+            return self._get_servo_info_batched(servo_data_set, timeout)
+        key = [Connect._COMMAND_OP_SERVO_INFO]
+        for servo_data in servo_data_set:
+            key.append(servo_data['sid'])
+            key.append(servo_data['address'])
+            key.append(servo_data['length'])
+        command_data = self._frame_cache.get(tuple(key), self._make_get_servo_info_command, *servo_data_set)
+        return self._parse_servo_info_response(*servo_data_set, response_data=self._send_data_wait_response(command_data, timeout, retry=True))
+
+    def set_servo_info_batching(self, window):
+        '''get_servo_info()の同時呼び出しをまとめて送信する設定
+
+        windowの秒数の間に他のスレッドから呼ばれたget_servo_info()の要求を1フレームにまとめて送信し、
+        レスポンスを呼び出し元ごとの結果に分けて返す。1フレームに収まらなくなった時点ですぐに送信する。
+        複数のスレッドがそれぞれ少数のサーボの情報を要求する場合に、全体の往復回数を減らすことができる。
+
+        Args:
+            window(int/float): 要求を集める秒数(0の場合はまとめない、初期値は0)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not (isinstance(window, int) or isinstance(window, float)):
+            raise ValueError('window must be int or float')
+        if not 0 <= window <= 1:
+            raise ValueError('window must be 0 - 1')
+        self._servo_info_batch_window = window
+
+    def _get_servo_info_batched(self, servo_data_set, timeout):
+        '''他の呼び出しとまとめて「サーボ情報要求」を送信する
+
+        最初に要求したスレッドが、待ち時間が過ぎるかフレームが一杯になるまで待ってからまとめて送信する。
+        '''
+        empty_batch = _ServoInfoBatch()
+        if not empty_batch.fits(servo_data_set, Connect._COMMAND_MAX_LENGTH):
+            # 1つの要求だけで1フレームを超える場合はまとめずにそのまま送る
+            return self._parse_servo_info_response(*servo_data_set, response_data=self._send_data_wait_response(self._make_get_servo_info_command(*servo_data_set), timeout, retry=True))
+        future = concurrent.futures.Future()
+        with self._servo_info_batch_lock:
+            batch = self._servo_info_batch
+            leader = batch is None or not batch.fits(servo_data_set, Connect._COMMAND_MAX_LENGTH)
+            if leader:
+                if batch is not None:
+                    # 収まらない場合は集めている要求をすぐに送らせ、新しく集め始める
+                    batch.ready.set()
+                batch = empty_batch
+                self._servo_info_batch = batch
+            batch.add(servo_data_set, future)
+            if not batch.fits(({'length':1},), Connect._COMMAND_MAX_LENGTH):
+                batch.ready.set()
+        if leader:
+            batch.ready.wait(self._servo_info_batch_window)
+            with self._servo_info_batch_lock:
+                if self._servo_info_batch is batch:
+                    self._servo_info_batch = None
+            self._send_servo_info_batch(batch, timeout)
+        try:
+            return self._clock.wait_future(future, timeout + self._servo_info_batch_window if not timeout == 0 else None)
+        except concurrent.futures.TimeoutError:
+            raise TimeoutError('V-Sido CONNECT response timeout')
+
+    def _send_servo_info_batch(self, batch, timeout):
+        '''まとめた「サーボ情報要求」を送信し、結果を呼び出し元ごとに分けて返す
+        '''
+        combined_data_set = []
+        for servo_data_set, future in batch.requests:
+            combined_data_set.extend(servo_data_set)
+        try:
+            response_data = self._send_data_wait_response(self._make_get_servo_info_command(*combined_data_set), timeout, retry=True)
+            self._parse_servo_info_response(*combined_data_set, response_data=response_data)
+        except (ConnectionError, ValueError, TimeoutError, IndexError) as error:
+            for servo_data_set, future in batch.requests:
+                future.set_exception(error)
+            return
+        for servo_data_set, future in batch.requests:
+            # _parse_servo_info_response()が各辞書データにdataを加えているので、呼び出し元の引数をそのまま返す
+            future.set_result(servo_data_set)
 
     def _make_get_servo_info_command(self, *servo_data_set):
         '''「サーボ情報要求」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_SERVO_INFO) # OP
-        data.append(0x00) # LN仮置き
-        for servo_data in servo_data_set:
-            data.append(servo_data['sid']) # SID
-            data.append(servo_data['address']) # DAD
-            data.append(servo_data['length']) # DLN
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['get_servo_info'].encode(servo_data_set)
 
     def _parse_servo_info_response(self, *servo_data_set, response_data):
         '''「サーボ情報要求」のレスポンスデータのパース
@@ -475,34 +1690,26 @@ class Connect(object):
             ValueError: invalid argument
             ConnectionError: V-Sido CONNECT is not connected
         '''
-        for sid in sid_set:
-            if not isinstance(sid, int):
-                raise ValueError('sid must be int')
-            if not 0 <= sid <= 254:
-                raise ValueError('sid must be 1 - 254')
-        self._send_data(self._make_set_feedback_id_command(*sid_set))
+        Connect._OPCODES['set_feedback_id'].validate(sid_set)
+        self._send_data(self._frame_cache.get((Connect._COMMAND_OP_FEEDBACK_ID,) + sid_set, self._make_set_feedback_id_command, *sid_set))
+        self._feedback_sid_set = sid_set
 
     def _make_set_feedback_id_command(self, *sid_set):
         '''「フィードバックID設定」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_FEEDBACK_ID) # OP
-        data.append(0x00) # LN仮置き
-        for sid in sid_set:
-            data.append(sid) # SID
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['set_feedback_id'].encode(sid_set)
 
-    def get_servo_feedback(self, address, length, timeout=1):
+    def get_servo_feedback(self, address, length, timeout=1, max_age=None):
         '''V-Sido CONNECTに「フィードバック要求」コマンドを送信
 
         フィードバックID設定で設定したサーボの現在情報を取得する。
+        max_ageを指定した場合は、設定した全サーボの写しがmax_age秒以内に受信したものであれば写しから返す。
 
         Args:
             address(int): サーボ情報格納先先頭アドレス(範囲は0～53)
             length(int): サーボ情報読み出しデータ長(範囲は1～54)
             timeout(Optional[int/float]): 受信タイムアウトするまでの秒数(省略した場合は1秒)
+            max_age(Optional[int/float]): 写しから返してよい経過秒数(省略した場合は必ず要求する)
 
         Returns:
             tuple: サーボ現在情報を書いた辞書データ
@@ -514,51 +1721,33 @@ class Connect(object):
             ConnectionError: V-Sido CONNECT is not connected
             TimeoutError: V-Sido CONNECT response timeout
         '''
-        if not isinstance(address, int):
-            raise ValueError('address must be int')
-        if not 0 <= address <= 53:
-            raise ValueError('address must be 0 - 53')
-        if not isinstance(length, int):
-            raise ValueError('length must be int')
-        if not 1 <= length <= 54:
-            raise ValueError('length must be int')
+        Connect._OPCODES['get_servo_feedback'].validate((), address=address, length=length)
         if not (isinstance(timeout, int) or isinstance(timeout, float)):
             raise ValueError('timeout must be int or float')
-        return self._parse_servo_feedback_response(address, length, response_data=self._send_data_wait_response(self._make_get_servo_feedback_command(address, length), timeout))
+        if max_age is not None:
+            if not (isinstance(max_age, int) or isinstance(max_age, float)):
+                raise ValueError('max_age must be int or float')
+            feedback_sid_set = self._feedback_sid_set
+            if feedback_sid_set:
+                servo_data_set = tuple()
+                for sid in feedback_sid_set:
+                    mirror_data = self._read_servo_mirror(sid, address, length, max_age)
+                    if mirror_data is None:
+                        break
+                    servo_data_set += ({'sid':sid, 'address':address, 'length':length, 'data':mirror_data},)
+                else:
+                    return servo_data_set
+        return self._parse_servo_feedback_response(address, length, response_data=self._send_data_wait_response(self._frame_cache.get((Connect._COMMAND_OP_GET_FEEDBACK, address, length), self._make_get_servo_feedback_command, address, length), timeout))
 
     def _make_get_servo_feedback_command(self, address, length):
         '''「サーボ情報要求」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_GET_FEEDBACK) # OP
-        data.append(0x00) # LN仮置き
-        data.append(address) # DAD
-        data.append(length) # DLN
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['get_servo_feedback'].encode((), address=address, length=length)
 
     def _parse_servo_feedback_response(self, address, length, response_data):
         '''「サーボ情報要求」のレスポンスデータのパース
         '''
-        if not isinstance(response_data, list):
-            raise ValueError('response_data must be list')
-        if len(response_data) < 4:
-            raise ValueError('Invalid response_data length')
-        if not response_data[1] == Connect._COMMAND_OP_GET_FEEDBACK:
-            raise ValueError('Invalid response_data OP')
-        servo_num = (len(response_data) - 4) // (length + 1)
-        servo_data_set = tuple()
-        for i in range(0, servo_num):
-            servo_data = {}
-            servo_data['sid'] = response_data[3 + i * length]
-            servo_data['address'] = address
-            servo_data['length'] = length
-            servo_data['data'] = []
-            for j in range(0, length):
-                servo_data['data'].append(response_data[4 + i * length + j])
-            servo_data_set += (servo_data,)
-        return servo_data_set
+        return Connect._OPCODES['get_servo_feedback'].parse(response_data, address=address, length=length)
 
     def set_vid_io_mode(self, *gpio_data_set):
         '''GPIOピン4～7番を入出力どちらで利用するかのVID設定の書き込み
@@ -658,37 +1847,15 @@ class Connect(object):
             ValueError: invalid argument
             ConnectionError: V-Sido CONNECT is not connected
         '''
-        for vid_data in vid_data_set:
-            if not isinstance(vid_data, dict):
-                raise ValueError('vid_data_set must contain dict data')
-            if 'vid' not in vid_data:
-                raise ValueError('missing vid in vid_data_set')
-            if not isinstance(vid_data['vid'], int):
-                raise ValueError('vid must be int')
-            if not 0 <= vid_data['vid'] <= 254:
-                # 本来はこんなに幅が広くないが将来的に拡張する可能性と、バージョン確認(254)などに対応
-                raise ValueError('vid must be 0 - 254')
-            if 'vdt' not in vid_data:
-                raise ValueError('missing vdt in vid_data_set')
-            if not isinstance(vid_data['vdt'], int):
-                raise ValueError('vdt must be int')
-            if not 0 <= vid_data['vdt'] <= 254:
-                # 2Byteデータの取り扱いについては仕様書を要確認
-                raise ValueError('vdt must be 0 - 254')
+        Connect._OPCODES['set_vid_value'].validate(vid_data_set)
         self._send_data(self._make_set_vid_value_command(*vid_data_set))
+        for vid_data in vid_data_set:
+            self._vid_settings[vid_data['vid']] = vid_data['vdt']
 
     def _make_set_vid_value_command(self, *vid_data_set):
         '''「VID設定」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_SET_VID_VALUE) # OP
-        data.append(0x00) # LN仮置き
-        for vid_data in vid_data_set:
-            data.append(vid_data['vid']) # VID
-            data.append(vid_data['vdt']) # VDT(※2Byteになるデータがある模様だが、それぞれでIDふられているので、LISTに入れるようにすること)
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['set_vid_value'].encode(vid_data_set)
 
     def get_vid_version(self, timeout=1):
         '''バージョン情報のVID設定の取得
@@ -724,6 +1891,26 @@ class Connect(object):
         pwd_data = self.get_vid_value(6, 7, timeout=timeout)
         return (pwd_data[0]['vdt'] * 256 + pwd_data[1]['vdt']) * 4
 
+    def get_pwm_cycle(self, timeout=1):
+        '''PWM周期を返す
+
+        接続後に送信、または読み出したPWM周期を返す。まだ分からない場合はVID設定から読み出して保持する。
+
+        Args:
+            timeout(Optional[int/float]): 読み出す場合の受信タイムアウトするまでの秒数(省略可、省略した場合は1秒)
+
+        Returns:
+            int: PWM周期(usec)
+
+        Raises:
+            ValueError: invalid argument
+            ConnectionError: V-Sido CONNECT is not connected
+            TimeoutError: V-Sido CONNECT response timeout
+        '''
+        if self._pwm_cycle is None:
+            self._pwm_cycle = self.get_vid_pwm_cycle(timeout=timeout)
+        return self._pwm_cycle
+
     def get_vid_value(self, *vid_set, timeout=1):
         '''V-Sido CONNECTに「VID要求」コマンドを送信
 
@@ -733,7 +1920,7 @@ class Connect(object):
 
         Args:
             *vid_set(int): VID設定情報
-            timeout(Optional[int/float]): 受信タイムアウトするまでの秒数(省略可、省略した場合は1秒)
+            timeout(Optional[int/float]): 受信タイムアウトするまでの秒数(レスポンスがない場合はこの中で再送する、省略可、省略した場合は1秒)
 
         Returns:
             tuple: VID設定情報を書いた辞書データ(引数vid_data_setにvdtを加えたもの)
@@ -747,27 +1934,15 @@ class Connect(object):
             ConnectionError: V-Sido CONNECT is not connected
             TimeoutError: V-Sido CONNECT response timeout
         '''
-        for vid in vid_set:
-            if not isinstance(vid, int):
-                raise ValueError('vid must be int')
-            if not 0 <= vid <= 254:
-                # 本来はこんなに幅が広くないが将来的に拡張する可能性と、バージョン確認などに対応
-                raise ValueError('vid must be int')
+        Connect._OPCODES['get_vid_value'].validate(vid_set)
         if not (isinstance(timeout, int) or isinstance(timeout, float)):
             raise ValueError('timeout must be int or float')
-        return self._parse_vid_response(*vid_set, response_data=self._send_data_wait_response(self._make_get_vid_value_command(*vid_set), timeout))
+        return self._parse_vid_response(*vid_set, response_data=self._send_data_wait_response(self._frame_cache.get((Connect._COMMAND_OP_GET_VID_VALUE,) + vid_set, self._make_get_vid_value_command, *vid_set), timeout, retry=True))
 
     def _make_get_vid_value_command(self, *vid_set):
         '''「VID要求」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_GET_VID_VALUE) # OP
-        data.append(0x00) # LN仮置き
-        for vid in vid_set:
-            data.append(vid) # VID
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['get_vid_value'].encode(vid_set)
 
     def _parse_vid_response(self, *vid_set, response_data):
         '''「VID要求」のレスポンスデータのパース
@@ -801,17 +1976,12 @@ class Connect(object):
         Raises:
             ConnectionError: V-Sido CONNECT is not connected
         '''
-        self._send_data(self._make_write_flash_command())
+        self._send_data(self._frame_cache.get((Connect._COMMAND_OP_WRITE_FLASH,), self._make_write_flash_command))
 
     def _make_write_flash_command(self):
         '''「フラッシュ書き込み要求」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_WRITE_FLASH) # OP
-        data.append(0x00) # LN仮置き
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['write_flash'].encode(())
 
     def set_gpio_value	(self, *gpio_data_set):
         '''V-Sido CONNECTに「IO設定」コマンドの送信
@@ -831,35 +2001,13 @@ class Connect(object):
             ValueError: invalid argument
             ConnectionError: V-Sido CONNECT is not connected
         '''
-        for gpio_data in gpio_data_set:
-            if not isinstance(gpio_data, dict):
-                raise ValueError('gpio_data_set must contain dict data')
-            if 'iid' not in gpio_data:
-                raise ValueError('missing iid in gpio_data_set')
-            if not isinstance(gpio_data['iid'], int):
-                raise ValueError('iid must be int')
-            if not gpio_data['iid'] in [4, 5, 6, 7]:
-                raise ValueError('iid must be 4 - 7')
-            if 'value' not in gpio_data:
-                raise ValueError('missing value in gpio_data_set')
-            if not isinstance(gpio_data['value'], int):
-                raise ValueError('value must be int')
-            if not gpio_data['value'] in [0, 1]:
-                raise ValueError('value must be 0 or 1')
+        Connect._OPCODES['set_gpio_value'].validate(gpio_data_set)
         self._send_data(self._make_set_gpio_value_command(*gpio_data_set))
 
     def _make_set_gpio_value_command(self, *gpio_data_set):
         '''「IO設定」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_GPIO) # OP
-        data.append(0x00) # LN仮置き
-        for gpio_data in gpio_data_set:
-            data.append(gpio_data['iid']) # VID
-            data.append(gpio_data['value']) # VAL
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['set_gpio_value'].encode(gpio_data_set)
 
     def set_pwm_pulse_width(self, *pwm_data_set):
         '''V-Sido CONNECTに「PWM設定」コマンドの送信
@@ -882,37 +2030,13 @@ class Connect(object):
         '''
         if self._pwm_cycle is None:
             self._pwm_cycle = self.get_vid_pwm_cycle()
-        for pwm_data in pwm_data_set:
-            if not isinstance(pwm_data, dict):
-                raise ValueError('pwm_data_set must contain dict data')
-            if 'iid' not in pwm_data:
-                raise ValueError('missing iid in pwm_data')
-            if not isinstance(pwm_data['iid'], int):
-                raise ValueError('iid must be int')
-            if not pwm_data['iid'] in [6, 7]:
-                raise ValueError('iid must be 6 or 7')
-            if 'pulse' not in pwm_data:
-                raise ValueError('missing pulse in pwm_data')
-            if not isinstance(pwm_data['pulse'], int):
-                raise ValueError('pulse must be int')
-            if not 0 <= pwm_data['pulse'] <= self._pwm_cycle:
-                raise ValueError('pulse must be 0 - PWM_CYCLE')
+        Connect._OPCODES['set_pwm_pulse_width'].validate(pwm_data_set, pwm_cycle=self._pwm_cycle)
         self._send_data(self._make_set_pwm_pulse_width_command(*pwm_data_set))
 
     def _make_set_pwm_pulse_width_command(self, *pwm_data_set):
         '''「PWM設定」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_PWM) # OP
-        data.append(0x00) # LN仮置き
-        for pwm_data in pwm_data_set:
-            data.append(pwm_data['iid']) # VID
-            pulse_data = self.make_2bytes_data(round(pwm_data['pulse'] / 4))
-            data.append(pulse_data[0]) # ANGLE
-            data.append(pulse_data[1]) # ANGLE
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['set_pwm_pulse_width'].encode(pwm_data_set)
 
     def check_connected_servo(self, timeout=1):
         '''V-Sido CONNECTに「接続確認要求」コマンドを送信
@@ -936,35 +2060,132 @@ class Connect(object):
         '''
         if not (isinstance(timeout, int) or isinstance(timeout, float)):
             raise ValueError('timeout must be int or float')
-        return self._parse_check_connected_servo_response(self._send_data_wait_response(self._make_check_connected_servo_command(), timeout))
+        return self._parse_check_connected_servo_response(self._send_data_wait_response(self._frame_cache.get((Connect._COMMAND_OP_CHECK_SERVO,), self._make_check_connected_servo_command), timeout))
 
     def _make_check_connected_servo_command(self):
         '''「接続確認要求」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_CHECK_SERVO) # OP
-        data.append(0x00) # LN仮置き
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['check_connected_servo'].encode(())
 
     def _parse_check_connected_servo_response(self, response_data):
         '''「接続確認要求」のレスポンスデータのパース
         '''
-        if not isinstance(response_data, list):
-            raise ValueError('response_data must be list')
-        if len(response_data) < 4:
-            raise ValueError('invalid response_data length')
-        if not response_data[1] == Connect._COMMAND_OP_CHECK_SERVO:
-            raise ValueError('invalid response_data OP')
-        sid_num = (len(response_data) - 4) // 2
-        sid_data_set = tuple()
-        for i in range(0, sid_num):
-            sid_data = {}
-            sid_data['sid'] = response_data[3 + i * 2]
-            sid_data['time'] = response_data[4 + i * 2]
-            sid_data_set += (sid_data, )
-        return sid_data_set
+        return Connect._OPCODES['check_connected_servo'].parse(response_data)
+
+    def discover_servos(self, use_cache=True, cache_dir=DEFAULT_CACHE_DIR, timeout=1):
+        '''接続されているサーボの一覧と全サーボ情報の取得
+
+        「接続確認要求」で接続されているサーボを調べ、全サーボの情報(アドレス0～53)を取得する。
+        サーボ情報要求は1フレームに収まる限りまとめて送るので、少ない往復回数で取得できる。
+        取得した一覧はシリアルポートごとにキャッシュし、次回以降は接続されているサーボが同じであれば
+        サーボ情報を読み直さずにキャッシュの内容を返す。
+
+        Args:
+            use_cache(Optional[bool]): キャッシュを使うかどうか(省略した場合は使う)
+            cache_dir(Optional[str]): キャッシュを置くディレクトリ(Noneの場合はファイルに保存しない)
+            timeout(Optional[int/float]): 1回の受信タイムアウトまでの秒数(省略した場合は1秒)
+
+        Returns:
+            tuple: サーボごとの情報の辞書データ(SID順)
+                sid(int): サーボID
+                time(int): 関節角度受信までの時間(usec)
+                data(list): サーボ情報(アドレス0～53)
+                example:
+                ({'sid':1, 'time':48, 'data':[0x01, 0x02, ...]}, {'sid':2, 'time':50, 'data':[0x01, 0x02, ...]})
+
+        Raises:
+            ValueError: invalid argument
+            ConnectionError: V-Sido CONNECT is not connected
+            TimeoutError: V-Sido CONNECT response timeout
+        '''
+        if not isinstance(use_cache, bool):
+            raise ValueError('use_cache must be bool')
+        if cache_dir is not None and not isinstance(cache_dir, str):
+            raise ValueError('cache_dir must be str')
+        if not (isinstance(timeout, int) or isinstance(timeout, float)):
+            raise ValueError('timeout must be int or float')
+        connected_servo_set = self.check_connected_servo(timeout=timeout)
+        sid_set = sorted(set(sid_data['sid'] for sid_data in connected_servo_set))
+        servo_info = None
+        if use_cache:
+            servo_info = self._load_servo_inventory(cache_dir)
+            if servo_info is not None and not sorted(servo_info.keys()) == sid_set:
+                servo_info = None
+        if servo_info is None:
+            servo_info = {}
+            servo_data_set = [{'sid':sid, 'address':0, 'length':Connect._SERVO_INFO_LENGTH} for sid in sid_set]
+            for servo_data_batch in self._pack_servo_info_requests(servo_data_set):
+                for servo_data in self.get_servo_info(*servo_data_batch, timeout=timeout):
+                    servo_info[servo_data['sid']] = servo_data['data']
+            self._save_servo_inventory(cache_dir, servo_info)
+        servo_time = {}
+        for sid_data in connected_servo_set:
+            servo_time[sid_data['sid']] = sid_data['time']
+        return tuple({'sid':sid, 'time':servo_time[sid], 'data':list(servo_info[sid])} for sid in sid_set)
+
+    def _pack_servo_info_requests(self, servo_data_set):
+        '''「サーボ情報要求」を、要求とレスポンスのどちらも1フレームに収まる単位に分ける
+
+        Returns:
+            list: 1フレームで要求できるservo_data_setのリスト
+        '''
+        batches = []
+        batch = []
+        command_length = 4 # ST, OP, LN, SUM
+        response_length = 4
+        for servo_data in servo_data_set:
+            next_command_length = command_length + 3
+            next_response_length = response_length + 1 + servo_data['length']
+            if batch and (next_command_length > Connect._COMMAND_MAX_LENGTH or next_response_length > Connect._COMMAND_MAX_LENGTH):
+                batches.append(batch)
+                batch = []
+                next_command_length = 4 + 3
+                next_response_length = 4 + 1 + servo_data['length']
+            batch.append(servo_data)
+            command_length = next_command_length
+            response_length = next_response_length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _get_servo_inventory_path(self, cache_dir):
+        '''シリアルポートごとのサーボ一覧キャッシュのファイル名
+        '''
+        port_name = ''.join(c if c.isalnum() else '_' for c in str(self._port))
+        return os.path.join(cache_dir, 'servos_' + port_name + '.json')
+
+    def _load_servo_inventory(self, cache_dir):
+        '''サーボ一覧キャッシュの読み込み(キャッシュがない場合はNone)
+        '''
+        if self._port in Connect._servo_inventory_cache:
+            return Connect._servo_inventory_cache[self._port]
+        if cache_dir is None:
+            return None
+        try:
+            with open(self._get_servo_inventory_path(cache_dir), 'r') as cache_file:
+                cached = json.load(cache_file)
+            servo_info = {}
+            for sid, data in cached['servos'].items():
+                if not len(data) == Connect._SERVO_INFO_LENGTH:
+                    return None
+                servo_info[int(sid)] = data
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+        Connect._servo_inventory_cache[self._port] = servo_info
+        return servo_info
+
+    def _save_servo_inventory(self, cache_dir, servo_info):
+        '''サーボ一覧キャッシュの保存
+        '''
+        Connect._servo_inventory_cache[self._port] = servo_info
+        if cache_dir is None:
+            return
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(self._get_servo_inventory_path(cache_dir), 'w') as cache_file:
+                json.dump({'port':str(self._port), 'servos':servo_info}, cache_file)
+        except OSError as error:
+            sys.stderr.write('could not save servo inventory: %s\n' % error)
 
     def set_ik(self, *ik_data_set, feedback=False, timeout=0.5):
         '''V-Sido CONNECTに「IK設定」コマンドの送信
@@ -1041,7 +2262,7 @@ class Connect(object):
         if not feedback:
             self._send_data(self._make_set_ik_command(*ik_data_set, feedback=feedback))
         else:
-            return self._parse_ik_response(self._send_data_wait_response(self._make_set_ik_command(*ik_data_set, feedback=feedback)))
+            return self._parse_ik_response(self._send_data_wait_response(self._make_set_ik_command(*ik_data_set, feedback=feedback), timeout))
 
     def _make_set_ik_command(self, *ik_data_set, feedback):
         '''「IK設定」コマンドのデータ生成
@@ -1092,7 +2313,7 @@ class Connect(object):
 
         Args:
             *ik_set(int): IK設定情報を書いた辞書データ
-            timeout(Optional[int/float]): 受信タイムアウトするまでの秒数(省略した場合は1秒)
+            timeout(Optional[int/float]): 受信タイムアウトするまでの秒数(レスポンスがない場合はこの中で再送する、省略した場合は1秒)
 
         Returns:
             tuple: 現在のIK位置の辞書データ
@@ -1108,27 +2329,15 @@ class Connect(object):
             ConnectionError: V-Sido CONNECT is not connected
             TimeoutError: V-Sido CONNECT response timeout
         '''
-        for kid in kid_set:
-            if not isinstance(kid, int):
-                raise ValueError('kid must be int')
-            if not 0 <= kid <= 15:
-                raise ValueError('kid must be 0 - 15')
+        Connect._OPCODES['get_ik'].validate(kid_set)
         if not (isinstance(timeout, int) or isinstance(timeout, float)):
             raise ValueError('timeout must be int or float')
-        return self._parse_ik_response(response_data=self._send_data_wait_response(self._make_get_ik_command(*kid_set), timeout))
+        return self._parse_ik_response(response_data=self._send_data_wait_response(self._frame_cache.get((Connect._COMMAND_OP_IK, 'get') + kid_set, self._make_get_ik_command, *kid_set), timeout, retry=True))
 
     def _make_get_ik_command(self, *kid_set):
         '''「IK取得」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_IK) # OP
-        data.append(0x00) # LN仮置き
-        data.append(0x08) # IKF
-        for kid in kid_set:
-            data.append(kid) # KID
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['get_ik'].encode(kid_set)
 
     def _parse_ik_response(self, response_data):
         '''「IK設定」のレスポンスデータのパース
@@ -1143,31 +2352,79 @@ class Connect(object):
         ikf_use_pos = (ikf >> 3) & 0b00000001
         ikf_use_rot = (ikf >> 4) & 0b00000001
         ikf_use_tor = (ikf >> 5) & 0b00000001
-        ik_num = (len(response_data) - 5) // (1 + (ikf_use_pos + ikf_use_rot + ikf_use_tor) * 3)
+        ik_size = 1 + (ikf_use_pos + ikf_use_rot + ikf_use_tor) * 3
+        ik_num = (len(response_data) - 5) // ik_size
         ik_data_set = tuple()
         for i in range(0, ik_num):
             ik_data = {}
-            kdt_count = 0
-            ik_data['kid'] = response_data[i * 4 + 4]
+            kdt_pos = i * ik_size + 5
+            ik_data['kid'] = response_data[kdt_pos - 1]
             ik_data['kdt'] = {}
             if ikf_use_pos == 1:
-                ik_data['kdt']['x'] = response_data[i * 4 + 5] - 100
-                ik_data['kdt']['y'] = response_data[i * 4 + 6] - 100
-                ik_data['kdt']['z'] = response_data[i * 4 + 7] - 100
-                kdt_count += 3
+                ik_data['kdt']['x'] = response_data[kdt_pos] - 100
+                ik_data['kdt']['y'] = response_data[kdt_pos + 1] - 100
+                ik_data['kdt']['z'] = response_data[kdt_pos + 2] - 100
+                kdt_pos += 3
             if ikf_use_rot == 1:
-                ik_data['kdt']['rx'] = response_data[i * 4 + 5 + kdt_count] - 100
-                ik_data['kdt']['ry'] = response_data[i * 4 + 6 + kdt_count] - 100
-                ik_data['kdt']['rz'] = response_data[i * 4 + 7 + kdt_count] - 100
-                kdt_count += 3
+                ik_data['kdt']['rx'] = response_data[kdt_pos] - 100
+                ik_data['kdt']['ry'] = response_data[kdt_pos + 1] - 100
+                ik_data['kdt']['rz'] = response_data[kdt_pos + 2] - 100
+                kdt_pos += 3
             if ikf_use_tor == 1:
-                ik_data['kdt']['tx'] = response_data[i * 4 + 5 + kdt_count] - 100
-                ik_data['kdt']['ty'] = response_data[i * 4 + 6 + kdt_count] - 100
-                ik_data['kdt']['tz'] = response_data[i * 4 + 7 + kdt_count] - 100
-                kdt_count += 3
+                ik_data['kdt']['tx'] = response_data[kdt_pos] - 100
+                ik_data['kdt']['ty'] = response_data[kdt_pos + 1] - 100
+                ik_data['kdt']['tz'] = response_data[kdt_pos + 2] - 100
+                kdt_pos += 3
             ik_data_set += (ik_data,)
         return ik_data_set
 
+    def _update_ik_state(self, response_data):
+        '''受信したIK情報でKIDごとの最新値を更新
+        '''
+        try:
+            ik_data_set = self._parse_ik_response(response_data)
+        except (ValueError, IndexError):
+            return
+        received_time = self._clock.time()
+        for ik_data in ik_data_set:
+            # 辞書の差し替えは1回の代入で行うので、読み出し側がロックなしで参照しても値が混ざらない
+            self._ik_state[ik_data['kid']] = {'kid':ik_data['kid'], 'kdt':ik_data['kdt'], 'time':received_time}
+
+    def get_latest_ik(self, *kid_set):
+        '''受信済みのIK情報の最新値を返す
+
+        set_ik(feedback=True)やget_ik()、IKStreamのフィードバックで受信したIK情報を、
+        V-Sido CONNECTへの問い合わせを行わずにKIDごとの最新値として返す。
+        一度も受信していないKIDは結果に含まれない。
+
+        Args:
+            *kid_set(int): IK部位の番号(省略した場合は受信済みの全KID)
+
+        Returns:
+            tuple: IK情報の辞書データ
+                kid(int): IK部位の番号
+                kdt(dict): IK用設定データ
+                time(float): 受信した時刻(時計の時刻)
+                example:
+                ({'kid':2, 'kdt':{'x':0, 'y':0, 'z':100}, 'time':1437557212.52},)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        for kid in kid_set:
+            if not isinstance(kid, int):
+                raise ValueError('kid must be int')
+            if not 0 <= kid <= 15:
+                raise ValueError('kid must be 0 - 15')
+        ik_state = self._ik_state
+        if not kid_set:
+            kid_set = sorted(ik_state.keys())
+        ik_data_set = tuple()
+        for kid in kid_set:
+            if kid in ik_state:
+                ik_data_set += (ik_state[kid],)
+        return ik_data_set
+
     def walk(self, forward, turn_cw):
         '''V-Sido CONNECTに「移動情報指定（歩行）」コマンドの送信
 
@@ -1182,30 +2439,13 @@ class Connect(object):
             ValueError: invalid argument
             ConnectionError: V-Sido CONNECT is not connected
         '''
-        if not isinstance(forward, int):
-            raise ValueError('forward must be int')
-        if not -100 <= forward <= 100:
-            raise ValueError('forward must be -100 - 100')
-        if not isinstance(turn_cw, int):
-            raise ValueError('turn_cw must be int')
-        if not -100 <= turn_cw <= 100:
-            raise ValueError('turn_cw must be -100 - 100')
-        self._send_data(self._make_walk_command(forward, turn_cw))
+        Connect._OPCODES['walk'].validate((), forward=forward, turn_cw=turn_cw)
+        self._send_data(self._frame_cache.get((Connect._COMMAND_OP_WALK, forward, turn_cw), self._make_walk_command, forward, turn_cw))
 
     def _make_walk_command(self, forward, turn_cw):
         '''「移動情報指定（歩行）」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_WALK) # OP
-        data.append(0x00) # LN仮置き
-        data.append(0x00) # WAD(Utilityでは0で固定)
-        data.append(0x02) # WLN(現在2で固定)
-        # 速度ならびに旋回は-100〜100を0〜200に変換する
-        data.append(forward + 100)
-        data.append(turn_cw + 100)
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['walk'].encode((), forward=forward, turn_cw=turn_cw)
 
     def get_acceleration(self, timeout=1):
         '''V-Sido CONNECTに「加速度センサー値要求」コマンドの送信
@@ -1214,7 +2454,7 @@ class Connect(object):
         VID設定で接続したセンサーを正しく設定していなければならない。
 
         Args:
-            timeout(Optional[int/float]): 受信タイムアウトするまでの秒数(省略可、省略した場合は1秒)
+            timeout(Optional[int/float]): 受信タイムアウトするまでの秒数(レスポンスがない場合はこの中で再送する、省略可、省略した場合は1秒)
 
         Returns:
             dict: 加速度センサー値の辞書データ
@@ -1231,60 +2471,330 @@ class Connect(object):
         '''
         if not (isinstance(timeout, int) or isinstance(timeout, float)):
             raise ValueError('timeout must be int or float')
-        return self._parse_acceleration_response(response_data=self._send_data_wait_response(self._make_get_acceleration_command(), timeout))
+        return self._parse_acceleration_response(response_data=self._send_data_wait_response(self._frame_cache.get((Connect._COMMAND_OP_ACCELERATION,), self._make_get_acceleration_command), timeout, retry=True))
 
     def _make_get_acceleration_command(self):
         '''「加速度センサ値要求」コマンドのデータ生成
         '''
-        data = []
-        data.append(Connect._COMMAND_ST) # ST
-        data.append(Connect._COMMAND_OP_ACCELERATION) # OP
-        data.append(0x00) # LN仮置き
-        data.append(0x00) # SUM仮置き
-        return self._adjust_ln_sum(data)
+        return Connect._OPCODES['get_acceleration'].encode(())
 
     def _parse_acceleration_response(self, response_data):
         '''「加速度センサ値要求」のレスポンスデータのパース
         '''
-        if not isinstance(response_data, list):
-            raise ValueError('response_data must be list')
-        if not len(response_data) == 7:
-            raise ValueError('invalid response_data length')
-        if not response_data[1] == Connect._COMMAND_OP_ACCELERATION:
-            raise ValueError('invalid response_data OP')
-        acceleration_data = {}
-        acceleration_data['ax'] = response_data[3]
-        acceleration_data['ay'] = response_data[4]
-        acceleration_data['az'] = response_data[5]
-        return acceleration_data
+        return Connect._OPCODES['get_acceleration'].parse(response_data)
+
+    def send_command(self, name, *item_set, timeout=1, **field_set):
+        '''register_opcode()で登録したコマンドの送信
+
+        定義表から生成した関数で引数を検証して送信データを作り、レスポンスが返ってくるコマンドはレスポンスを待つ。
+
+        Args:
+            name(str): コマンド名
+            *item_set(dict/int): 繰り返す項目の辞書データ(scalar_itemsの場合は値)
+            timeout(Optional[int/float]): 受信タイムアウトするまでの秒数(省略した場合は1秒)
+            **field_set: コマンドごとに1回の項目と、検証に使う引数
 
-    def _send_data(self, command_data):
+        Returns:
+            レスポンスのパース結果(パースの定義がない場合は受信データのリスト、レスポンスがない場合はNone)
+
+        Raises:
+            ValueError: invalid argument
+            ConnectionError: V-Sido CONNECT is not connected
+            TimeoutError: V-Sido CONNECT response timeout
+        '''
+        spec = get_opcode(name)
+        for argument_name in spec.argument_names + spec.context:
+            if argument_name not in field_set:
+                raise ValueError('missing ' + argument_name)
+        for argument_name in field_set:
+            if argument_name not in spec.argument_names and argument_name not in spec.context:
+                raise ValueError('unknown argument ' + argument_name)
+        if not (isinstance(timeout, int) or isinstance(timeout, float)):
+            raise ValueError('timeout must be int or float')
+        spec.validate(item_set, **field_set)
+        command_data = spec.encode(item_set, **field_set)
+        if not spec.response:
+            self._send_data(command_data, spec.lane)
+            return None
+        response_data = self._send_data_wait_response(command_data, timeout, spec.lane)
+        if spec.parse is None:
+            return response_data
+        return spec.parse(response_data, **field_set)
+
+    def _send_data(self, command_data, lane=None, register_response=True):
         '''V-Sido CONNECTにシリアル経由でデータ送信
+
+        register_responseがFalseの場合は、レスポンスが返ってくるコマンドでもレスポンス待ちを登録しない
+        (IKStreamの周期送信のように、レスポンスを受信時のキャッシュの更新だけに使う場合)。
+        '''
+        self._write_command(command_data, Connect._DEFAULT_RESPONSE_TIMEOUT, lane, register_response=register_response)
+
+    def _send_data_wait_response(self, command_data, timeout=0.5, lane=None, retry=False):
+        '''V-Sido CONNECTにシリアル経由でデータ送信して受信を待つ
+
+        retryがTrueの場合は、レスポンスが返ってこなければtimeoutの範囲内で再送する(何度送っても結果が変わらない情報要求用)。
+        '''
+        if retry and self._query_max_retries > 0:
+            return self._send_data_wait_response_retry(command_data, timeout, lane)
+        pending_response = self._write_command(command_data, timeout, lane)
+        if pending_response is None:
+            raise ValueError('command_data has no response')
+        try:
+            # 待っている間はロックを持たないので、他のスレッドは送受信を続けられる
+            return self._clock.wait_future(pending_response.future, timeout if not timeout == 0 else None)
+        except concurrent.futures.TimeoutError:
+            with self._send_lock:
+                self._get_rtt_estimator(command_data[1]).timeouts += 1
+            raise TimeoutError('V-Sido CONNECT response timeout')
+
+    def _send_data_wait_response_retry(self, command_data, timeout, lane):
+        '''レスポンスが返ってこない場合に再送しながら受信を待つ
+
+        1回の送信で待つ時間はOPごとの往復時間の推定から求め、再送するたびに倍にする。全体ではtimeout秒を超えて待たない。
+        送信ごとのレスポンス待ちは全体の期限まで待ち行列に残すので、先に送ったデータへのレスポンスが遅れて届いた場合もその結果を使う。
+        '''
+        op = command_data[1]
+        clock = self._clock
+        max_retries = self._query_max_retries
+        deadline = clock.time() + timeout if not timeout == 0 else float('inf')
+        result_future = concurrent.futures.Future()
+        result_lock = threading.Lock()
+
+        def set_result(future):
+            # いずれかの送信へのレスポンスを結果とする(期限切れによるタイムアウトは無視する)
+            error = future.exception()
+            if isinstance(error, TimeoutError):
+                return
+            with result_lock:
+                if result_future.done():
+                    return
+                if error is None:
+                    result_future.set_result(future.result())
+                else:
+                    result_future.set_exception(error)
+
+        attempts = []
+        try:
+            while True:
+                remaining = deadline - clock.time()
+                with self._send_lock:
+                    estimator = self._get_rtt_estimator(op)
+                    if attempts:
+                        estimator.retries += 1
+                        for pending_response in attempts:
+                            pending_response.sample_rtt = False
+                    attempt_timeout = estimator.get_timeout(Connect._INITIAL_RESPONSE_TIMEOUT, self._query_min_timeout) * 2 ** len(attempts)
+                if len(attempts) >= max_retries or attempt_timeout > remaining:
+                    attempt_timeout = remaining
+                pending_response = self._write_command(command_data, remaining if remaining < float('inf') else 0, lane, sample_rtt=not attempts)
+                if pending_response is None:
+                    raise ValueError('command_data has no response')
+                attempts.append(pending_response)
+                pending_response.future.add_done_callback(set_result)
+                try:
+                    return clock.wait_future(result_future, attempt_timeout if attempt_timeout < float('inf') else None)
+                except concurrent.futures.TimeoutError:
+                    pass
+                if len(attempts) > max_retries or clock.time() >= deadline:
+                    with self._send_lock:
+                        estimator.timeouts += 1
+                    raise TimeoutError('V-Sido CONNECT response timeout')
+        finally:
+            # 戻る時は、レスポンスを受け取っていない送信の待ち行列での保持期限を、往復時間の推定から求めた時間まで縮める
+            with self._send_lock:
+                expire_time = clock.time() + self._get_rtt_estimator(op).get_timeout(Connect._INITIAL_RESPONSE_TIMEOUT, self._query_min_timeout)
+                for pending_response in attempts:
+                    if not pending_response.future.done() and pending_response.expire_time is not None:
+                        pending_response.expire_time = min(pending_response.expire_time, expire_time)
+
+    def _write_command(self, command_data, timeout, lane=None, sample_rtt=True, register_response=True):
+        '''送信データを送信レーンに積む
+
+        送信中のデータも送信待ちのデータもなければ、呼び出し元のスレッドでそのまま送信する。
+        そうでなければレーンに積み、送信スレッドが優先度の高いレーンから順に送信する。
+
+        Returns:
+            _PendingResponse: レスポンス待ち(レスポンスが返ってこないコマンドの場合はNone)
         '''
         if not self._connected:
+            if self._link_down:
+                raise LinkLostError('V-Sido CONNECT link lost')
             raise ConnectionError('V-Sido CONNECT is not connected')
         if len(command_data) > 254:
             raise ValueError('command_data too long')
-        data_bytes = b''
-        for data in command_data:
-            data_bytes += data.to_bytes(1, byteorder='little')
-        self._serial.write(data_bytes)
-        self._post_send_handler(command_data)
+        if lane is None:
+            lane = Connect._OP_LANES.get(command_data[1], Connect.LANE_BACKGROUND)
+        pending_response = None
+        if register_response and self._expects_response(command_data):
+            pending_response = _PendingResponse(command_data, timeout, sample_rtt)
+        item = _TransmitItem(command_data, pending_response, lane, self._clock.time())
+        with self._tx_condition:
+            self._tx_stats[lane]['queued'] += 1
+            if self._tx_busy or any(self._tx_lanes) or (lane == Connect.LANE_BACKGROUND and self._is_over_budget()):
+                self._tx_lanes[lane].append(item)
+                self._tx_condition.notify_all()
+                return pending_response
+            self._tx_busy = True
+        try:
+            self._transmit(item)
+        finally:
+            with self._tx_condition:
+                self._tx_busy = False
+                self._tx_condition.notify_all()
+        return pending_response
 
-    def _send_data_wait_response(self, command_data, timeout=0.5):
-        '''V-Sido CONNECTにシリアル経由でデータ送信して受信を待つ
+    def _wait_transmit_idle(self, timeout):
+        '''送信レーンに積まれたデータが全て送信されるまで待つ(Bridgeが送信の順番をクライアント間で公平にするため)
+
+        Returns:
+            bool: timeout秒以内に送信し終えた場合はTrue
         '''
-        self._response_waiting_buffer = []
+        deadline = time.monotonic() + timeout
+        with self._tx_condition:
+            while self._tx_busy or any(self._tx_lanes):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._tx_condition.wait(remaining)
+        return True
+
+    def _acquire_transmitter(self):
+        '''送信中のフレームが終わるのを待って送信の権利を得る(BoardGroupで複数の基板に同時に書き込むため)
+
+        _release_transmitter()を呼ぶまで、他のスレッドと送信スレッドの送信は待たされる。
+        '''
+        with self._tx_condition:
+            while self._tx_busy:
+                self._tx_condition.wait()
+            self._tx_busy = True
+
+    def _release_transmitter(self):
+        '''_acquire_transmitter()で得た送信の権利を返す
+        '''
+        with self._tx_condition:
+            self._tx_busy = False
+            self._tx_condition.notify_all()
+
+    def _write_acquired(self, command_data_set, queued_time):
+        '''_acquire_transmitter()で送信の権利を得た状態で、レスポンスのないコマンドを送信レーンを通さずに書き込む
+        '''
+        for command_data in command_data_set:
+            with self._tx_condition:
+                self._tx_stats[Connect.LANE_MOTION]['queued'] += 1
+            self._transmit(_TransmitItem(command_data, None, Connect.LANE_MOTION, queued_time))
+
+    def _transmit(self, item):
+        '''送信データの書き込みとレスポンス待ちの登録
+
+        書き込みとレスポンス待ちの登録はロック内でまとめて行うので、
+        フレームの途中に他のスレッドのデータが混ざることはなく、待ち行列の順序は送信順と一致する。
+        '''
+        command_data = item.command_data
+        pending_response = item.pending_response
         try:
-            self._send_data(command_data)
-        except (ConnectionError, ValueError):
+            with self._send_lock:
+                if not self._connected:
+                    if self._link_down:
+                        raise LinkLostError('V-Sido CONNECT link lost')
+                    raise ConnectionError('V-Sido CONNECT is not connected')
+                sent_time = self._clock.time()
+                if pending_response is not None:
+                    pending_response.set_sent_time(sent_time)
+                    pending_responses = self._pending_responses.setdefault(command_data[1], collections.deque())
+                    self._purge_pending_responses(pending_responses, sent_time)
+                    pending_responses.append(pending_response)
+                self._serial.write(bytes(command_data))
+        except (ConnectionError, ValueError, serial.SerialException) as error:
+            # 送信できなかった場合はレスポンス待ちを取り消して例外で終了させる
+            if pending_response is not None:
+                with self._send_lock:
+                    pending_responses = self._pending_responses.get(command_data[1])
+                    if pending_responses and pending_response in pending_responses:
+                        pending_responses.remove(pending_response)
+                if not pending_response.future.done():
+                    pending_response.future.set_exception(error)
+            if isinstance(error, serial.SerialException) and self._connected and not self._link_lost:
+                # 書き込めなかった場合は受信の異常と同じく通信路が切れたものとする
+                self._notify_link_lost(error)
             raise
-        wait_start = time.time()
-        while not self._response_waiting_buffer:
-            if not timeout == 0:
-                if time.time() - wait_start > timeout:
-                    raise TimeoutError('V-Sido CONNECT response timeout')
-        return self._response_waiting_buffer
+        with self._link_lock:
+            self._tx_meters[item.lane].add(sent_time, self.get_wire_time(len(command_data)))
+        wait_time = sent_time - item.queued_time
+        with self._tx_condition:
+            stats = self._tx_stats[item.lane]
+            stats['sent'] += 1
+            stats['wait_total'] += wait_time
+            if wait_time > stats['wait_max']:
+                stats['wait_max'] = wait_time
+        self._post_send_handler(command_data)
+
+    def _expects_response(self, command_data):
+        '''送信データに対してレスポンスが返ってくるかどうか
+        '''
+        op = command_data[1]
+        if op == Connect._COMMAND_OP_IK:
+            # IKFのbit3～5のいずれかが立っている場合のみIK情報が返ってくる
+            return (command_data[3] & 0b00111000) != 0
+        return is_response_op(op)
+
+    def _purge_pending_responses(self, pending_responses, now):
+        '''期限切れのレスポンス待ちを待ち行列の先頭から取り除く(ロック内で呼ぶこと)
+        '''
+        while pending_responses and pending_responses[0].expire_time + Connect._RESPONSE_GRACE_TIME < now:
+            pending_response = pending_responses.popleft()
+            if not pending_response.future.done():
+                pending_response.future.set_exception(TimeoutError('V-Sido CONNECT response timeout'))
+
+    def _dispatch_response(self, response_data):
+        '''受信したレスポンスを、同じOPで最も古いレスポンス待ちに渡す
+
+        レスポンス待ちは別のスレッドで受け取るので、待っている送信元がある場合だけリストに複製して渡す。
+        '''
+        with self._send_lock:
+            pending_responses = self._pending_responses.get(response_data[1])
+            if not pending_responses:
+                return None
+            now = self._clock.time()
+            self._purge_pending_responses(pending_responses, now)
+            if not pending_responses:
+                return None
+            if response_data[1] == Connect._COMMAND_OP_IK and not self._ik_response_matches(pending_responses[0].command_data, response_data):
+                # IKStreamの周期送信のようにレスポンス待ちを登録していない送信へのレスポンスは、待っている呼び出し元に渡さない
+                return None
+            pending_response = pending_responses.popleft()
+            if pending_response.sample_rtt and not pending_response.future.done():
+                self._get_rtt_estimator(response_data[1]).add(now - pending_response.sent_time)
+        if not pending_response.future.done():
+            pending_response.future.set_result(list(response_data))
+        return pending_response
+
+    def _ik_response_matches(self, command_data, response_data):
+        '''IK情報のレスポンスのKIDの並びが、送信データのKIDの並びと一致するかどうか
+        '''
+        return self._get_ik_kid_set(command_data, 0) == self._get_ik_kid_set(response_data, 3)
+
+    def _get_ik_kid_set(self, data, ikf_shift):
+        '''「IK設定」「IK取得」のデータからKIDを取り出す
+
+        IKFのikf_shiftビット目から3ビット(位置、姿勢、トルク)で、KIDごとのデータ長を決める
+        (送信データは0ビット目から、レスポンスは3ビット目から)。
+        '''
+        if len(data) < 5:
+            return ()
+        ikf = (data[3] >> ikf_shift) & 0b00000111
+        ik_size = 1 + ((ikf & 1) + ((ikf >> 1) & 1) + ((ikf >> 2) & 1)) * 3
+        return tuple(data[i] for i in range(4, len(data) - 1, ik_size))
+
+    def _fail_pending_responses(self, error):
+        '''全てのレスポンス待ちを例外で終了させる
+        '''
+        with self._send_lock:
+            pending_responses_set = list(self._pending_responses.values())
+            self._pending_responses = {}
+        for pending_responses in pending_responses_set:
+            for pending_response in pending_responses:
+                if not pending_response.future.done():
+                    pending_response.future.set_exception(error)
 
     def make_2bytes_data(self, value):
         '''数値データから2Byteデータを作る
@@ -1352,6 +2862,58 @@ class Connect(object):
         return_value = return_value_tmp >> 1
         return return_value
 
+    def make_2bytes_data_array(self, values):
+        '''数値の配列から2Byteデータの並びをまとめて作る
+
+        make_2bytes_data()を要素ごとに呼んだ結果をつなげたものと同じデータを、配列全体への1回の演算で作る。
+
+        Args:
+            values(array.array/list/tuple): 加工したい数値の並び('h'型のarray.arrayを渡すと変換を省略できる)
+
+        Returns:
+            list: 加工済み2Byteのデータを要素ごとに下位、上位の順に並べたリスト
+                example:
+                [0x0e, 0xa6, 0x10, 0x02]
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not (isinstance(values, array.array) and values.typecode == 'h'):
+            if not (isinstance(values, list) or isinstance(values, tuple) or isinstance(values, array.array)):
+                raise ValueError('values must be array, list or tuple')
+            for value in values:
+                if not isinstance(value, int):
+                    raise ValueError('value must be int')
+            if values and (max(values) > 0b0011111111111111 or min(values) < -0b0100000000000000):
+                raise ValueError('too large value')
+            values = array.array('h', values)
+        return list(_encode_2bytes_array(values))
+
+    def parse_2bytes_data_array(self, data, signed=False):
+        '''V-Sido CONNECTからの2Byteデータの並びをまとめて数値に戻す
+
+        parse_2bytes_data()を2Byteごとに呼んだ結果と同じ値を、データ全体への1回の演算で求める。
+
+        Args:
+            data(list/bytes): 2Byteのデータを要素ごとに下位、上位の順に並べたもの
+                example:
+                [0x0e, 0xa6, 0x10, 0x02]
+            signed(bool): データをsignedで扱うかunsignedで扱うか
+
+        Returns:
+            array.array: 加工して元に戻した数値の'h'型の配列
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not (isinstance(data, list) or isinstance(data, bytes) or isinstance(data, bytearray)):
+            raise ValueError('data must be list or bytes')
+        if not len(data) % 2 == 0:
+            raise ValueError('invalid response_data length')
+        if not isinstance(signed, bool):
+            raise ValueError('signed must be bool')
+        return _decode_2bytes_array(bytes(data), signed)
+
     def _adjust_ln_sum(self, command_data):
         '''データ中のLN(Length)とSUM(CheckSum)の調整
         '''
@@ -1369,6 +2931,59 @@ class Connect(object):
         '''
         return self._firmware_version
 
+# コマンドの定義表(「V-Sido CONNECT RC Command Reference」参照)
+# エラーメッセージはこれまでの公開メソッドのものに合わせている。
+# IK設定はIKFによってデータの並びが変わるので、定義表を使わずにConnect._make_set_ik_command()で作る。
+# サーボ情報要求、VID要求、IK取得はレスポンスの並びが要求ごとに変わるので、パースはConnectのメソッドで行う。
+for _spec in (
+    OpcodeSpec('set_servo_angle', Connect._COMMAND_OP_ANGLE,
+        fields=(Field('cycle_time', low=0, high=1000, divisor=10),), # CYC(引数はmsec単位で来るが、データは10msec単位で送る)
+        item_fields=(Field('sid', low=1, high=254), Field('angle', kind='word', value_type='number', low=-180, high=180, scale=10)),
+        item_set_name='angle_data_set'),
+    OpcodeSpec('set_servo_compliance', Connect._COMMAND_OP_COMPLIANCE,
+        item_fields=(Field('sid', low=1, high=254), Field('compliance_cw', low=1, high=254), Field('compliance_ccw', low=1, high=254)),
+        item_set_name='compliance_data_set'),
+    OpcodeSpec('set_servo_min_max_angle', Connect._COMMAND_OP_MIN_MAX,
+        item_fields=(Field('sid', low=0, high=254), Field('min', kind='word', value_type='number', low=-180, high=180, scale=10), Field('max', kind='word', value_type='number', low=-180, high=180, scale=10)),
+        item_set_name='min_max_data_set', constraints=(('min', 'max', 'max must be bigger than min'),)),
+    OpcodeSpec('get_servo_info', Connect._COMMAND_OP_SERVO_INFO,
+        item_fields=(Field('sid', low=0, high=254), Field('address', low=0, high=53, type_message='adress must be int', range_message='adress must be 0 - 53'), Field('length', low=1, high=54)),
+        item_set_name='servo_data_set', response=True),
+    OpcodeSpec('set_feedback_id', Connect._COMMAND_OP_FEEDBACK_ID,
+        item_fields=(Field('sid', low=0, high=254, range_message='sid must be 1 - 254'),), scalar_items=True),
+    OpcodeSpec('get_servo_feedback', Connect._COMMAND_OP_GET_FEEDBACK,
+        fields=(Field('address', low=0, high=53), Field('length', low=1, high=54, range_message='length must be int')),
+        response_fields=(Field('sid'), Field('address', kind='echo'), Field('length', kind='echo'), Field('data', kind='data', size='length')),
+        response_messages={'length':'Invalid response_data length', 'op':'Invalid response_data OP'}),
+    OpcodeSpec('set_vid_value', Connect._COMMAND_OP_SET_VID_VALUE,
+        # VIDは本来はこんなに幅が広くないが将来的に拡張する可能性と、バージョン確認(254)などに対応
+        # VDTの2Byteデータの取り扱いについては仕様書を要確認
+        item_fields=(Field('vid', low=0, high=254), Field('vdt', low=0, high=254)),
+        item_set_name='vid_data_set'),
+    OpcodeSpec('get_vid_value', Connect._COMMAND_OP_GET_VID_VALUE,
+        item_fields=(Field('vid', low=0, high=254, range_message='vid must be int'),), scalar_items=True, response=True),
+    OpcodeSpec('write_flash', Connect._COMMAND_OP_WRITE_FLASH),
+    OpcodeSpec('set_gpio_value', Connect._COMMAND_OP_GPIO,
+        item_fields=(Field('iid', choices=(4, 5, 6, 7), range_message='iid must be 4 - 7'), Field('value', choices=(0, 1))),
+        item_set_name='gpio_data_set'),
+    OpcodeSpec('set_pwm_pulse_width', Connect._COMMAND_OP_PWM,
+        # パルス幅の上限はVID設定のPWM周期なので、検証時にpwm_cycleとして渡す
+        item_fields=(Field('iid', choices=(6, 7)), Field('pulse', kind='word', low=0, high='pwm_cycle', divisor=4, range_message='pulse must be 0 - PWM_CYCLE')),
+        item_set_name='pwm_data_set', missing_name='pwm_data', context=('pwm_cycle',)),
+    OpcodeSpec('check_connected_servo', Connect._COMMAND_OP_CHECK_SERVO,
+        response_fields=(Field('sid'), Field('time'))),
+    OpcodeSpec('get_ik', Connect._COMMAND_OP_IK,
+        fields=(Field('ikf', kind='const', value=0x08),),
+        item_fields=(Field('kid', low=0, high=15),), scalar_items=True, response=True),
+    OpcodeSpec('walk', Connect._COMMAND_OP_WALK,
+        # 速度ならびに旋回は-100～100を0～200に変換する
+        fields=(Field('wad', kind='const', value=0x00), Field('wln', kind='const', value=0x02), Field('forward', low=-100, high=100, offset=100), Field('turn_cw', low=-100, high=100, offset=100))),
+    OpcodeSpec('get_acceleration', Connect._COMMAND_OP_ACCELERATION,
+        response_fields=(Field('ax'), Field('ay'), Field('az')), response_repeat=False, response_length=7),
+):
+    Connect._OPCODES[_spec.name] = register_opcode(_spec)
+
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 if __name__ == '__main__':
 
@@ -0,0 +1,156 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ IKストリーミング
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import threading
+
+import serial
+
+from vsido.periodic import PeriodicTask
+
+
+class IKStream(PeriodicTask):
+    '''IK目標値を一定周期で送信し続けるクラス
+
+    set_target()で与えた複数KIDの目標値(位置、姿勢、トルク)を、レスポンスを待たずに一定周期で送信する。
+    feedback=Trueの場合はIK情報のリターンも要求し、受信したIK情報はConnectがKIDごとの最新値として保持する。
+    最新値はget_latest()(Connect.get_latest_ik()と同じ)で待ち時間なしに読み出せる。
+    Connect(io_process=True)の場合は子プロセスで周期送信を行い、目標値の設定などは子プロセスに渡す。
+
+    example:
+        stream = vsido.IKStream(vc, rate=50)
+        stream.start()
+        stream.set_target({'kid':2, 'kdt':{'x':0, 'y':0, 'z':100}})
+        print(stream.get_latest(2))
+    '''
+
+    _KDT_GROUPS = (('x', 'y', 'z'), ('rx', 'ry', 'rz'), ('tx', 'ty', 'tz'))
+
+    def __init__(self, connect, rate=50, feedback=True):
+        '''初期化処理
+
+        Args:
+            connect(Connect): 接続済みのV-Sido CONNECTのインスタンス
+            rate(Optional[int/float]): 1秒あたりの送信回数(省略した場合は50Hz)
+            feedback(Optional[bool]): IK情報のリターンを求めるかのbool値(省略した場合フィードバックあり)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        super().__init__(rate, connect.get_clock())
+        if not isinstance(feedback, bool):
+            raise ValueError('feedback must be bool')
+        self._connect = connect
+        self._feedback = feedback
+        self._targets = {}
+        self._targets_lock = threading.Lock()
+        self._command_data = None
+        self._send_error_count = 0
+        self._remote = connect._create_remote_task('IKStream', {'rate':rate, 'feedback':feedback})
+
+    def set_target(self, *ik_data_set):
+        '''IK目標値の設定
+
+        KIDごとの目標値を更新する。次の送信周期から新しい値が送信される。
+        ひとつのフレームで送るため、全KIDで同じ組み合わせ(位置、姿勢、トルク)のデータを指定すること。
+
+        Args:
+            *ik_data_set(dict): IK設定情報を書いた辞書データ
+                kid(int): IK部位の番号
+                kdt(dict): IK用設定データ(位置x,y,z、姿勢rx,ry,rz、トルクtx,ty,tzの必要なセットのみ)
+                example:
+                {'kid':2, 'kdt':{'x':0, 'y':0, 'z':100}}, {'kid':3, 'kdt':{'x':0, 'y':0, 'z':100}}
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if self._remote is not None:
+            self._remote.call('set_target', *ik_data_set)
+            return
+        for ik_data in ik_data_set:
+            if not isinstance(ik_data, dict):
+                raise ValueError('ik_data_set must contain dict data')
+            if 'kid' not in ik_data:
+                raise ValueError('missing kid in ik_data_set')
+            if not isinstance(ik_data['kid'], int):
+                raise ValueError('kid must be int')
+            if not 0 <= ik_data['kid'] <= 15:
+                raise ValueError('kid must be 0 - 15')
+            if 'kdt' not in ik_data:
+                raise ValueError('missing kdt in ik_data_set')
+            if not isinstance(ik_data['kdt'], dict):
+                raise ValueError('kdt must contain dict data')
+            if not ik_data['kdt']:
+                raise ValueError('kdt must contain position, rotation or torque')
+            for group in IKStream._KDT_GROUPS:
+                if group[0] not in ik_data['kdt']:
+                    continue
+                for key in group:
+                    if key not in ik_data['kdt']:
+                        raise ValueError('missing ' + key + ' in kdt')
+                    if not isinstance(ik_data['kdt'][key], int):
+                        raise ValueError(key + ' must be int')
+                    if not -100 <= ik_data['kdt'][key] <= 100:
+                        raise ValueError(key + ' must be -100 - 100')
+        with self._targets_lock:
+            targets = dict(self._targets)
+            for ik_data in ik_data_set:
+                targets[ik_data['kid']] = {'kid':ik_data['kid'], 'kdt':dict(ik_data['kdt'])}
+            ik_groups = set()
+            for ik_data in targets.values():
+                ik_groups.add(tuple(group[0] in ik_data['kdt'] for group in IKStream._KDT_GROUPS))
+            if len(ik_groups) > 1:
+                raise ValueError('all kdt must contain the same data set')
+            self._targets = targets
+            # 送信データは目標値の更新時にだけ作り、周期処理では作成済みのデータを送るだけにする
+            self._command_data = self._connect._make_set_ik_command(*[targets[kid] for kid in sorted(targets)], feedback=self._feedback)
+
+    def clear_target(self, *kid_set):
+        '''IK目標値の削除
+
+        Args:
+            *kid_set(int): 送信を止めるIK部位の番号(省略した場合は全KID)
+        '''
+        if self._remote is not None:
+            self._remote.call('clear_target', *kid_set)
+            return
+        with self._targets_lock:
+            if not kid_set:
+                targets = {}
+            else:
+                targets = dict(self._targets)
+                for kid in kid_set:
+                    targets.pop(kid, None)
+            self._targets = targets
+            if targets:
+                self._command_data = self._connect._make_set_ik_command(*[targets[kid] for kid in sorted(targets)], feedback=self._feedback)
+            else:
+                self._command_data = None
+
+    def get_latest(self, *kid_set):
+        '''受信済みのIK情報の最新値を返す(Connect.get_latest_ik()参照)
+        '''
+        return self._connect.get_latest_ik(*kid_set)
+
+    def get_send_error_count(self):
+        '''送信に失敗した回数を返す
+        '''
+        if self._remote is not None:
+            return self._remote.call('get_send_error_count')
+        return self._send_error_count
+
+    def _tick(self, now):
+        '''周期ごとの目標値送信
+        '''
+        command_data = self._command_data
+        if command_data is None:
+            return
+        try:
+            # レスポンス待ちは登録しない(IK情報は受信時にConnectの最新値として保持される)
+            self._connect._send_data(command_data, register_response=False)
+        except (ConnectionError, ValueError, serial.SerialException):
+            self._send_error_count += 1
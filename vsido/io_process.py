@@ -0,0 +1,776 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ 別プロセスでの送受信
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import concurrent.futures
+import itertools
+import multiprocessing
+import pickle
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import serial
+
+from vsido.clock import VirtualClock
+from vsido.connect import Connect, DEFAULT_BAUTRATE, _PendingResponse
+
+
+def _attach_shared_memory(name, shared_tracker=False):
+    '''既存の共有メモリに接続する
+
+    作成したプロセス以外がresource_trackerに登録すると、終了時に共有メモリが削除されてしまうので登録しない。
+
+    Args:
+        name(str): 共有メモリの名前
+        shared_tracker(Optional[bool]): 作成したプロセスとresource_trackerを共有している(spawnで起動した子プロセス)場合はTrue
+    '''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python3.12以前はtrack引数がない
+        shm = shared_memory.SharedMemory(name=name)
+        if not shared_tracker:
+            # 独立したプロセスの場合は、自分のresource_trackerへの登録を取り消す
+            # (resource_trackerを共有している場合に取り消すと、作成したプロセス側の登録が消えてしまう)
+            from multiprocessing import resource_tracker
+            try:
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except Exception:
+                pass
+        return shm
+
+
+class SharedRingBuffer(object):
+    '''共有メモリ上のロックを使わないリングバッファ
+
+    書き込み側1プロセス、読み出し側1プロセスの組み合わせでのみ使える。
+    先頭に読み出し位置(head)と書き込み位置(tail)を置き、それぞれ読み出し側、書き込み側だけが更新する。
+    データは2Byteの長さを先頭に付けたフレーム単位で格納する。
+    データを書き込んでから位置を更新するので、読み出し側が書き込み途中のデータを読むことはない。
+    '''
+
+    _HEADER = struct.Struct('<QQ') # head, tail
+    _LENGTH = struct.Struct('<H')
+
+    def __init__(self, name=None, capacity=65536, shared_tracker=False):
+        '''初期化処理
+
+        Args:
+            name(Optional[str]): 接続する共有メモリの名前(省略した場合は新しく作成する)
+            capacity(Optional[int]): 新しく作成する場合のデータ領域のByte数(省略した場合は65536)
+            shared_tracker(Optional[bool]): 作成したプロセスから起動された子プロセスで接続する場合はTrue
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if name is None:
+            if not isinstance(capacity, int):
+                raise ValueError('capacity must be int')
+            if not capacity >= 1024:
+                raise ValueError('capacity must be 1024 or more')
+            self._shm = shared_memory.SharedMemory(create=True, size=SharedRingBuffer._HEADER.size + capacity)
+            self._owner = True
+            SharedRingBuffer._HEADER.pack_into(self._shm.buf, 0, 0, 0)
+        else:
+            self._shm = _attach_shared_memory(name, shared_tracker)
+            self._owner = False
+        self._buf = self._shm.buf
+        self._data = self._buf[SharedRingBuffer._HEADER.size:]
+        self._capacity = len(self._data)
+
+    def get_name(self):
+        '''共有メモリの名前を返す
+        '''
+        return self._shm.name
+
+    def put(self, data):
+        '''フレームの書き込み(書き込み側のプロセスからのみ呼ぶこと)
+
+        Args:
+            data(bytes): 書き込むデータ
+
+        Returns:
+            bool: 書き込めた場合はTrue、空きが足りなかった場合はFalse
+        '''
+        head, tail = SharedRingBuffer._HEADER.unpack_from(self._buf, 0)
+        size = SharedRingBuffer._LENGTH.size + len(data)
+        if self._capacity - (tail - head) < size:
+            return False
+        self._copy_in(tail, SharedRingBuffer._LENGTH.pack(len(data)))
+        self._copy_in(tail + SharedRingBuffer._LENGTH.size, data)
+        struct.pack_into('<Q', self._buf, 8, tail + size)
+        return True
+
+    def get(self):
+        '''フレームの読み出し(読み出し側のプロセスからのみ呼ぶこと)
+
+        Returns:
+            bytes: 読み出したデータ(データがない場合はNone)
+        '''
+        head, tail = SharedRingBuffer._HEADER.unpack_from(self._buf, 0)
+        if head == tail:
+            return None
+        length = SharedRingBuffer._LENGTH.unpack(self._copy_out(head, SharedRingBuffer._LENGTH.size))[0]
+        data = self._copy_out(head + SharedRingBuffer._LENGTH.size, length)
+        struct.pack_into('<Q', self._buf, 0, head + SharedRingBuffer._LENGTH.size + length)
+        return data
+
+    def close(self):
+        '''共有メモリの切り離し(作成した側の場合は削除も行う)
+        '''
+        self._data.release()
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def _copy_in(self, position, data):
+        '''データ領域の末尾をまたぐ場合は分割して書き込む
+        '''
+        start = position % self._capacity
+        first = min(len(data), self._capacity - start)
+        self._data[start:start + first] = data[:first]
+        if first < len(data):
+            self._data[0:len(data) - first] = data[first:]
+
+    def _copy_out(self, position, length):
+        '''データ領域の末尾をまたぐ場合は分割して読み出す
+        '''
+        start = position % self._capacity
+        first = min(length, self._capacity - start)
+        if first == length:
+            return bytes(self._data[start:start + length])
+        return bytes(self._data[start:start + first]) + bytes(self._data[0:length - first])
+
+
+# 子プロセスの生存確認と、停止の確認の間隔(秒)
+_POLL_INTERVAL = 0.05
+# リングバッファのByte数
+_RING_CAPACITY = 65536
+# 子プロセスでアプリケーション側からの呼び出しを実行するスレッドの数
+_CALL_WORKERS = 32
+
+# リングバッファで受け渡すメッセージの種類
+_MESSAGE_WRITE = 0x77 # 送信データ(親→子)
+_MESSAGE_CALL = 0x63 # メソッド呼び出し(親→子)
+_MESSAGE_RESULT = 0x72 # 送信データのレスポンスやメソッド呼び出しの結果(子→親)
+_MESSAGE_RECEIVED = 0x66 # 受信したフレーム(子→親、post_receive_handler用)
+_MESSAGE_SENT = 0x73 # 送信したフレーム(子→親、post_send_handler用)
+# メッセージの先頭: 種類(uint8) 要求番号(uint32、結果を待たない場合は0)
+_HEADER = struct.Struct('<BI')
+# 送信データの先頭: 種類 要求番号 フラグ(uint8) 送信レーン(int8、-1はOPの既定) タイムアウト(double)
+_WRITE_HEADER = struct.Struct('<BIBbd')
+_WRITE_FLAG_RESPONSE = 0x01
+_WRITE_FLAG_SAMPLE_RTT = 0x02
+# 結果の先頭: 種類 要求番号 結果の種類(uint8)
+_RESULT_HEADER = struct.Struct('<BIB')
+_RESULT_RESPONSE = 0 # レスポンスのフレーム
+_RESULT_VALUE = 1 # pickleした戻り値
+_RESULT_ERROR = 2 # pickleした例外
+
+# 子プロセスで作ることができる周期処理
+_REMOTE_TASK_CLASSES = ('IKStream', 'AccelerationSampler')
+
+
+def _dump_error(error):
+    '''例外をpickleする(pickleできない例外は内容を文字列にしたRuntimeErrorにする)
+    '''
+    try:
+        return pickle.dumps(error)
+    except Exception:
+        return pickle.dumps(RuntimeError(repr(error)))
+
+
+class _ChildConnect(Connect):
+    '''子プロセスで送受信とその処理を行うConnect
+
+    アプリケーション側でregister_opcode()したコマンドは子プロセスの一覧にないので、
+    アプリケーション側がレスポンスを待つよう指示したOPを覚えておき、そのレスポンスも待ち受ける。
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._extra_response_ops = set()
+
+    def _expects_response(self, command_data):
+        '''送信データにレスポンスが返ってくるかどうか(アプリケーション側から指示されたOPを含む)
+        '''
+        return command_data[1] in self._extra_response_ops or super()._expects_response(command_data)
+
+
+class _ChildServer(object):
+    '''子プロセスでアプリケーション側からの要求を処理するクラス
+
+    送信データは受け取った順に子プロセスのConnectの送信レーンに積み、レスポンスが届いたら結果を返す。
+    メソッド呼び出しはレスポンス待ちで送信データの受け取りが止まらないように、スレッドプールで実行する。
+    '''
+
+    def __init__(self, rx_ring, rx_ready, stop_event, forward_receive, forward_send, thread_policy):
+        self._rx_ring = rx_ring
+        self._rx_ready = rx_ready
+        self._rx_lock = threading.Lock()
+        self._stop_event = stop_event
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=_CALL_WORKERS)
+        self._tasks = {}
+        self._task_ids = itertools.count(1)
+        post_receive_handler = self._post_received_frame if forward_receive else None
+        post_send_handler = self._post_sent_frame if forward_send else None
+        self.connect = _ChildConnect(post_receive_handler=post_receive_handler, post_send_handler=post_send_handler, io_thread_policy=thread_policy)
+
+    def handle(self, message):
+        '''アプリケーション側からのメッセージの処理
+        '''
+        kind, request_id = _HEADER.unpack_from(message, 0)
+        if kind == _MESSAGE_WRITE:
+            # 送信順を保つため、送信データはその場で送信レーンに積む
+            self._write(message)
+        elif kind == _MESSAGE_CALL:
+            self._executor.submit(self._call, request_id, message[_HEADER.size:])
+
+    def close(self):
+        '''周期処理を止めて切断する
+        '''
+        for task in list(self._tasks.values()):
+            task.stop()
+        self._tasks.clear()
+        self.connect.close()
+        self.connect.stop_publishing_state()
+        self._executor.shutdown(wait=True)
+
+    def _write(self, message):
+        '''送信データを子プロセスのConnectで送り、レスポンスを待つ場合は届いた時に結果を返す
+        '''
+        kind, request_id, flags, lane, timeout = _WRITE_HEADER.unpack_from(message, 0)
+        command_data = list(message[_WRITE_HEADER.size:])
+        expects_response = bool(flags & _WRITE_FLAG_RESPONSE)
+        if expects_response and not self.connect._expects_response(command_data) and not command_data[1] == Connect._COMMAND_OP_IK:
+            self.connect._extra_response_ops.add(command_data[1])
+        try:
+            pending_response = self.connect._write_command(command_data, timeout, None if lane < 0 else lane, sample_rtt=bool(flags & _WRITE_FLAG_SAMPLE_RTT), register_response=expects_response)
+        except Exception as error:
+            if expects_response:
+                self._post_result(request_id, _RESULT_ERROR, _dump_error(error))
+            return
+        if expects_response:
+            if pending_response is None:
+                self._post_result(request_id, _RESULT_ERROR, _dump_error(ValueError('command_data has no response')))
+            else:
+                pending_response.future.add_done_callback(lambda future: self._post_response(request_id, future))
+
+    def _post_response(self, request_id, future):
+        '''レスポンス待ちの結果を返す
+        '''
+        error = future.exception()
+        if error is None:
+            self._post_result(request_id, _RESULT_RESPONSE, bytes(future.result()))
+        else:
+            self._post_result(request_id, _RESULT_ERROR, _dump_error(error))
+
+    def _call(self, request_id, payload):
+        '''子プロセスのConnectや周期処理のメソッドを呼び出して結果を返す
+        '''
+        try:
+            task_id, name, args, kwargs = pickle.loads(payload)
+            if task_id == 0 and (name == '_create_task' or name == '_wait_response'):
+                value = getattr(self, name)(*args)
+            elif task_id == 0:
+                value = getattr(self.connect, name)(*args, **kwargs)
+            else:
+                task = self._tasks.get(task_id)
+                if task is None:
+                    raise ConnectionError('task is not found')
+                value = getattr(task, name)(*args, **kwargs)
+            self._post_result(request_id, _RESULT_VALUE, pickle.dumps(value))
+        except Exception as error:
+            self._post_result(request_id, _RESULT_ERROR, _dump_error(error))
+
+    def _wait_response(self, command_data, timeout, lane, retry):
+        '''送信してレスポンスを待つ(再送、往復時間の推定、タイムアウトの集計は子プロセスのConnectで行う)
+        '''
+        if not command_data[1] == Connect._COMMAND_OP_IK:
+            # アプリケーション側でregister_opcode()したコマンドのレスポンスも待ち受ける
+            self.connect._extra_response_ops.add(command_data[1])
+        return self.connect._send_data_wait_response(command_data, timeout, lane, retry)
+
+    def _create_task(self, class_name, kwargs):
+        '''子プロセスのConnectを使う周期処理を作る
+        '''
+        if class_name == 'IKStream':
+            from vsido.ik_stream import IKStream
+            task = IKStream(self.connect, **kwargs)
+        elif class_name == 'AccelerationSampler':
+            from vsido.acceleration import AccelerationSampler
+            task = AccelerationSampler(self.connect, **kwargs)
+        else:
+            raise ValueError('class_name must be one of %s' % ', '.join(_REMOTE_TASK_CLASSES))
+        task_id = next(self._task_ids)
+        self._tasks[task_id] = task
+        return task_id
+
+    def _post_received_frame(self, received_data):
+        self._post(_HEADER.pack(_MESSAGE_RECEIVED, 0) + bytes(received_data))
+
+    def _post_sent_frame(self, sent_data):
+        self._post(_HEADER.pack(_MESSAGE_SENT, 0) + bytes(sent_data))
+
+    def _post_result(self, request_id, result_type, payload):
+        self._post(_RESULT_HEADER.pack(_MESSAGE_RESULT, request_id, result_type) + payload)
+
+    def _post(self, message):
+        '''アプリケーション側にメッセージを渡す(複数のスレッドから呼ばれるので順番に書き込む)
+        '''
+        with self._rx_lock:
+            while not self._rx_ring.put(message):
+                if self._stop_event.is_set():
+                    # 停止中はアプリケーション側が読み出さないので捨てる
+                    return
+                # アプリケーション側の読み出しが追いつくまで待つ
+                time.sleep(0.0001)
+        self._rx_ready.release()
+
+
+def _io_process_main(port, baudrate, tx_name, rx_name, tx_ready, rx_ready, stop_event, result_connection, options):
+    '''子プロセスの処理
+
+    Connectでシリアルポートを開き、フレームの処理、レスポンス待ち、サーボ情報などの最新値の保持、
+    周期処理(IKStream、AccelerationSampler)と送信をこのプロセスで行う。
+    最新値はpublish_state()の共有メモリでアプリケーション側に公開する。
+    接続できた場合はresult_connectionでファームウェアのバージョンと共有メモリの名前を、
+    接続できなかった場合はエラーの内容を親プロセスに知らせる。
+    '''
+    forward_receive, forward_send, thread_policy = options
+    tx_ring = SharedRingBuffer(tx_name, shared_tracker=True)
+    rx_ring = SharedRingBuffer(rx_name, shared_tracker=True)
+    server = _ChildServer(rx_ring, rx_ready, stop_event, forward_receive, forward_send, thread_policy)
+    state_name = server.connect.publish_state()
+    try:
+        server.connect.open(port, baudrate)
+    except serial.SerialException as error:
+        result_connection.send((str(error), None, None))
+        server.connect.stop_publishing_state()
+        tx_ring.close()
+        rx_ring.close()
+        return
+    result_connection.send((None, server.connect.get_firmware_version(), state_name))
+    parent_process = multiprocessing.parent_process()
+    try:
+        while not stop_event.is_set():
+            if not tx_ready.acquire(timeout=_POLL_INTERVAL):
+                if parent_process is not None and not parent_process.is_alive():
+                    # 親プロセスが終了した場合
+                    break
+                continue
+            message = tx_ring.get()
+            while message is not None:
+                server.handle(message)
+                message = tx_ring.get()
+    finally:
+        stop_event.set()
+        server.close()
+        tx_ring.close()
+        rx_ring.close()
+
+
+class _RemoteTask(object):
+    '''子プロセスで動いている周期処理の呼び出し口
+
+    IKStream、AccelerationSamplerがConnect(io_process=True)で作られた場合に持ち、メソッド呼び出しを子プロセスに渡す。
+    作った後に切断(再接続)した場合は、子プロセスの周期処理はなくなっているのでConnectionErrorになる。
+    '''
+
+    def __init__(self, connect, task_id, generation):
+        self._connect = connect
+        self._task_id = task_id
+        self._generation = generation
+
+    def call(self, name, *args, **kwargs):
+        '''子プロセスの周期処理のメソッドを呼び出す
+
+        Raises:
+            ConnectionError: 作った時の接続が切れている場合発生
+        '''
+        if not self._generation == self._connect._generation:
+            raise ConnectionError('V-Sido CONNECT is not connected')
+        return self._connect._call(self._task_id, name, args, kwargs)
+
+
+class ProcessConnect(Connect):
+    '''送受信とその処理を子プロセスで行うConnect(Connect(io_process=True)で作られる)
+
+    子プロセスのConnectがシリアルポートの送受信、フレームの処理、レスポンス待ち、往復時間の推定、
+    サーボ情報やIK情報の最新値の保持を行い、このプロセスで作ったIKStream、AccelerationSamplerの周期処理も子プロセスで動く。
+    アプリケーション側のスレッドの負荷(GILの競合)で受信や送信、周期処理が遅れることがなくなる。
+    送信データと結果は共有メモリ上のリングバッファで受け渡し、get_latest_ik()、get_servo_mirror()は
+    子プロセスがpublish_state()で公開している共有メモリ(StateReader)から読み出す。
+    その他の送信コマンドや設定、統計の取得は子プロセスのConnectで実行され、結果(例外を含む)が返る。
+    時計は実時間(SystemClock)のみで、BoardGroupのボードには使えない。
+    '''
+
+    def __init__(self, post_receive_handler=None, post_send_handler=None, debug=False, io_process=True, io_thread_policy=None, clock=None):
+        '''初期化処理(Connect.__init__()参照)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if isinstance(clock, VirtualClock):
+            raise ValueError('clock must be SystemClock when io_process is True')
+        super().__init__(post_receive_handler, post_send_handler, debug, io_process, io_thread_policy, clock)
+        # 受信、送信したフレームを子プロセスから受け取るかどうか(送受信後に呼び出す関数がある場合だけ受け取る)
+        self._forward_receive = post_receive_handler is not None or debug
+        self._forward_send = post_send_handler is not None or debug
+        self._process = None
+        self._state_reader = None
+        self._state_name = None
+        # 子プロセスの結果を待っている要求(要求番号ごとのFuture)
+        self._requests = {}
+        self._request_lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._tx_lock = threading.Lock()
+        # 接続ごとに増える番号(切断前に作った周期処理の呼び出し口を無効にする)
+        self._generation = 0
+
+    def open(self, port, baudrate=DEFAULT_BAUTRATE):
+        '''子プロセスを起動してV-Sido CONNECTにシリアルポート経由で接続(Connect.open()参照)
+
+        子プロセスがV-Sido CONNECTのファームウェアのバージョンを取得できるまで戻らない。
+
+        Args:
+            port(str): シリアルポート文字列
+            baudrate(Optional[int]): 通信速度
+
+        Raises:
+            ValueError: invalid argument
+            serial.SerialException: シリアルポートがオープンできなかった場合発生
+        '''
+        if self._connected:
+            return
+        if not isinstance(port, str):
+            raise ValueError('port must be str when io_process is True')
+        from vsido.shared_state import StateReader
+        tx_ring = SharedRingBuffer(capacity=_RING_CAPACITY)
+        rx_ring = SharedRingBuffer(capacity=_RING_CAPACITY)
+        # スレッドを持つプロセスからforkしないように、spawnで子プロセスを起動する
+        context = multiprocessing.get_context('spawn')
+        tx_ready = context.Semaphore(0)
+        rx_ready = context.Semaphore(0)
+        stop_event = context.Event()
+        result_connection, child_connection = context.Pipe(duplex=False)
+        options = (self._forward_receive, self._forward_send, self._io_thread_policy)
+        process = context.Process(target=_io_process_main, args=(port, baudrate, tx_ring.get_name(), rx_ring.get_name(), tx_ready, rx_ready, stop_event, child_connection, options))
+        process.daemon = True
+        process.start()
+        # Connect.open()と同じく、V-Sido CONNECTが応答するまで待ち続ける
+        while not result_connection.poll(_POLL_INTERVAL):
+            if not process.is_alive():
+                break
+        try:
+            error, firmware_version, state_name = result_connection.recv() if result_connection.poll() else ('io process terminated', None, None)
+        except EOFError:
+            error = 'io process terminated'
+        if error is not None:
+            stop_event.set()
+            process.join()
+            tx_ring.close()
+            rx_ring.close()
+            raise serial.SerialException(error)
+        # 子プロセスとresource_trackerを共有しているので、子プロセスが作った共有メモリの登録を取り消さない
+        self._state_reader = StateReader(state_name, shared_tracker=True)
+        self._state_name = state_name
+        self._process = process
+        self._tx_ring = tx_ring
+        self._rx_ring = rx_ring
+        self._tx_ready = tx_ready
+        self._rx_ready = rx_ready
+        self._stop_event = stop_event
+        self._baudrate = baudrate
+        self._port = port
+        self._firmware_version = firmware_version
+        self._generation += 1
+        self._connected = True
+        self._receiver_alive = True
+        self._receiver_thread = threading.Thread(target=self._io_receiver)
+        self._receiver_thread.daemon = True
+        self._receiver_thread.start()
+
+    def close(self):
+        '''子プロセスを止めてV-Sido CONNECTから切断する
+        '''
+        if self._process is None:
+            return
+        with self._request_lock:
+            self._connected = False
+        self._stop_event.set()
+        self._tx_ready.release()
+        self._process.join()
+        self._receiver_alive = False
+        self._rx_ready.release()
+        self._receiver_thread.join()
+        self._fail_requests(ConnectionError('V-Sido CONNECT is not connected'))
+        state_reader = self._state_reader
+        self._state_reader = None
+        if not self._process.exitcode == 0:
+            # 子プロセスが異常終了した場合は、子プロセスが削除できなかった状態公開用の共有メモリを削除する
+            try:
+                state_reader._shm.unlink()
+            except FileNotFoundError:
+                pass
+        state_reader.close()
+        with self._tx_lock:
+            self._tx_ring.close()
+            self._rx_ring.close()
+            self._tx_ring = None
+        self._process = None
+        self._reset_values()
+
+    def is_connected(self):
+        '''V-Sidoとの接続確認(Connect.is_connected()参照)
+
+        Returns:
+            bool: 接続している時はTrue、接続していない時はFalseを返す
+        '''
+        if not self._connected:
+            return False
+        try:
+            return self._call(0, 'is_connected', (), {})
+        except ConnectionError:
+            return False
+
+    def publish_state(self, name=None):
+        '''ロボットの最新状態を公開している共有メモリの名前を返す
+
+        子プロセスが接続した時から公開しているので、新しく作らずにその名前を返す。
+
+        Args:
+            name(Optional[str]): 指定できない(省略すること)
+
+        Returns:
+            str: 共有メモリの名前
+
+        Raises:
+            ValueError: invalid argument
+            ConnectionError: 接続していない場合発生
+        '''
+        if name is not None:
+            raise ValueError('name cannot be specified when io_process is True')
+        if self._state_name is None or not self._connected:
+            raise ConnectionError('V-Sido CONNECT is not connected')
+        return self._state_name
+
+    def stop_publishing_state(self):
+        '''何もしない(子プロセスの公開はget_latest_ik()などが使うので、切断するまで止めない)
+        '''
+        pass
+
+    def get_servo_mirror(self, sid):
+        '''サーボ情報の写しを共有メモリから読み出す(Connect.get_servo_mirror()参照)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not isinstance(sid, int):
+            raise ValueError('sid must be int')
+        if not 0 <= sid <= 254:
+            raise ValueError('sid must be 0 - 254')
+        state_reader = self._state_reader
+        if state_reader is None:
+            return None
+        return state_reader.get_servo_mirror(sid)
+
+    def get_latest_ik(self, *kid_set):
+        '''受信済みのIK情報の最新値を共有メモリから読み出す(Connect.get_latest_ik()参照)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        for kid in kid_set:
+            if not isinstance(kid, int):
+                raise ValueError('kid must be int')
+            if not 0 <= kid <= 15:
+                raise ValueError('kid must be 0 - 15')
+        state_reader = self._state_reader
+        if state_reader is None:
+            return tuple()
+        if not kid_set:
+            kid_set = range(0, 16)
+        ik_data_set = tuple()
+        for kid in kid_set:
+            ik_data = state_reader.get_ik(kid)
+            if ik_data is not None:
+                ik_data_set += (ik_data,)
+        return ik_data_set
+
+    def _create_remote_task(self, class_name, kwargs):
+        '''子プロセスで周期処理を作り、その呼び出し口を返す
+
+        Raises:
+            ConnectionError: 接続していない場合発生
+        '''
+        if not self._connected:
+            raise ConnectionError('V-Sido CONNECT is not connected')
+        task_id = self._call(0, '_create_task', (class_name, kwargs), {})
+        return _RemoteTask(self, task_id, self._generation)
+
+    def _write_command(self, command_data, timeout, lane=None, sample_rtt=True, register_response=True):
+        '''送信データを子プロセスに渡す(子プロセスのConnectが送信レーンに積んで送る)
+
+        Returns:
+            _PendingResponse: レスポンス待ち(子プロセスからレスポンスが届くと結果が設定される。
+                レスポンスが返ってこないコマンドの場合はNone)
+
+        Raises:
+            ConnectionError: 接続していない場合発生
+        '''
+        if not self._connected:
+            raise ConnectionError('V-Sido CONNECT is not connected')
+        if len(command_data) > 254:
+            raise ValueError('command_data is too long')
+        pending_response = None
+        request_id = 0
+        flags = _WRITE_FLAG_SAMPLE_RTT if sample_rtt else 0
+        if register_response and self._expects_response(command_data):
+            pending_response = _PendingResponse(command_data, timeout, sample_rtt)
+            request_id = self._add_request(pending_response.future)
+            flags |= _WRITE_FLAG_RESPONSE
+        message = _WRITE_HEADER.pack(_MESSAGE_WRITE, request_id, flags, -1 if lane is None else lane, timeout) + bytes(command_data)
+        self._put_message(message, request_id)
+        return pending_response
+
+    def _send_data_wait_response(self, command_data, timeout=0.5, lane=None, retry=False):
+        '''送信データを子プロセスに渡してレスポンスを待つ(Connect._send_data_wait_response()参照)
+
+        レスポンスを待つ処理(再送、タイムアウト)は子プロセスのConnectで行い、結果や例外だけを受け取る。
+        '''
+        if not self._expects_response(command_data):
+            raise ValueError('command_data has no response')
+        return self._call(0, '_wait_response', (list(command_data), timeout, lane, retry), {})
+
+    def _call(self, task_id, name, args, kwargs):
+        '''子プロセスのConnect(task_idが0の場合)や周期処理のメソッドを呼び出して結果を返す
+
+        Raises:
+            ConnectionError: 接続していない場合や、子プロセスが終了した場合発生
+        '''
+        future = concurrent.futures.Future()
+        request_id = self._add_request(future)
+        self._put_message(_HEADER.pack(_MESSAGE_CALL, request_id) + pickle.dumps((task_id, name, args, kwargs)), request_id)
+        return future.result()
+
+    def _add_request(self, future):
+        '''結果を待つ要求を登録して要求番号を返す
+        '''
+        with self._request_lock:
+            if not self._connected:
+                raise ConnectionError('V-Sido CONNECT is not connected')
+            request_id = next(self._request_ids) % 0xffffffff + 1
+            self._requests[request_id] = future
+        return request_id
+
+    def _put_message(self, message, request_id):
+        '''子プロセスにメッセージを渡す(渡せなかった場合は要求の登録を取り消す)
+        '''
+        try:
+            with self._tx_lock:
+                tx_ring = self._tx_ring
+                if tx_ring is None:
+                    raise ConnectionError('V-Sido CONNECT is not connected')
+                if len(message) + SharedRingBuffer._LENGTH.size > tx_ring._capacity:
+                    raise ValueError('message is too long')
+                while not tx_ring.put(message):
+                    # 子プロセスが止まっている場合は送信用のリングバッファが空かないので、待ち続けずに例外にする
+                    if not self._process.is_alive():
+                        raise ConnectionError('io process terminated')
+                    time.sleep(0.0001)
+                self._tx_ready.release()
+        except Exception:
+            if request_id:
+                with self._request_lock:
+                    self._requests.pop(request_id, None)
+            raise
+
+    def _fail_requests(self, error):
+        '''結果を待っている要求を全て例外で終わらせる
+        '''
+        with self._request_lock:
+            requests = self._requests
+            self._requests = {}
+        for future in requests.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _io_receiver(self):
+        '''子プロセスからのメッセージを受け取るスレッドの処理
+        '''
+        rx_ring = self._rx_ring
+        rx_ready = self._rx_ready
+        process = self._process
+        while self._receiver_alive:
+            if not rx_ready.acquire(timeout=_POLL_INTERVAL):
+                if not process.is_alive():
+                    # 子プロセスが異常終了した場合は、結果を待っている要求を全て終わらせる
+                    with self._request_lock:
+                        self._connected = False
+                    self._fail_requests(ConnectionError('io process terminated'))
+                    return
+                continue
+            message = rx_ring.get()
+            while message is not None:
+                self._handle_message(message)
+                message = rx_ring.get()
+
+    def _handle_message(self, message):
+        '''子プロセスからのメッセージの処理
+        '''
+        kind, request_id = _HEADER.unpack_from(message, 0)
+        if kind == _MESSAGE_RESULT:
+            result_type = message[_HEADER.size]
+            payload = message[_RESULT_HEADER.size:]
+            with self._request_lock:
+                future = self._requests.pop(request_id, None)
+            if future is None or future.done():
+                return
+            if result_type == _RESULT_RESPONSE:
+                future.set_result(list(payload))
+            elif result_type == _RESULT_VALUE:
+                future.set_result(pickle.loads(payload))
+            else:
+                future.set_exception(pickle.loads(payload))
+        elif kind == _MESSAGE_RECEIVED:
+            self._post_receive_handler(message[_HEADER.size:])
+        elif kind == _MESSAGE_SENT:
+            self._post_send_handler(message[_HEADER.size:])
+
+
+def _make_forwarder(name):
+    '''子プロセスのConnectのメソッドを呼び出すメソッドを作る
+    '''
+    def forwarder(self, *args, **kwargs):
+        if not self._connected:
+            raise ConnectionError('V-Sido CONNECT is not connected')
+        return self._call(0, name, args, kwargs)
+    forwarder.__name__ = name
+    forwarder.__qualname__ = 'ProcessConnect.' + name
+    forwarder.__doc__ = getattr(Connect, name).__doc__
+    return forwarder
+
+
+# 子プロセスのConnectで実行するメソッド
+for _name in (
+        'set_link_budget', 'get_link_stats', 'get_background_rate_scale',
+        'set_frame_cache_size', 'get_frame_cache_stats', 'clear_frame_cache',
+        'get_tx_lane_stats', 'set_query_retry', 'get_response_stats',
+        'start_watchdog', 'stop_watchdog', 'get_watchdog_stats', 'get_io_thread_status',
+        'set_servo_angle', 'set_servo_compliance', 'set_servo_min_max_angle', 'get_servo_settings', 'get_servo_angle_limits',
+        'get_servo_info', 'set_servo_info_batching', 'set_feedback_id', 'get_servo_feedback',
+        'set_vid_io_mode', 'set_vid_use_pwm', 'set_vid_pwm_cycle', 'set_vid_value',
+        'get_vid_version', 'get_vid_pwm_cycle', 'get_pwm_cycle', 'get_vid_value',
+        'write_flash', 'set_gpio_value', 'set_pwm_pulse_width', 'check_connected_servo', 'discover_servos',
+        'set_ik', 'get_ik', 'walk', 'get_acceleration',
+        '_send_servo_angle_array', '_wait_transmit_idle'):
+    setattr(ProcessConnect, _name, _make_forwarder(_name))
+del _name
@@ -0,0 +1,575 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ ダイレクトティーチングの記録と再生
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import array
+import collections
+import itertools
+import json
+import os
+import struct
+import sys
+import threading
+import zlib
+
+import serial
+
+from vsido.connect import Connect
+from vsido.opcodes import _decode_2bytes_array
+from vsido.periodic import PeriodicTask
+
+# ファイルの形式
+#   ヘッダー: マジック、バージョン、メタデータ(JSON)の長さ、メタデータ
+#   チャンク: サンプル数、列数、列ごとの圧縮後の長さ、列ごとの圧縮データ(差分をzlibで圧縮したもの)
+#   索引: チャンクごとの(位置、サンプル数)
+#   末尾: 索引の位置、チャンク数、終端マーク
+# 列は時刻(記録開始からのusec、'q'型)とサーボごとの角度(0.1度単位、'h'型)で、値はリトルエンディアンで書く。
+# 索引がない(記録中に終了した)ファイルは、チャンクを先頭からたどって読む。
+_FILE_MAGIC = b'VSMR'
+_FILE_VERSION = 1
+_HEADER_FORMAT = '<4sHI'
+_CHUNK_FORMAT = '<II'
+_INDEX_FORMAT = '<QI'
+_TRAILER_FORMAT = '<QI4s'
+_TRAILER_MAGIC = b'VSME'
+_TIME_TYPECODE = 'q'
+_ANGLE_TYPECODE = 'h'
+# 再生時の1回の「目標角度設定」で移行できる最大の時間(msec)
+_MAX_CYCLE_TIME = 1000
+
+
+def _to_little_endian(values):
+    '''配列をリトルエンディアンのByte列にする
+    '''
+    if sys.byteorder == 'little':
+        return values.tobytes()
+    values = array.array(values.typecode, values)
+    values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode, data):
+    '''リトルエンディアンのByte列から配列を作る
+    '''
+    values = array.array(typecode)
+    values.frombytes(data)
+    if not sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def _encode_column(values):
+    '''列を差分にしてzlibで圧縮する(ゆっくり変わる値は差分がほとんど0になるので良く縮む)
+    '''
+    deltas = array.array(values.typecode, [values[0]] if values else [])
+    deltas.extend(map(int.__sub__, values[1:], values[:-1]))
+    return zlib.compress(_to_little_endian(deltas))
+
+
+def _decode_column(typecode, data):
+    '''_encode_column()で圧縮した列を戻す
+    '''
+    return array.array(typecode, itertools.accumulate(_from_little_endian(typecode, zlib.decompress(data))))
+
+
+def reduce_keyframes(times, angle_columns, tolerance):
+    '''Ramer-Douglas-Peuckerのアルゴリズムで、直線補間で再現できるサンプルを間引く
+
+    残したキーフレームの間を直線で補間した時に、どのサーボの角度もtolerance以上ずれないように間引く。
+
+    Args:
+        times(array.array/list): 時刻の並び(昇順)
+        angle_columns(list): サーボごとの角度の並び
+        tolerance(int/float): 許容する角度のずれ(度)
+
+    Returns:
+        list: 残すサンプルの位置(昇順)
+
+    Raises:
+        ValueError: invalid argument
+    '''
+    if not (isinstance(tolerance, int) or isinstance(tolerance, float)):
+        raise ValueError('tolerance must be int or float')
+    if not tolerance >= 0:
+        raise ValueError('tolerance must be 0 or more')
+    count = len(times)
+    if count <= 2:
+        return list(range(0, count))
+    keep = bytearray(count)
+    keep[0] = 1
+    keep[count - 1] = 1
+    # 再帰の代わりに区間のスタックを使う
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        time_first = times[first]
+        span = times[last] - time_first
+        max_error = -1.0
+        max_index = first
+        for column in angle_columns:
+            angle_first = column[first]
+            slope = (column[last] - angle_first) / span if span > 0 else 0.0
+            for i in range(first + 1, last):
+                error = abs(column[i] - (angle_first + slope * (times[i] - time_first)))
+                if error > max_error:
+                    max_error = error
+                    max_index = i
+        if max_error > tolerance:
+            keep[max_index] = 1
+            stack.append((first, max_index))
+            stack.append((max_index, last))
+    return [i for i in range(0, count) if keep[i]]
+
+
+class MotionRecorder(PeriodicTask):
+    '''ダイレクトティーチングでロボットの姿勢を記録するクラス
+
+    指定したサーボをフィードバックIDに設定し、一定周期で「フィードバック要求」を送信して、
+    指定したアドレスの2Byteデータ(現在角度)を時刻とともにファイルに記録する。
+    要求はレスポンスを待たずに最大pipeline_depth個まで先に送るので、往復時間より短い周期でも記録できる。
+    時刻はレスポンスを受信した時刻で、取得できなかった周期は記録せずに数える。
+    記録はchunk_sizeサンプルごとに列ごとに圧縮してファイルに追記する(形式はMotionRecordingを参照)。
+
+    compliance=(cw, ccw)を指定した場合は、記録中だけ対象のサーボのコンプライアンスを下げて手で動かしやすくし、
+    停止時に接続後に送信済みの値(Connect.get_servo_settings())に戻す。
+
+    example:
+        recorder = vsido.MotionRecorder(vc, 'wave.vsmr', (2, 3, 4), address=19, rate=100, compliance=(10, 10))
+        recorder.start()
+        time.sleep(10)
+        recorder.stop()
+        recording = vsido.MotionRecording('wave.vsmr')
+        recording.play(vc, tolerance=0.5)
+    '''
+
+    def __init__(self, connect, path, sid_set, address, rate=100, pipeline_depth=4, chunk_size=1000, compliance=None):
+        '''初期化処理
+
+        Args:
+            connect(Connect): 接続済みのV-Sido CONNECTのインスタンス
+            path(str): 記録するファイルのパス
+            sid_set(list/tuple): 記録するサーボID
+            address(int): 現在角度のサーボ情報のアドレス(範囲は0～52、サーボの仕様に合わせて指定する)
+            rate(Optional[int/float]): 1秒あたりの記録回数(省略した場合は100Hz)
+            pipeline_depth(Optional[int]): レスポンスを待たずに送る要求の数(省略した場合は4)
+            chunk_size(Optional[int]): 1チャンクのサンプル数(省略した場合は1000)
+            compliance(Optional[tuple]): 記録中のコンプライアンススロープ値(cw, ccw)(省略した場合は変更しない)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        super().__init__(rate, connect.get_clock())
+        if not isinstance(path, str):
+            raise ValueError('path must be str')
+        if not (isinstance(sid_set, list) or isinstance(sid_set, tuple)):
+            raise ValueError('sid_set must be list or tuple')
+        if not sid_set:
+            raise ValueError('sid_set must not be empty')
+        for sid in sid_set:
+            if not isinstance(sid, int):
+                raise ValueError('sid must be int')
+            if not 1 <= sid <= 254:
+                raise ValueError('sid must be 1 - 254')
+        if not len(set(sid_set)) == len(sid_set):
+            raise ValueError('sid_set must not contain duplicate sid')
+        if not isinstance(address, int):
+            raise ValueError('address must be int')
+        if not 0 <= address <= 52:
+            raise ValueError('address must be 0 - 52')
+        if not isinstance(pipeline_depth, int):
+            raise ValueError('pipeline_depth must be int')
+        if not 1 <= pipeline_depth <= 16:
+            raise ValueError('pipeline_depth must be 1 - 16')
+        if not isinstance(chunk_size, int):
+            raise ValueError('chunk_size must be int')
+        if not chunk_size > 0:
+            raise ValueError('chunk_size must be bigger than 0')
+        if compliance is not None:
+            if not (isinstance(compliance, tuple) and len(compliance) == 2):
+                raise ValueError('compliance must be tuple of cw and ccw')
+            for value in compliance:
+                if not isinstance(value, int):
+                    raise ValueError('compliance must be int')
+                if not 1 <= value <= 254:
+                    raise ValueError('compliance must be 1 - 254')
+        self._connect = connect
+        self._path = path
+        self._sid_set = tuple(sid_set)
+        self._address = address
+        self._pipeline_depth = pipeline_depth
+        self._chunk_size = chunk_size
+        self._compliance = compliance
+        self._command_data = None
+        self._in_flight = collections.deque()
+        # 受信スレッドから渡されるレスポンス(受信時刻, レスポンスデータ)
+        self._received = collections.deque()
+        self._file = None
+        self._chunk_index = []
+        self._start_time = None
+        self._columns = None
+        self._sample_count = 0
+        self._dropped_count = 0
+        self._restore_settings = ()
+        self._recording_lock = threading.Lock()
+
+    def start(self):
+        '''記録の開始(フィードバックIDの設定とファイルの作成を行う)
+
+        Raises:
+            ConnectionError: V-Sido CONNECT is not connected
+            OSError: ファイルを作成できなかった場合発生
+        '''
+        if self._alive:
+            return
+        connect = self._connect
+        if self._compliance is not None:
+            self._restore_settings = tuple(servo_settings for servo_settings in connect.get_servo_settings(*self._sid_set) if 'compliance_cw' in servo_settings)
+            connect.set_servo_compliance(*[{'sid':sid, 'compliance_cw':self._compliance[0], 'compliance_ccw':self._compliance[1]} for sid in self._sid_set])
+        connect.set_feedback_id(*self._sid_set)
+        self._command_data = bytes(connect._make_get_servo_feedback_command(self._address, 2))
+        self._file = open(self._path, 'wb')
+        self._chunk_index = []
+        self._start_time = self._clock.time()
+        metadata = json.dumps({'sid_set':list(self._sid_set), 'address':self._address, 'rate':self._rate, 'start_time':self._start_time}).encode('utf-8')
+        self._file.write(struct.pack(_HEADER_FORMAT, _FILE_MAGIC, _FILE_VERSION, len(metadata)))
+        self._file.write(metadata)
+        self._columns = self._make_columns()
+        self._sample_count = 0
+        self._dropped_count = 0
+        self._overrun_count = 0
+        self._in_flight.clear()
+        self._received.clear()
+        super().start()
+
+    def stop(self, timeout=1):
+        '''記録の停止(送信済みの要求のレスポンスを待ってから、残りを書き込んでファイルを閉じる)
+
+        Args:
+            timeout(Optional[int/float]): 送信済みの要求のレスポンスを待つ秒数(省略した場合は1秒)
+        '''
+        if not self._alive:
+            return
+        super().stop()
+        deadline = self._clock.time() + timeout
+        for pending_response in list(self._in_flight):
+            try:
+                self._clock.wait_future(pending_response.future, max(0.0, deadline - self._clock.time()))
+            except Exception:
+                pass
+        with self._recording_lock:
+            self._drain()
+            self._dropped_count += len(self._in_flight)
+            self._in_flight.clear()
+            self._flush_chunk()
+            index_offset = self._file.tell()
+            for offset, count in self._chunk_index:
+                self._file.write(struct.pack(_INDEX_FORMAT, offset, count))
+            self._file.write(struct.pack(_TRAILER_FORMAT, index_offset, len(self._chunk_index), _TRAILER_MAGIC))
+            self._file.close()
+            self._file = None
+        if self._restore_settings:
+            try:
+                self._connect.set_servo_compliance(*[{'sid':servo_settings['sid'], 'compliance_cw':servo_settings['compliance_cw'], 'compliance_ccw':servo_settings['compliance_ccw']} for servo_settings in self._restore_settings])
+            except ConnectionError:
+                pass
+
+    def get_sample_count(self):
+        '''記録したサンプル数を返す
+        '''
+        return self._sample_count
+
+    def get_dropped_count(self):
+        '''記録できなかったサンプル数(タイムアウト、要求の詰まり、周期遅れによる実行の飛ばし)を返す
+        '''
+        return self._dropped_count + self._overrun_count
+
+    def _make_columns(self):
+        return [array.array(_TIME_TYPECODE)] + [array.array(_ANGLE_TYPECODE) for sid in self._sid_set]
+
+    def _on_response(self, future):
+        '''レスポンスを受け取った時の処理(受信スレッドで呼ばれるので、受信時刻を付けて渡すだけにする)
+        '''
+        if future.cancelled() or future.exception() is not None:
+            self._received.append((None, None))
+        else:
+            self._received.append((self._clock.time(), future.result()))
+
+    def _drain(self):
+        '''受け取ったレスポンスを列に追加する(_recording_lockの中で呼ぶ)
+        '''
+        in_flight = self._in_flight
+        while in_flight and in_flight[0].future.done():
+            in_flight.popleft()
+        received = self._received
+        columns = self._columns
+        sid_count = len(self._sid_set)
+        expected_sid_set = list(self._sid_set)
+        while received:
+            received_time, response_data = received.popleft()
+            if response_data is None:
+                self._dropped_count += 1
+                continue
+            # SID、下位、上位の3Byteずつ並んでいる
+            body = response_data[3:-1]
+            if not (len(body) == sid_count * 3 and body[0::3] == expected_sid_set):
+                self._dropped_count += 1
+                continue
+            word_data = bytearray(sid_count * 2)
+            word_data[0::2] = body[1::3]
+            word_data[1::2] = body[2::3]
+            angles = _decode_2bytes_array(bytes(word_data), True)
+            columns[0].append(round((received_time - self._start_time) * 1000000))
+            for i in range(0, sid_count):
+                columns[i + 1].append(angles[i])
+            self._sample_count += 1
+        if len(columns[0]) >= self._chunk_size:
+            self._flush_chunk()
+
+    def _flush_chunk(self):
+        '''たまったサンプルを1チャンクとして圧縮して追記する(_recording_lockの中で呼ぶ)
+        '''
+        columns = self._columns
+        count = len(columns[0])
+        if count == 0:
+            return
+        compressed = [_encode_column(column) for column in columns]
+        self._chunk_index.append((self._file.tell(), count))
+        self._file.write(struct.pack(_CHUNK_FORMAT, count, len(compressed)))
+        self._file.write(struct.pack('<%dI' % len(compressed), *[len(data) for data in compressed]))
+        for data in compressed:
+            self._file.write(data)
+        self._file.flush()
+        self._columns = self._make_columns()
+
+    def _tick(self, now):
+        '''周期ごとのフィードバック要求の送信と、受け取ったレスポンスの記録
+        '''
+        with self._recording_lock:
+            self._drain()
+        if len(self._in_flight) >= self._pipeline_depth:
+            # 先に送った要求のレスポンスが返ってこない場合は、この周期の要求を送らない
+            self._dropped_count += 1
+            return
+        try:
+            pending_response = self._connect._write_command(self._command_data, self._period * self._pipeline_depth, Connect.LANE_CONTROL)
+        except (ConnectionError, ValueError, serial.SerialException):
+            self._dropped_count += 1
+            return
+        self._in_flight.append(pending_response)
+        pending_response.future.add_done_callback(self._on_response)
+
+
+class MotionRecording(object):
+    '''MotionRecorderで記録したファイルの読み込みと再生
+
+    開いた時にはヘッダーと索引だけを読み、列のデータは要求された範囲のチャンクだけを展開する。
+    列はarray.arrayで返すので、NumPyを使う場合はnumpy.frombuffer()でコピーせずに配列として扱える。
+
+    example:
+        recording = vsido.MotionRecording('wave.vsmr')
+        times = recording.read_column('time')
+        angles = recording.read_column(2, 0, 500)
+    '''
+
+    def __init__(self, path):
+        '''初期化処理
+
+        Args:
+            path(str): 記録したファイルのパス
+
+        Raises:
+            ValueError: invalid file
+            OSError: ファイルを読み込めなかった場合発生
+        '''
+        if not isinstance(path, str):
+            raise ValueError('path must be str')
+        self._path = path
+        with open(path, 'rb') as recording_file:
+            header = recording_file.read(struct.calcsize(_HEADER_FORMAT))
+            if not len(header) == struct.calcsize(_HEADER_FORMAT):
+                raise ValueError('invalid recording file')
+            magic, version, metadata_length = struct.unpack(_HEADER_FORMAT, header)
+            if not (magic == _FILE_MAGIC and version == _FILE_VERSION):
+                raise ValueError('invalid recording file')
+            self._metadata = json.loads(recording_file.read(metadata_length).decode('utf-8'))
+            self._sid_set = tuple(self._metadata['sid_set'])
+            data_offset = recording_file.tell()
+            self._chunk_index = self._read_index(recording_file, data_offset)
+        # チャンクごとの先頭のサンプル位置
+        self._chunk_starts = list(itertools.accumulate([0] + [count for offset, count in self._chunk_index]))
+
+    def _read_index(self, recording_file, data_offset):
+        '''索引を読む(索引がない場合はチャンクを先頭からたどる)
+        '''
+        trailer_size = struct.calcsize(_TRAILER_FORMAT)
+        file_size = recording_file.seek(0, os.SEEK_END)
+        if file_size >= data_offset + trailer_size:
+            recording_file.seek(file_size - trailer_size)
+            index_offset, chunk_count, magic = struct.unpack(_TRAILER_FORMAT, recording_file.read(trailer_size))
+            index_size = struct.calcsize(_INDEX_FORMAT)
+            if magic == _TRAILER_MAGIC and index_offset + chunk_count * index_size + trailer_size == file_size:
+                recording_file.seek(index_offset)
+                index_data = recording_file.read(chunk_count * index_size)
+                return [struct.unpack_from(_INDEX_FORMAT, index_data, i * index_size) for i in range(0, chunk_count)]
+        chunk_index = []
+        offset = data_offset
+        chunk_header_size = struct.calcsize(_CHUNK_FORMAT)
+        while offset + chunk_header_size <= file_size:
+            recording_file.seek(offset)
+            count, column_count = struct.unpack(_CHUNK_FORMAT, recording_file.read(chunk_header_size))
+            if not (count > 0 and column_count == len(self._sid_set) + 1):
+                break
+            lengths = struct.unpack('<%dI' % column_count, recording_file.read(4 * column_count))
+            end = offset + chunk_header_size + 4 * column_count + sum(lengths)
+            if end > file_size:
+                # 書き込み途中のチャンクは捨てる
+                break
+            chunk_index.append((offset, count))
+            offset = end
+        return chunk_index
+
+    def get_metadata(self):
+        '''記録時の設定(sid_set、address、rate、start_time)を返す
+        '''
+        return dict(self._metadata)
+
+    def get_sid_set(self):
+        '''記録したサーボIDを返す
+        '''
+        return self._sid_set
+
+    def get_sample_count(self):
+        '''サンプル数を返す
+        '''
+        return self._chunk_starts[-1]
+
+    def get_chunk_count(self):
+        '''チャンク数を返す
+        '''
+        return len(self._chunk_index)
+
+    def read_column(self, name, start=0, stop=None):
+        '''列を読み出す(範囲にかかるチャンクだけを展開する)
+
+        Args:
+            name(str/int): 'time'(記録開始からの秒数)かサーボID(角度、度単位)
+            start(Optional[int]): 最初のサンプル位置(省略した場合は先頭)
+            stop(Optional[int]): 最後のサンプル位置の次(省略した場合は末尾まで)
+
+        Returns:
+            array.array: 'd'型の配列
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if name == 'time':
+            column_number = 0
+        elif name in self._sid_set:
+            column_number = self._sid_set.index(name) + 1
+        else:
+            raise ValueError('unknown column ' + str(name))
+        sample_count = self.get_sample_count()
+        if stop is None:
+            stop = sample_count
+        if not (isinstance(start, int) and isinstance(stop, int)):
+            raise ValueError('start and stop must be int')
+        start = max(0, min(start, sample_count))
+        stop = max(start, min(stop, sample_count))
+        typecode = _TIME_TYPECODE if column_number == 0 else _ANGLE_TYPECODE
+        divisor = 1000000 if column_number == 0 else 10
+        values = array.array('d')
+        with open(self._path, 'rb') as recording_file:
+            for i in range(0, len(self._chunk_index)):
+                chunk_start = self._chunk_starts[i]
+                chunk_stop = self._chunk_starts[i + 1]
+                if chunk_stop <= start or chunk_start >= stop:
+                    continue
+                column = _decode_column(typecode, self._read_chunk_column(recording_file, i, column_number))
+                values.extend([value / divisor for value in column[max(start, chunk_start) - chunk_start:min(stop, chunk_stop) - chunk_start]])
+        return values
+
+    def _read_chunk_column(self, recording_file, chunk_number, column_number):
+        '''チャンクから1列分の圧縮データを読む
+        '''
+        offset, count = self._chunk_index[chunk_number]
+        chunk_header_size = struct.calcsize(_CHUNK_FORMAT)
+        recording_file.seek(offset)
+        count, column_count = struct.unpack(_CHUNK_FORMAT, recording_file.read(chunk_header_size))
+        lengths = struct.unpack('<%dI' % column_count, recording_file.read(4 * column_count))
+        recording_file.seek(sum(lengths[:column_number]), os.SEEK_CUR)
+        return recording_file.read(lengths[column_number])
+
+    def get_keyframes(self, tolerance=0):
+        '''再生用のキーフレームを返す
+
+        Args:
+            tolerance(Optional[int/float]): 間引く時に許容する角度のずれ(度、省略した場合は間引かない)
+
+        Returns:
+            list: (時刻(秒), サーボIDの順の角度のタプル)のリスト
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        times = self.read_column('time')
+        angle_columns = [self.read_column(sid) for sid in self._sid_set]
+        if tolerance > 0:
+            indexes = reduce_keyframes(times, angle_columns, tolerance)
+        else:
+            reduce_keyframes(times, [], tolerance)
+            indexes = range(0, len(times))
+        return [(times[i], tuple(column[i] for column in angle_columns)) for i in indexes]
+
+    def play(self, connect, tolerance=0, speed=1.0):
+        '''記録した動きを「目標角度設定」で再生する(再生が終わるまで戻らない)
+
+        キーフレームごとに、次のキーフレームまでの時間をcycle_timeとして目標角度を送信する。
+        1000msecを超える間隔は、直線補間した中間の角度で分けて送信する。
+
+        Args:
+            connect(Connect): 接続済みのV-Sido CONNECTのインスタンス
+            tolerance(Optional[int/float]): 間引く時に許容する角度のずれ(度、省略した場合は間引かない)
+            speed(Optional[int/float]): 再生速度の倍率(省略した場合は記録した速さ)
+
+        Raises:
+            ValueError: invalid argument
+            ConnectionError: V-Sido CONNECT is not connected
+        '''
+        if not (isinstance(speed, int) or isinstance(speed, float)):
+            raise ValueError('speed must be int or float')
+        if not speed > 0:
+            raise ValueError('speed must be bigger than 0')
+        keyframes = self.get_keyframes(tolerance)
+        if not keyframes:
+            return
+        sid_set = list(self._sid_set)
+        # 最初の姿勢にはすぐに移る
+        connect._send_servo_angle_array(sid_set, _clamp_angles(keyframes[0][1]), 0)
+        clock = connect.get_clock()
+        start_time = clock.time()
+        previous_time, previous_angles = keyframes[0]
+        for keyframe_time, angles in keyframes[1:]:
+            interval = (keyframe_time - previous_time) / speed
+            steps = max(1, int(-(-interval * 1000 // _MAX_CYCLE_TIME)))
+            for step in range(1, steps + 1):
+                ratio = step / steps
+                step_angles = [previous + (angle - previous) * ratio for previous, angle in zip(previous_angles, angles)]
+                # 送信した角度に向けて、次の送信時刻までかけて移行させる
+                send_time = start_time + (previous_time - keyframes[0][0]) / speed + interval * (step - 1) / steps
+                delay = send_time - clock.time()
+                if delay > 0:
+                    clock.sleep(delay)
+                connect._send_servo_angle_array(sid_set, _clamp_angles(step_angles), min(_MAX_CYCLE_TIME, round(interval * 1000 / steps)))
+            previous_time, previous_angles = keyframe_time, angles
+
+
+def _clamp_angles(angles):
+    '''角度を「目標角度設定」の範囲に収める
+    '''
+    return [min(max(angle, -180.0), 180.0) for angle in angles]
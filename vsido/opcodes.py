@@ -0,0 +1,520 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ コマンドの定義表
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import array
+import functools
+import keyword
+import operator
+import sys
+
+_COMMAND_ST = 0xff
+_FIELD_KINDS = ('byte', 'word', 'const', 'echo', 'data')
+_VALUE_TYPES = ('int', 'number', None)
+_RESPONSE_MESSAGES = {
+    'type':'response_data must be list',
+    'length':'invalid response_data length',
+    'op':'invalid response_data OP',
+}
+
+# 登録済みのコマンド(名前をキーにする)
+_opcodes = {}
+# レスポンスが返ってくるOP
+_response_ops = set()
+
+
+def _encode_2bytes_array(values):
+    '''数値の配列をまとめて2Byteデータに変形する(make_2bytes_data()の一括版)
+
+    配列全体を1つの多倍長整数として扱い、シフトとマスクを1回ずつ行うことで全要素を同時に変形する。
+    各要素の16bitの範囲外にはみ出したビットはマスクで落ちるので、隣の要素に影響しない。
+
+    Args:
+        values(array.array): 'h'型の配列(範囲は-16384～16383)
+
+    Returns:
+        bytes: 要素ごとに下位、上位の順に並べた2Byteデータ
+
+    Raises:
+        ValueError: 範囲外の値が含まれる場合発生
+    '''
+    if not values:
+        return b''
+    if max(values) > 0b0011111111111111 or min(values) < -0b0100000000000000: #変換できる数値は14bitまで
+        raise ValueError('too large value')
+    raw = values.tobytes() if sys.byteorder == 'little' else _byteswapped(values).tobytes()
+    packed = int.from_bytes(raw, byteorder='little')
+    # 全体を左に1bitシフトした下位バイトと、さらに1bitシフトした上位バイトを組み合わせる
+    mask_low = int.from_bytes(b'\xfe\x00' * len(values), byteorder='little')
+    mask_high = int.from_bytes(b'\x00\xfe' * len(values), byteorder='little')
+    encoded = ((packed << 1) & mask_low) | ((packed << 2) & mask_high)
+    return encoded.to_bytes(len(raw), byteorder='little')
+
+
+def _decode_2bytes_array(data, signed=False):
+    '''2Byteデータの並びをまとめて数値に戻す(parse_2bytes_data()の一括版)
+
+    Args:
+        data(bytes): 要素ごとに下位、上位の順に並べた2Byteデータ
+        signed(bool): データをsignedで扱うかunsignedで扱うか
+
+    Returns:
+        array.array: 'h'型の配列
+    '''
+    values = array.array('h')
+    if not data:
+        return values
+    packed = int.from_bytes(data, byteorder='little')
+    count = len(data) // 2
+    # 下位バイトの上位7bitと上位バイトの上位7bitをつなげて14bitの数値に戻す
+    decoded = ((packed & int.from_bytes(b'\xfe\x00' * count, byteorder='little')) >> 1) | ((packed & int.from_bytes(b'\x00\xfe' * count, byteorder='little')) >> 2)
+    if signed:
+        # 14bit目の符号ビットを15、16bit目に広げる
+        sign = decoded & int.from_bytes(b'\x00\x20' * count, byteorder='little')
+        decoded |= (sign << 1) | (sign << 2)
+    values.frombytes(decoded.to_bytes(len(data), byteorder='little'))
+    if not sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def _byteswapped(values):
+    '''ビッグエンディアンの環境で、配列をリトルエンディアンの並びにしたコピーを返す
+    '''
+    values = array.array(values.typecode, values)
+    values.byteswap()
+    return values
+
+
+def _decode_word(low, high, signed):
+    '''2Byteデータ1つを数値に戻す(parse_2bytes_data()と同じ結果)
+    '''
+    value = (low >> 1) | ((high >> 1) << 7)
+    if signed and value & 0x2000:
+        value -= 0x4000
+    return value
+
+
+class Field(object):
+    '''コマンドの1項目の定義
+
+    kindは次のいずれか。
+        byte: 1Byteの値(送信時はscaleを掛けるかdivisorで割って丸め、offsetを足す。受信時はその逆)
+        word: 2Byteデータ(make_2bytes_data()と同じ形式で、変換後の範囲は-16384～16383)
+        const: 引数を取らない固定の1Byte(valueの値)
+        echo: レスポンスのパース結果に要求時の同じ名前の引数をそのまま入れる(レスポンス専用)
+        data: sizeで指定した長さのByteのリスト(レスポンス専用、sizeは数値か要求時の引数名)
+    low、highには数値の他に、検証時に渡す引数の名前(OpcodeSpecのcontext)を指定できる。
+    '''
+    __slots__ = ('name', 'kind', 'value_type', 'low', 'high', 'choices', 'scale', 'divisor', 'offset', 'value', 'size', 'signed', 'type_message', 'range_message')
+
+    def __init__(self, name, kind='byte', value_type='int', low=None, high=None, choices=None, scale=None, divisor=None, offset=0, value=None, size=None, signed=False, type_message=None, range_message=None):
+        '''初期化処理
+
+        Args:
+            name(str): 項目名(辞書データのキー、引数名)
+            kind(Optional[str]): 'byte'、'word'、'const'、'echo'、'data'のいずれか(省略した場合は'byte')
+            value_type(Optional[str]): 'int'、'number'(intかfloat)、None(検証しない)のいずれか
+            low(Optional[int/float/str]): 最小値
+            high(Optional[int/float/str]): 最大値
+            choices(Optional[tuple]): 取りうる値
+            scale(Optional[int/float]): 送信時に掛ける値
+            divisor(Optional[int/float]): 送信時に割る値
+            offset(Optional[int]): 送信時に足す値
+            value(Optional[int]): constの値
+            size(Optional[int/str]): dataの長さ
+            signed(Optional[bool]): wordをsignedで受信するかどうか
+            type_message(Optional[str]): 型が違う場合のエラーメッセージ
+            range_message(Optional[str]): 範囲外の場合のエラーメッセージ
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not (isinstance(name, str) and name.isidentifier() and not keyword.iskeyword(name) and not name.startswith('_')):
+            raise ValueError('name must be identifier')
+        if kind not in _FIELD_KINDS:
+            raise ValueError('kind must be byte, word, const, echo or data')
+        if value_type not in _VALUE_TYPES:
+            raise ValueError('value_type must be int, number or None')
+        if kind == 'const' and not (isinstance(value, int) and 0 <= value <= 254):
+            raise ValueError('value must be 0 - 254')
+        if kind == 'data' and not (isinstance(size, int) or isinstance(size, str)):
+            raise ValueError('size must be int or str')
+        if scale is not None and divisor is not None:
+            raise ValueError('scale and divisor can not be set together')
+        self.name = name
+        self.kind = kind
+        self.value_type = value_type
+        self.low = low
+        self.high = high
+        self.choices = tuple(choices) if choices is not None else None
+        self.scale = scale
+        self.divisor = divisor
+        self.offset = offset
+        self.value = value
+        self.size = size
+        self.signed = signed
+        if type_message is None:
+            type_message = name + (' must be int' if value_type == 'int' else ' must be int or float')
+        if range_message is None:
+            if self.choices is not None:
+                range_message = name + ' must be ' + ' or '.join(str(choice) for choice in self.choices)
+            else:
+                range_message = '%s must be %s - %s' % (name, low, high)
+        self.type_message = type_message
+        self.range_message = range_message
+
+    def get_wire_size(self):
+        '''送信データ中のByte数(dataは長さが決まらないのでNone)
+        '''
+        if self.kind == 'word':
+            return 2
+        if self.kind == 'echo':
+            return 0
+        if self.kind == 'data':
+            return self.size if isinstance(self.size, int) else None
+        return 1
+
+    def _make_check_lines(self, var, indent):
+        '''値の検証のコード
+        '''
+        lines = []
+        if self.value_type == 'int':
+            lines.append('if not isinstance(%s, int):' % var)
+            lines.append('    raise ValueError(%r)' % self.type_message)
+        elif self.value_type == 'number':
+            lines.append('if not (isinstance(%s, int) or isinstance(%s, float)):' % (var, var))
+            lines.append('    raise ValueError(%r)' % self.type_message)
+        if self.choices is not None:
+            lines.append('if not %s in %r:' % (var, self.choices))
+            lines.append('    raise ValueError(%r)' % self.range_message)
+        if self.low is not None or self.high is not None:
+            if self.high is None:
+                condition = '%s >= %s' % (var, _bound(self.low))
+            elif self.low is None:
+                condition = '%s <= %s' % (var, _bound(self.high))
+            else:
+                condition = '%s <= %s <= %s' % (_bound(self.low), var, _bound(self.high))
+            lines.append('if not %s:' % condition)
+            lines.append('    raise ValueError(%r)' % self.range_message)
+        return [indent + line for line in lines]
+
+    def _make_encode_expression(self, var):
+        '''送信する値の式
+        '''
+        if self.scale is not None:
+            var = 'round(%s * %r)' % (var, self.scale)
+        elif self.divisor is not None:
+            var = 'round(%s / %r)' % (var, self.divisor)
+        if self.offset:
+            var = '(%s + %r)' % (var, self.offset)
+        return var
+
+    def _make_decode_expression(self, var):
+        '''受信した値の式
+        '''
+        if self.offset:
+            var = '(%s - %r)' % (var, self.offset)
+        if self.scale is not None:
+            var = '%s / %r' % (var, self.scale)
+        elif self.divisor is not None:
+            var = '%s * %r' % (var, self.divisor)
+        return var
+
+
+def _bound(bound):
+    '''範囲の端の式(文字列は検証時の引数名)
+    '''
+    return bound if isinstance(bound, str) else repr(bound)
+
+
+class OpcodeSpec(object):
+    '''V-Sido CONNECTのコマンドの定義
+
+    コマンドのデータは、ST、OP、LNの後にfields(コマンドごとに1回)、item_fields(辞書データごとに繰り返し)を並べ、最後にSUMを置く。
+    定義から、引数を検証する関数(validate)、送信データを作る関数(encode)、レスポンスをパースする関数(parse)を
+    Pythonのコードとして生成してコンパイルするので、項目ごとに分岐する汎用の処理より速い。
+    生成したコードはsourceで確認できる。
+
+        validate(item_set, **field_set): 引数の検証(エラーはValueError)
+        encode(item_set, **field_set): 送信データ(LN、SUM調整済みのリスト)を返す
+        parse(response_data, **field_set): レスポンスのパース結果を返す(response_fieldsがない場合はNone)
+
+    example:
+        spec = vsido.OpcodeSpec('set_servo_torque', 0x75,
+            item_fields=(vsido.Field('sid', low=1, high=254), vsido.Field('torque', choices=(0, 1))),
+            item_set_name='torque_data_set')
+        vsido.register_opcode(spec)
+        vc.send_command('set_servo_torque', {'sid':1, 'torque':0})
+    '''
+
+    def __init__(self, name, op, fields=(), item_fields=(), item_set_name=None, missing_name=None, scalar_items=False, constraints=(), context=(), response=False, response_fields=(), response_repeat=True, response_length=None, response_messages=None, lane=None):
+        '''初期化処理
+
+        Args:
+            name(str): コマンド名
+            op(int): OP(範囲は0～254)
+            fields(Optional[tuple]): コマンドごとに1回の項目(Field)
+            item_fields(Optional[tuple]): 辞書データごとに繰り返す項目(Field)
+            item_set_name(Optional[str]): エラーメッセージに使う辞書データの並びの名前(省略した場合はname + '_data_set')
+            missing_name(Optional[str]): キーがない場合のエラーメッセージに使う名前(省略した場合はitem_set_name)
+            scalar_items(Optional[bool]): 辞書データの代わりに値をそのまま並べるかどうか(item_fieldsは1つだけ)
+            constraints(Optional[tuple]): 辞書データ内の大小関係の(小さい方の項目名、大きい方の項目名、エラーメッセージ)
+            context(Optional[tuple]): 検証時にだけ渡す引数名(Fieldのlow、highに使う)
+            response(Optional[bool]): レスポンスが返ってくるかどうか
+            response_fields(Optional[tuple]): レスポンスの1件分の項目(Field)
+            response_repeat(Optional[bool]): レスポンスの項目を最後まで繰り返すかどうか(Falseの場合は1件の辞書データを返す)
+            response_length(Optional[int]): レスポンスの長さ(省略した場合は4Byte以上)
+            response_messages(Optional[dict]): レスポンスのエラーメッセージ('type'、'length'、'op')
+            lane(Optional[int]): 送信レーン(省略した場合はOPから決める)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not (isinstance(name, str) and name.isidentifier()):
+            raise ValueError('name must be identifier')
+        if not isinstance(op, int):
+            raise ValueError('op must be int')
+        if not 0 <= op <= 254:
+            raise ValueError('op must be 0 - 254')
+        fields = tuple(fields)
+        item_fields = tuple(item_fields)
+        response_fields = tuple(response_fields)
+        for field in fields + item_fields + response_fields:
+            if not isinstance(field, Field):
+                raise ValueError('fields must contain Field')
+        for field in fields + item_fields:
+            if field.kind in ('echo', 'data'):
+                raise ValueError(field.kind + ' can be used only in response_fields')
+        if scalar_items and not (len(item_fields) == 1 and item_fields[0].kind in ('byte', 'word')):
+            raise ValueError('scalar_items needs one byte or word field')
+        argument_names = [field.name for field in fields if not field.kind == 'const']
+        for field in response_fields:
+            if field.kind == 'echo' and field.name not in argument_names:
+                raise ValueError('unknown echo field ' + field.name)
+            if field.kind == 'data' and isinstance(field.size, str) and field.size not in argument_names:
+                raise ValueError('unknown data size ' + field.size)
+        if response_fields and response_repeat and not any(field.kind in ('byte', 'word', 'data') for field in response_fields):
+            raise ValueError('response_fields must contain received field')
+        self.name = name
+        self.op = op
+        self.fields = fields
+        self.item_fields = item_fields
+        self.item_set_name = item_set_name if item_set_name is not None else name + '_data_set'
+        self.missing_name = missing_name if missing_name is not None else self.item_set_name
+        self.scalar_items = scalar_items
+        self.constraints = tuple(constraints)
+        self.context = tuple(context)
+        self.response = response or bool(response_fields)
+        self.response_fields = response_fields
+        self.response_repeat = response_repeat
+        self.response_length = response_length
+        self.response_messages = dict(_RESPONSE_MESSAGES)
+        self.response_messages.update(response_messages or {})
+        self.lane = lane
+        self.argument_names = tuple(argument_names)
+        self.source = ''
+        self.validate = None
+        self.encode = None
+        self.parse = None
+        self._compile()
+
+    def _compile(self):
+        '''検証、送信データ作成、パースの関数を生成する
+        '''
+        lines = []
+        lines.extend(self._make_validate_source())
+        lines.extend(self._make_encode_source())
+        if self.response_fields:
+            lines.extend(self._make_parse_source())
+        self.source = '\n'.join(lines)
+        namespace = {
+            'array':array,
+            '_encode_2bytes_array':_encode_2bytes_array,
+            '_decode_word':_decode_word,
+            '_reduce':functools.reduce,
+            '_xor':operator.xor,
+        }
+        exec(compile(self.source, '<vsido opcode %s>' % self.name, 'exec'), namespace)
+        self.validate = namespace['validate']
+        self.encode = namespace['encode']
+        self.parse = namespace.get('parse')
+
+    def _make_parameters(self, first, names):
+        return ', '.join([first] + list(names) + ['**_ignored'])
+
+    def _make_validate_source(self):
+        lines = ['def validate(%s):' % self._make_parameters('_item_set', self.argument_names + self.context)]
+        for field in self.fields:
+            if not field.kind == 'const':
+                lines.extend(field._make_check_lines(field.name, '    '))
+        value_fields = [field for field in self.item_fields if not field.kind == 'const']
+        if self.scalar_items:
+            lines.append('    for _value in _item_set:')
+            lines.extend(value_fields[0]._make_check_lines('_value', '        '))
+        elif value_fields:
+            lines.append('    for _item in _item_set:')
+            lines.append('        if not isinstance(_item, dict):')
+            lines.append('            raise ValueError(%r)' % (self.item_set_name + ' must contain dict data'))
+            for field in value_fields:
+                lines.append('        if %r not in _item:' % field.name)
+                lines.append('            raise ValueError(%r)' % ('missing ' + field.name + ' in ' + self.missing_name))
+                lines.append('        _value = _item[%r]' % field.name)
+                lines.extend(field._make_check_lines('_value', '        '))
+            for low_name, high_name, message in self.constraints:
+                lines.append('        if _item[%r] < _item[%r]:' % (high_name, low_name))
+                lines.append('            raise ValueError(%r)' % message)
+        lines.append('    return None')
+        lines.append('')
+        return lines
+
+    def _make_encode_source(self):
+        header_size = 3 + sum(field.get_wire_size() for field in self.fields)
+        item_size = sum(field.get_wire_size() for field in self.item_fields)
+        lines = ['def encode(%s):' % self._make_parameters('_item_set', self.argument_names)]
+        # ST、OP、LN(仮置き)と、コマンドごとに1回の項目
+        header = ['%d' % _COMMAND_ST, '%d' % self.op, '0']
+        for field in self.fields:
+            if field.kind == 'const':
+                header.append('%d' % field.value)
+            elif field.kind == 'byte':
+                header.append(field._make_encode_expression(field.name))
+            else:
+                lines.append("    _word_%s = _encode_2bytes_array(array.array('h', [%s]))" % (field.name, field._make_encode_expression(field.name)))
+                header.extend(['_word_%s[0]' % field.name, '_word_%s[1]' % field.name])
+        lines.append('    _data = [%s]' % ', '.join(header))
+        # 繰り返す項目
+        var = '_item' if self.scalar_items else None
+        values = [field._make_encode_expression(var if var is not None else '_item[%r]' % field.name) if not field.kind == 'const' else '%d' % field.value for field in self.item_fields]
+        if self.scalar_items and self.item_fields[0].kind == 'byte':
+            if values[0] == '_item':
+                lines.append('    _data += _item_set')
+            else:
+                lines.append('    _data += [%s for _item in _item_set]' % values[0])
+        elif self.scalar_items:
+            lines.append("    _data += _encode_2bytes_array(array.array('h', [%s for _item in _item_set]))" % values[0])
+        elif any(field.kind == 'word' for field in self.item_fields):
+            # 2Byteデータは全要素をまとめて変換し、項目ごとに間隔item_sizeのスライスで書き込む
+            lines.append('    _data += [0] * (len(_item_set) * %d)' % item_size)
+            position = header_size
+            for field, value in zip(self.item_fields, values):
+                if field.kind == 'word':
+                    lines.append("    _words = _encode_2bytes_array(array.array('h', [%s for _item in _item_set]))" % value)
+                    lines.append('    _data[%d::%d] = _words[0::2] # %s' % (position, item_size, field.name))
+                    lines.append('    _data[%d::%d] = _words[1::2] # %s' % (position + 1, item_size, field.name))
+                elif field.kind == 'const':
+                    lines.append('    _data[%d::%d] = [%s] * len(_item_set) # %s' % (position, item_size, value, field.name))
+                else:
+                    lines.append('    _data[%d::%d] = [%s for _item in _item_set] # %s' % (position, item_size, value, field.name))
+                position += field.get_wire_size()
+        elif self.item_fields:
+            lines.append('    for _item in _item_set:')
+            lines.append('        _data += (%s,)' % ', '.join(values))
+        lines.append('    _data.append(0) # SUM仮置き')
+        lines.append('    _data[2] = len(_data) # LN')
+        # SUMの位置は0なので、全体のXORがそのままSUMになる
+        lines.append('    _data[-1] = _reduce(_xor, _data) # SUM')
+        lines.append('    return _data')
+        lines.append('')
+        return lines
+
+    def _make_parse_source(self):
+        messages = self.response_messages
+        lines = ['def parse(%s):' % self._make_parameters('response_data', self.argument_names)]
+        lines.append('    if not isinstance(response_data, list):')
+        lines.append('        raise ValueError(%r)' % messages['type'])
+        sizes = [field.get_wire_size() for field in self.response_fields if not field.kind == 'echo']
+        if self.response_length is not None:
+            lines.append('    if not len(response_data) == %d:' % self.response_length)
+        elif not self.response_repeat and None not in sizes:
+            # 1件だけ返ってくる場合は、項目がすべて入っているかを確かめる
+            lines.append('    if len(response_data) < %d:' % (4 + sum(sizes)))
+        else:
+            lines.append('    if len(response_data) < 4:')
+        lines.append('        raise ValueError(%r)' % messages['length'])
+        lines.append('    if not response_data[1] == %d:' % self.op)
+        lines.append('        raise ValueError(%r)' % messages['op'])
+        # 1件分の辞書データの式を作る(位置は_positionからの相対)
+        offset = []
+        items = []
+        for field in self.response_fields:
+            position = ' + '.join(['_position'] + offset)
+            if field.kind == 'echo':
+                items.append('%r:%s' % (field.name, field.name))
+                continue
+            if field.kind == 'const':
+                offset.append('1')
+                continue
+            if field.kind == 'byte':
+                items.append('%r:%s' % (field.name, field._make_decode_expression('response_data[%s]' % position)))
+                offset.append('1')
+            elif field.kind == 'word':
+                value = '_decode_word(response_data[%s], response_data[%s + 1], %r)' % (position, position, field.signed)
+                items.append('%r:%s' % (field.name, field._make_decode_expression(value)))
+                offset.append('2')
+            else:
+                size = str(field.size)
+                items.append('%r:response_data[%s:%s + %s]' % (field.name, position, position, size))
+                offset.append(size)
+        record = '{' + ', '.join(items) + '}'
+        if self.response_repeat:
+            lines.append('    _size = %s' % ' + '.join(offset))
+            lines.append('    _records = []')
+            lines.append('    for _position in range(3, 3 + (len(response_data) - 4) // _size * _size, _size):')
+            lines.append('        _records.append(%s)' % record)
+            lines.append('    return tuple(_records)')
+        else:
+            lines.append('    _position = 3')
+            lines.append('    return %s' % record)
+        return lines
+
+
+def register_opcode(spec, replace=False):
+    '''コマンドの定義を登録する(Connect.send_command()で送信できるようになる)
+
+    Args:
+        spec(OpcodeSpec): コマンドの定義
+        replace(Optional[bool]): 同じ名前の定義を置き換えるかどうか(省略した場合は置き換えない)
+
+    Returns:
+        OpcodeSpec: 登録した定義
+
+    Raises:
+        ValueError: invalid argument
+    '''
+    if not isinstance(spec, OpcodeSpec):
+        raise ValueError('spec must be OpcodeSpec')
+    if spec.name in _opcodes and not replace:
+        raise ValueError('opcode ' + spec.name + ' is already registered')
+    _opcodes[spec.name] = spec
+    if spec.response:
+        _response_ops.add(spec.op)
+    return spec
+
+
+def get_opcode(name):
+    '''登録済みのコマンドの定義を返す
+
+    Raises:
+        ValueError: unknown opcode
+    '''
+    spec = _opcodes.get(name)
+    if spec is None:
+        raise ValueError('unknown opcode ' + str(name))
+    return spec
+
+
+def get_opcode_names():
+    '''登録済みのコマンド名を返す
+    '''
+    return tuple(sorted(_opcodes))
+
+
+def is_response_op(op):
+    '''OPのコマンドに対してレスポンスが返ってくるかどうか
+    '''
+    return op in _response_ops
@@ -0,0 +1,249 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ GPIO・PWM出力の波形再生
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import array
+import threading
+
+import serial
+
+from vsido.periodic import PeriodicTask
+
+_GPIO_IID_SET = (4, 5, 6, 7)
+_PWM_IID_SET = (6, 7)
+
+
+class _Waveform(object):
+    '''出力チャンネルで再生中の波形
+    '''
+    __slots__ = ('kind', 'samples', 'position', 'loop')
+
+    def __init__(self, kind, samples, loop):
+        self.kind = kind
+        self.samples = samples
+        self.position = 0
+        self.loop = loop
+
+
+class OutputScheduler(PeriodicTask):
+    '''GPIO・PWMの出力に、あらかじめ作った波形を一定周期で再生するクラス
+
+    LEDのフェードやブザー、補助のアクチュエータなど、GPIOピン4～7番の出力とピン6番、7番のPWMのパルス幅を、
+    1周期に1サンプルずつ出力する。値の検証は波形を渡した時点で行い、周期処理では行わない。
+    同じ周期で変わる全チャンネルの値は、GPIOは1つの「IO設定」フレーム、PWMは1つの「PWM設定」フレームにまとめて送信する。
+    値が変わらないチャンネルは送信しない。
+    PWM周期は最初にPWMの波形を渡した時に1回だけ読み出して保持する。
+
+    事前にset_vid_io_mode()で使うピンを出力に、PWMを使う場合はset_vid_use_pwm()でPWMを使えるようにしておくこと。
+
+    example:
+        scheduler = vsido.OutputScheduler(vc, rate=50)
+        scheduler.play_gpio(4, scheduler.make_blink(0.1, 0.4), loop=True)
+        scheduler.play_pwm(6, scheduler.make_ramp(0, 15000, 2.0))
+        scheduler.start()
+    '''
+
+    def __init__(self, connect, rate=50):
+        '''初期化処理
+
+        Args:
+            connect(Connect): 接続済みのV-Sido CONNECTのインスタンス
+            rate(Optional[int/float]): 1秒あたりの出力回数(省略した場合は50Hz)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        super().__init__(rate, connect.get_clock())
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._waveforms = {}
+        self._last_values = {}
+        self._pwm_cycle = None
+        self._send_error_count = 0
+
+    def make_ramp(self, start, end, duration):
+        '''startからendまでduration秒かけて直線的に変わる波形を作る(PWMのパルス幅用)
+
+        Args:
+            start(int): 最初の値
+            end(int): 最後の値
+            duration(int/float): 秒数
+
+        Returns:
+            array.array: 1周期ごとの値の配列
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not (isinstance(start, int) and isinstance(end, int)):
+            raise ValueError('start and end must be int')
+        if not (isinstance(duration, int) or isinstance(duration, float)):
+            raise ValueError('duration must be int or float')
+        if not duration >= 0:
+            raise ValueError('duration must be 0 or more')
+        count = max(1, round(duration * self._rate))
+        if count == 1:
+            return array.array('l', [end])
+        return array.array('l', [round(start + (end - start) * i / (count - 1)) for i in range(0, count)])
+
+    def make_blink(self, on_time, off_time, count=1):
+        '''on_time秒HIGH、off_time秒LOWをcount回繰り返す波形を作る(GPIO用)
+
+        Args:
+            on_time(int/float): HIGHの秒数
+            off_time(int/float): LOWの秒数
+            count(Optional[int]): 繰り返す回数(省略した場合は1回)
+
+        Returns:
+            array.array: 1周期ごとの値の配列
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        for value in (on_time, off_time):
+            if not (isinstance(value, int) or isinstance(value, float)):
+                raise ValueError('on_time and off_time must be int or float')
+            if not value >= 0:
+                raise ValueError('on_time and off_time must be 0 or more')
+        if not isinstance(count, int):
+            raise ValueError('count must be int')
+        if not count >= 1:
+            raise ValueError('count must be 1 or more')
+        period = [1] * round(on_time * self._rate) + [0] * round(off_time * self._rate)
+        if not period:
+            raise ValueError('on_time or off_time is too short')
+        return array.array('l', period * count)
+
+    def play_gpio(self, iid, samples, loop=False):
+        '''GPIOピンの出力に波形を再生する(同じピンで再生中の波形は置き換える)
+
+        Args:
+            iid(int): GPIOピン番号(範囲は4～7)
+            samples(list/tuple/array.array): 1周期ごとの値(0がLOW、1がHIGH)
+            loop(Optional[bool]): 最後まで再生したら最初に戻るかどうか(省略した場合は最後の値のまま止める)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not iid in _GPIO_IID_SET:
+            raise ValueError('iid must be 4 - 7')
+        samples = self._check_samples(samples, loop)
+        for value in samples:
+            if not value in (0, 1):
+                raise ValueError('value must be 0 or 1')
+        self._set_waveform(iid, _Waveform('gpio', samples, loop))
+
+    def play_pwm(self, iid, samples, loop=False):
+        '''PWMのパルス幅に波形を再生する(同じピンで再生中の波形は置き換える)
+
+        Args:
+            iid(int): GPIOピン番号(範囲は6～7)
+            samples(list/tuple/array.array): 1周期ごとのパルス幅(範囲は0～PWM周期で4usec単位)
+            loop(Optional[bool]): 最後まで再生したら最初に戻るかどうか(省略した場合は最後の値のまま止める)
+
+        Raises:
+            ValueError: invalid argument
+            ConnectionError: V-Sido CONNECT is not connected
+            TimeoutError: V-Sido CONNECT response timeout
+        '''
+        if not iid in _PWM_IID_SET:
+            raise ValueError('iid must be 6 or 7')
+        samples = self._check_samples(samples, loop)
+        pwm_cycle = self._get_pwm_cycle()
+        if samples and (min(samples) < 0 or max(samples) > pwm_cycle):
+            raise ValueError('pulse must be 0 - PWM_CYCLE')
+        self._set_waveform(iid, _Waveform('pwm', samples, loop))
+
+    def stop_channel(self, *iid_set):
+        '''波形の再生を止める(出力は最後の値のまま)
+
+        Args:
+            *iid_set(int): GPIOピン番号(省略した場合は全チャンネル)
+        '''
+        with self._lock:
+            if not iid_set:
+                self._waveforms = {}
+                return
+            waveforms = dict(self._waveforms)
+            for iid in iid_set:
+                waveforms.pop(iid, None)
+            self._waveforms = waveforms
+
+    def is_playing(self, iid):
+        '''波形を再生中かどうか
+        '''
+        return iid in self._waveforms
+
+    def get_send_error_count(self):
+        '''送信に失敗した回数を返す
+        '''
+        return self._send_error_count
+
+    def _check_samples(self, samples, loop):
+        if not (isinstance(samples, list) or isinstance(samples, tuple) or isinstance(samples, array.array)):
+            raise ValueError('samples must be list, tuple or array')
+        if not samples:
+            raise ValueError('samples must not be empty')
+        for value in samples:
+            if not isinstance(value, int):
+                raise ValueError('sample must be int')
+        if not isinstance(loop, bool):
+            raise ValueError('loop must be bool')
+        # 呼び出し元が後から書き換えても再生中の波形が変わらないように複製する
+        return array.array('l', samples)
+
+    def _get_pwm_cycle(self):
+        '''PWM周期を返す(最初の1回だけConnectから読み出す)
+        '''
+        if self._pwm_cycle is None:
+            self._pwm_cycle = self._connect.get_pwm_cycle()
+        return self._pwm_cycle
+
+    def _set_waveform(self, iid, waveform):
+        with self._lock:
+            waveforms = dict(self._waveforms)
+            waveforms[iid] = waveform
+            self._waveforms = waveforms
+
+    def _tick(self, now):
+        '''周期ごとの出力
+        '''
+        gpio_data_set = []
+        pwm_data_set = []
+        with self._lock:
+            finished = []
+            for iid, waveform in self._waveforms.items():
+                value = waveform.samples[waveform.position]
+                waveform.position += 1
+                if waveform.position >= len(waveform.samples):
+                    if waveform.loop:
+                        waveform.position = 0
+                    else:
+                        finished.append(iid)
+                if self._last_values.get(iid) == (waveform.kind, value):
+                    continue
+                self._last_values[iid] = (waveform.kind, value)
+                if waveform.kind == 'gpio':
+                    gpio_data_set.append({'iid':iid, 'value':value})
+                else:
+                    pwm_data_set.append({'iid':iid, 'pulse':value})
+            if finished:
+                waveforms = dict(self._waveforms)
+                for iid in finished:
+                    del waveforms[iid]
+                self._waveforms = waveforms
+        try:
+            if gpio_data_set:
+                self._connect._send_data(self._connect._make_set_gpio_value_command(*gpio_data_set))
+            if pwm_data_set:
+                self._connect._send_data(self._connect._make_set_pwm_pulse_width_command(*pwm_data_set))
+        except (ConnectionError, ValueError, serial.SerialException):
+            self._send_error_count += 1
+            # 送れなかった値は次の周期で送り直す
+            with self._lock:
+                for data in gpio_data_set + pwm_data_set:
+                    self._last_values.pop(data['iid'], None)
@@ -0,0 +1,187 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ 周期実行スレッド
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import threading
+
+from vsido.clock import SYSTEM_CLOCK, SystemClock
+from vsido.realtime import ThreadPolicy
+
+
+class PeriodicTask(object):
+    '''一定周期で処理を実行するスレッドの基底クラス
+
+    ライブラリが持つ周期送信・周期取得の処理はこのクラスを継承し、_tick()を実装する。
+    周期は開始時刻からの積み上げで管理するので、処理時間によって周期がずれていくことはない。
+    Connect(io_process=True)で作られた場合など、子プロセスで動かす場合(_remoteを設定した場合)は、
+    開始、停止と状態の取得を子プロセスの周期処理に渡す。
+    '''
+
+    def __init__(self, rate, clock=None):
+        '''初期化処理
+
+        Args:
+            rate(int/float): 1秒あたりの実行回数(Hz)
+            clock(Optional[SystemClock]): 周期の管理に使う時計(省略した場合は実時間)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not (isinstance(rate, int) or isinstance(rate, float)):
+            raise ValueError('rate must be int or float')
+        if not rate > 0:
+            raise ValueError('rate must be bigger than 0')
+        if clock is not None and not isinstance(clock, SystemClock):
+            raise ValueError('clock must be SystemClock or VirtualClock')
+        self._rate = rate
+        self._clock = clock if clock is not None else SYSTEM_CLOCK
+        self._period = 1.0 / rate
+        self._alive = False
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._tick_count = 0
+        self._overrun_count = 0
+        self._tick_error_count = 0
+        self._last_tick_error = None
+        self._thread_policy = None
+        # 起床遅れの計測(JitterProbe.attach()で設定)
+        self._jitter_probe = None
+        self._jitter_name = type(self).__name__
+        # 子プロセスで動かす場合の呼び出し口(継承先で設定する)
+        self._remote = None
+
+    def start(self):
+        '''周期実行の開始
+        '''
+        if self._remote is not None:
+            self._remote.call('start')
+            return
+        if self._alive:
+            return
+        self._alive = True
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''周期実行の停止
+        '''
+        if self._remote is not None:
+            try:
+                self._remote.call('stop')
+            except ConnectionError:
+                # 切断した場合は子プロセスの周期処理も止まっている
+                pass
+            return
+        if not self._alive:
+            return
+        self._alive = False
+        self._stop_event.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def is_running(self):
+        '''周期実行中かどうかの確認
+
+        Returns:
+            bool: 実行中はTrue、停止中はFalseを返す
+        '''
+        if self._remote is not None:
+            try:
+                return self._remote.call('is_running')
+            except ConnectionError:
+                return False
+        return self._alive
+
+    def get_rate(self):
+        '''実行周期(Hz)を返す
+        '''
+        return self._rate
+
+    def set_thread_policy(self, policy):
+        '''周期実行スレッドのCPUアフィニティとリアルタイム優先度の設定(次のstart()から適用する)
+
+        Args:
+            policy(ThreadPolicy): 設定(Noneの場合は既定のまま)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if policy is not None and not isinstance(policy, ThreadPolicy):
+            raise ValueError('policy must be ThreadPolicy')
+        if self._remote is not None:
+            self._remote.call('set_thread_policy', policy)
+            return
+        self._thread_policy = policy
+
+    def get_overrun_count(self):
+        '''処理が周期に間に合わず、実行を飛ばした回数を返す
+        '''
+        if self._remote is not None:
+            return self._remote.call('get_overrun_count')
+        return self._overrun_count
+
+    def get_tick_error_count(self):
+        '''周期処理で例外が発生した回数を返す
+        '''
+        if self._remote is not None:
+            return self._remote.call('get_tick_error_count')
+        return self._tick_error_count
+
+    def get_last_tick_error(self):
+        '''周期処理で最後に発生した例外を返す(発生していない場合はNone)
+        '''
+        if self._remote is not None:
+            return self._remote.call('get_last_tick_error')
+        return self._last_tick_error
+
+    def _run(self):
+        '''周期実行スレッドの処理
+        '''
+        if self._thread_policy is not None:
+            self._thread_policy.apply()
+        clock = self._clock
+        next_time = clock.time()
+        while self._alive:
+            jitter_probe = self._jitter_probe
+            if jitter_probe is not None:
+                jitter_probe._record(self._jitter_name, clock.time() - next_time)
+            try:
+                self._tick(next_time)
+            except Exception as error:
+                # 1周期の処理の失敗で周期実行が止まらないように、記録して次の周期に進む
+                self._tick_error_count += 1
+                self._last_tick_error = error
+            self._tick_count += 1
+            period = self._period / self._get_rate_scale()
+            next_time += period
+            delay = next_time - clock.time()
+            if delay > 0:
+                clock.wait(self._stop_event, delay)
+            else:
+                # 1周期以上遅れた場合は、溜まった分を連続実行せずに飛ばす
+                missed = int(-delay // period)
+                if missed > 0:
+                    self._overrun_count += missed
+                    next_time += missed * period
+
+    def _get_rate_scale(self):
+        '''実行周期に掛ける割合を返す(通信量に応じて周期を落とす場合は継承先で実装する)
+
+        Returns:
+            float: 割合(1.0で指定した周期どおり、0.5で周期が2倍になる)
+        '''
+        return 1.0
+
+    def _tick(self, now):
+        '''1周期ごとに実行する処理(継承先で実装する)
+
+        Args:
+            now(float): この周期の予定実行時刻
+        '''
+        raise NotImplementedError
@@ -0,0 +1,311 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ 姿勢のレイヤー合成
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import array
+import threading
+
+import serial
+
+from vsido.periodic import PeriodicTask
+
+# サーボIDの数(SID 0～254をそのまま配列の位置として使う)
+_SERVO_NUM = 255
+_MODES = ('base', 'additive')
+
+
+class _PoseLayer(object):
+    '''姿勢のレイヤー
+
+    角度はサーボIDを位置とする配列で持ち、sid_setでこのレイヤーが動かすサーボを表す。
+    '''
+    __slots__ = ('name', 'mode', 'angles', 'sid_set', 'fade_from', 'fade_to', 'fade_start', 'fade_time', 'remove_after_fade')
+
+    def __init__(self, name, mode):
+        self.name = name
+        self.mode = mode
+        self.angles = array.array('d', bytes(8 * _SERVO_NUM))
+        self.sid_set = ()
+        self.fade_from = 0.0
+        self.fade_to = 0.0
+        self.fade_start = 0.0
+        self.fade_time = 0.0
+        self.remove_after_fade = False
+
+    def set_weight(self, weight, fade_time, now):
+        '''重みの変更(fade_time秒かけて現在の重みからweightまで直線的に変える)
+        '''
+        self.fade_from = self.get_weight(now)
+        self.fade_to = weight
+        self.fade_start = now
+        self.fade_time = fade_time
+
+    def get_weight(self, now):
+        '''時刻nowでの重みを返す
+        '''
+        if self.is_fading(now):
+            return self.fade_from + (self.fade_to - self.fade_from) * (now - self.fade_start) / self.fade_time
+        return self.fade_to
+
+    def is_fading(self, now):
+        '''時刻nowで重みが変化している途中かどうか
+        '''
+        return self.fade_time > 0 and now < self.fade_start + self.fade_time
+
+
+class PoseBlender(PeriodicTask):
+    '''複数の姿勢のレイヤーを重みづけして合成し、一定周期で目標角度を送信するクラス
+
+    レイヤーには次の2種類がある。
+        base: 立ち姿勢や歩行姿勢などの基本姿勢。サーボごとに、そのサーボを動かすbaseレイヤーの重みで加重平均する。
+        additive: 視線、呼吸、ジェスチャーなどの差分。重みを掛けた角度を基本姿勢に足す。
+    重みはフェード時間をかけて直線的に変えられる。合成した角度はset_servo_min_max_angle()で送信済みの最大・最小角
+    (未送信の場合は-180～180度)に収め、1周期ごとに1つの「目標角度設定」フレームで送信する。
+
+    重みが変化していないレイヤーは、レイヤーの変更時にまとめて足し込んだ配列を保持しておき、
+    周期処理ではフェード中のレイヤーだけを足すので、レイヤーの数が増えても周期処理の負荷はほとんど変わらない。
+
+    example:
+        blender = vsido.PoseBlender(vc, rate=50)
+        blender.set_layer('stand', {'sid':2, 'angle':0}, {'sid':3, 'angle':-30}, mode='base')
+        blender.set_layer('breath', {'sid':3, 'angle':2}, weight=0.5, fade_time=1)
+        blender.start()
+    '''
+
+    def __init__(self, connect, rate=50, cycle_time=None):
+        '''初期化処理
+
+        Args:
+            connect(Connect): 接続済みのV-Sido CONNECTのインスタンス
+            rate(Optional[int/float]): 1秒あたりの送信回数(省略した場合は50Hz)
+            cycle_time(Optional[int]): 目標角度に移行するまでの時間(msec、省略した場合は送信周期)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        super().__init__(rate, connect.get_clock())
+        if cycle_time is None:
+            cycle_time = round(1000 / rate)
+        if not isinstance(cycle_time, int):
+            raise ValueError('cycle_time must be int')
+        if not 0 <= cycle_time <= 1000:
+            raise ValueError('cycle_time must be 0 - 1000')
+        self._connect = connect
+        self._cycle_time = cycle_time
+        self._lock = threading.Lock()
+        self._layers = {}
+        self._dirty = True
+        # 重みが変化していないレイヤーを足し込んだ配列(baseの重みの和、baseの重み×角度の和、additiveの重み×角度の和)
+        self._static_weight = array.array('d', bytes(8 * _SERVO_NUM))
+        self._static_weighted = array.array('d', bytes(8 * _SERVO_NUM))
+        self._static_additive = array.array('d', bytes(8 * _SERVO_NUM))
+        self._fading_layers = ()
+        self._sid_set = ()
+        self._pose = {}
+        self._send_error_count = 0
+
+    def set_layer(self, name, *angle_data_set, mode='additive', weight=1.0, fade_time=0):
+        '''レイヤーの追加・角度の更新
+
+        同じ名前のレイヤーがある場合は角度を置き換える(重みはweightまでfade_time秒かけて変える)。
+        新しいレイヤーは重み0からweightまでfade_time秒かけてフェードインする。
+
+        Args:
+            name(str): レイヤーの名前
+            *angle_data_set(dict): サーボの角度情報を書いた辞書データ(set_servo_angle()の引数と同じ形式)
+            mode(Optional[str]): 'base'(基本姿勢)か'additive'(差分、省略した場合)
+            weight(Optional[int/float]): 重み(範囲は0.0～1.0)
+            fade_time(Optional[int/float]): 重みを変える秒数(省略した場合はすぐに変える)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not isinstance(name, str):
+            raise ValueError('name must be str')
+        if mode not in _MODES:
+            raise ValueError('mode must be base or additive')
+        self._check_weight(weight, fade_time)
+        sid_set = []
+        for angle_data in angle_data_set:
+            if not isinstance(angle_data, dict):
+                raise ValueError('angle_data_set must contain dict data')
+            if 'sid' not in angle_data:
+                raise ValueError('missing sid in angle_data_set')
+            if not isinstance(angle_data['sid'], int):
+                raise ValueError('sid must be int')
+            if not 1 <= angle_data['sid'] <= 254:
+                raise ValueError('sid must be 1 - 254')
+            if 'angle' not in angle_data:
+                raise ValueError('missing angle in angle_data_set')
+            if not (isinstance(angle_data['angle'], int) or isinstance(angle_data['angle'], float)):
+                raise ValueError('angle must be int or float')
+            if not -180.0 <= angle_data['angle'] <= 180.0:
+                raise ValueError('angle must be -180 - 180')
+            sid_set.append(angle_data['sid'])
+        now = self._clock.time()
+        with self._lock:
+            layer = self._layers.get(name)
+            if layer is None or not layer.mode == mode:
+                previous_layer = layer
+                layer = _PoseLayer(name, mode)
+                if previous_layer is not None:
+                    layer.fade_to = previous_layer.get_weight(now)
+            else:
+                # 前の角度を消してから書き込む
+                layer.angles = array.array('d', bytes(8 * _SERVO_NUM))
+            for angle_data in angle_data_set:
+                layer.angles[angle_data['sid']] = angle_data['angle']
+            layer.sid_set = tuple(sorted(set(sid_set)))
+            layer.remove_after_fade = False
+            layer.set_weight(weight, fade_time, now)
+            self._layers[name] = layer
+            self._dirty = True
+
+    def set_weight(self, name, weight, fade_time=0):
+        '''レイヤーの重みの変更
+
+        Args:
+            name(str): レイヤーの名前
+            weight(int/float): 重み(範囲は0.0～1.0)
+            fade_time(Optional[int/float]): 重みを変える秒数(省略した場合はすぐに変える)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        self._check_weight(weight, fade_time)
+        with self._lock:
+            if name not in self._layers:
+                raise ValueError('unknown layer ' + str(name))
+            layer = self._layers[name]
+            layer.remove_after_fade = False
+            layer.set_weight(weight, fade_time, self._clock.time())
+            self._dirty = True
+
+    def remove_layer(self, name, fade_time=0):
+        '''レイヤーの削除(fade_time秒かけてフェードアウトしてから削除する)
+
+        Args:
+            name(str): レイヤーの名前
+            fade_time(Optional[int/float]): フェードアウトする秒数(省略した場合はすぐに削除する)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        self._check_weight(0.0, fade_time)
+        with self._lock:
+            if name not in self._layers:
+                raise ValueError('unknown layer ' + str(name))
+            if fade_time > 0:
+                layer = self._layers[name]
+                layer.set_weight(0.0, fade_time, self._clock.time())
+                layer.remove_after_fade = True
+            else:
+                del self._layers[name]
+            self._dirty = True
+
+    def get_layer_names(self):
+        '''レイヤーの名前を返す
+        '''
+        with self._lock:
+            return tuple(sorted(self._layers))
+
+    def get_pose(self):
+        '''最後に送信した合成後の角度を返す
+
+        Returns:
+            dict: サーボIDをキーにした角度の辞書データ
+        '''
+        return dict(self._pose)
+
+    def get_send_error_count(self):
+        '''送信に失敗した回数を返す
+        '''
+        return self._send_error_count
+
+    def _check_weight(self, weight, fade_time):
+        if not (isinstance(weight, int) or isinstance(weight, float)):
+            raise ValueError('weight must be int or float')
+        if not 0.0 <= weight <= 1.0:
+            raise ValueError('weight must be 0 - 1')
+        if not (isinstance(fade_time, int) or isinstance(fade_time, float)):
+            raise ValueError('fade_time must be int or float')
+        if not fade_time >= 0:
+            raise ValueError('fade_time must be 0 or more')
+
+    def _rebuild(self, now):
+        '''重みが変化していないレイヤーを足し込み直す(ロック内で呼ぶ)
+        '''
+        for name in [name for name, layer in self._layers.items() if layer.remove_after_fade and not layer.is_fading(now)]:
+            del self._layers[name]
+        static_weight = array.array('d', bytes(8 * _SERVO_NUM))
+        static_weighted = array.array('d', bytes(8 * _SERVO_NUM))
+        static_additive = array.array('d', bytes(8 * _SERVO_NUM))
+        fading_layers = []
+        sid_set = set()
+        for layer in self._layers.values():
+            sid_set.update(layer.sid_set)
+            if layer.is_fading(now):
+                fading_layers.append(layer)
+                continue
+            weight = layer.fade_to
+            angles = layer.angles
+            if layer.mode == 'base':
+                for sid in layer.sid_set:
+                    static_weight[sid] += weight
+                    static_weighted[sid] += weight * angles[sid]
+            else:
+                for sid in layer.sid_set:
+                    static_additive[sid] += weight * angles[sid]
+        self._static_weight = static_weight
+        self._static_weighted = static_weighted
+        self._static_additive = static_additive
+        self._fading_layers = tuple(fading_layers)
+        self._sid_set = tuple(sorted(sid_set))
+        self._dirty = False
+
+    def _tick(self, now):
+        '''周期ごとの姿勢の合成と送信
+        '''
+        with self._lock:
+            if self._dirty or any(not layer.is_fading(now) for layer in self._fading_layers):
+                self._rebuild(now)
+            sid_set = self._sid_set
+            if not sid_set:
+                return
+            fading_layers = self._fading_layers
+            # 配列の複製はCの処理で行われるので、サーボ数に対して十分速い
+            weight_sum = array.array('d', self._static_weight)
+            weighted_sum = array.array('d', self._static_weighted)
+            additive_sum = array.array('d', self._static_additive)
+            for layer in fading_layers:
+                weight = layer.get_weight(now)
+                angles = layer.angles
+                if layer.mode == 'base':
+                    for sid in layer.sid_set:
+                        weight_sum[sid] += weight
+                        weighted_sum[sid] += weight * angles[sid]
+                else:
+                    for sid in layer.sid_set:
+                        additive_sum[sid] += weight * angles[sid]
+        angle_limits = self._connect.get_servo_angle_limits()
+        angle_set = []
+        for sid in sid_set:
+            angle = additive_sum[sid]
+            if weight_sum[sid] > 0:
+                angle += weighted_sum[sid] / weight_sum[sid]
+            limits = angle_limits.get(sid)
+            if limits is not None:
+                angle = min(max(angle, limits[0]), limits[1])
+            else:
+                angle = min(max(angle, -180.0), 180.0)
+            angle_set.append(angle)
+        try:
+            self._connect._send_servo_angle_array(sid_set, angle_set, self._cycle_time)
+        except (ConnectionError, ValueError, serial.SerialException):
+            self._send_error_count += 1
+            return
+        self._pose = dict(zip(sid_set, angle_set))
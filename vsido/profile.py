@@ -0,0 +1,252 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ ロボット設定プロファイル
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import json
+
+from vsido.connect import Connect
+
+# VID番号(「V-Sido CONNECT RC Command Reference」参照)
+_VID_IO_MODE = 3
+_VID_USE_PWM = 5
+_VID_PWM_CYCLE_HIGH = 6
+_VID_PWM_CYCLE_LOW = 7
+_PWM_CYCLE_VID_SET = (_VID_PWM_CYCLE_HIGH, _VID_PWM_CYCLE_LOW)
+
+
+class RobotProfile(object):
+    '''ロボットの設定を宣言的に記述したプロファイル
+
+    サーボのコンプライアンス、最大・最小角、GPIOの入出力、PWMの設定をまとめて記述し、
+    apply()で現在の値との差分だけをV-Sido CONNECTに送信する。
+    フラッシュへの書き込みは、保存されるVID設定が実際に変わった場合のみ行う。
+
+    プロファイルの形式(辞書データ、またはJSONファイル):
+        {
+            'servos': [
+                {'sid':1, 'compliance_cw':100, 'compliance_ccw':100, 'min':-90, 'max':90},
+                {'sid':2, 'min':-150, 'max':50}
+            ],
+            'io_mode': [{'iid':4, 'mode':0}, {'iid':5, 'mode':1}],
+            'pwm': {'use':True, 'cycle':20000}
+        }
+    いずれの項目も省略でき、省略した設定は変更しない。
+
+    example:
+        profile = vsido.RobotProfile.load('robot.json')
+        print(profile.apply(vc))
+    '''
+
+    def __init__(self, servos=None, io_mode=None, pwm=None):
+        '''初期化処理
+
+        Args:
+            servos(Optional[list]): サーボごとの設定の辞書データのリスト
+                sid(int): サーボID(範囲は1～254)
+                compliance_cw(Optional[int]): 時計回りのコンプライアンススロープ値(範囲は1～254、compliance_ccwと組で指定)
+                compliance_ccw(Optional[int]): 反時計回りのコンプライアンススロープ値(範囲は1～254)
+                min(Optional[int/float]): 最小角度(範囲は-180.0～180.0度、maxと組で指定)
+                max(Optional[int/float]): 最大角度(範囲は-180.0～180.0度)
+            io_mode(Optional[list]): GPIOの入出力の設定(set_vid_io_mode()の引数と同じ形式)
+            pwm(Optional[dict]): PWMの設定
+                use(Optional[bool]): GPIOピン6番、7番をPWMに使うかどうか
+                cycle(Optional[int]): PWM周期(範囲は4～65536usec)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        self._servos = {}
+        for servo in servos or []:
+            if not isinstance(servo, dict):
+                raise ValueError('servos must contain dict data')
+            if 'sid' not in servo:
+                raise ValueError('missing sid in servos')
+            if not isinstance(servo['sid'], int):
+                raise ValueError('sid must be int')
+            if not 1 <= servo['sid'] <= 254:
+                raise ValueError('sid must be 1 - 254')
+            if ('compliance_cw' in servo) != ('compliance_ccw' in servo):
+                raise ValueError('compliance_cw and compliance_ccw must be set together')
+            for key in ('compliance_cw', 'compliance_ccw'):
+                if key in servo:
+                    if not isinstance(servo[key], int):
+                        raise ValueError(key + ' must be int')
+                    if not 1 <= servo[key] <= 254:
+                        raise ValueError(key + ' must be 1 - 254')
+            if ('min' in servo) != ('max' in servo):
+                raise ValueError('min and max must be set together')
+            for key in ('min', 'max'):
+                if key in servo:
+                    if not (isinstance(servo[key], int) or isinstance(servo[key], float)):
+                        raise ValueError(key + ' must be int or float')
+                    if not -180.0 <= servo[key] <= 180.0:
+                        raise ValueError(key + ' must be -180 - 180')
+            if 'min' in servo and servo['max'] < servo['min']:
+                raise ValueError('max must be bigger than min')
+            self._servos[servo['sid']] = dict(servo)
+        self._io_mode = {}
+        for gpio_data in io_mode or []:
+            if not isinstance(gpio_data, dict):
+                raise ValueError('io_mode must contain dict data')
+            if not gpio_data.get('iid') in [4, 5, 6, 7]:
+                raise ValueError('iid must be 4 - 7')
+            if not gpio_data.get('mode') in [0, 1]:
+                raise ValueError('mode must be 0 or 1')
+            self._io_mode[gpio_data['iid']] = gpio_data['mode']
+        self._pwm = {}
+        if pwm is not None:
+            if not isinstance(pwm, dict):
+                raise ValueError('pwm must be dict')
+            if 'use' in pwm:
+                if not isinstance(pwm['use'], bool):
+                    raise ValueError('use must be bool')
+                self._pwm['use'] = pwm['use']
+            if 'cycle' in pwm:
+                if not isinstance(pwm['cycle'], int):
+                    raise ValueError('cycle must be int')
+                if not 4 <= pwm['cycle'] <= 65536:
+                    raise ValueError('cycle must be 4 - 65536')
+                self._pwm['cycle'] = pwm['cycle']
+
+    @classmethod
+    def from_dict(cls, profile_data):
+        '''辞書データからプロファイルを作る
+        '''
+        if not isinstance(profile_data, dict):
+            raise ValueError('profile_data must be dict')
+        return cls(servos=profile_data.get('servos'), io_mode=profile_data.get('io_mode'), pwm=profile_data.get('pwm'))
+
+    @classmethod
+    def load(cls, path):
+        '''JSONファイルからプロファイルを読み込む
+        '''
+        with open(path, 'r') as profile_file:
+            return cls.from_dict(json.load(profile_file))
+
+    def to_dict(self):
+        '''プロファイルを辞書データにする
+        '''
+        profile_data = {}
+        if self._servos:
+            profile_data['servos'] = [dict(self._servos[sid]) for sid in sorted(self._servos)]
+        if self._io_mode:
+            profile_data['io_mode'] = [{'iid':iid, 'mode':self._io_mode[iid]} for iid in sorted(self._io_mode)]
+        if self._pwm:
+            profile_data['pwm'] = dict(self._pwm)
+        return profile_data
+
+    def save(self, path):
+        '''プロファイルをJSONファイルに保存する
+        '''
+        with open(path, 'w') as profile_file:
+            json.dump(self.to_dict(), profile_file, indent=2)
+
+    def apply(self, connect, write_flash=True, timeout=1):
+        '''プロファイルの設定をV-Sido CONNECTに反映する
+
+        VID設定は現在の値を1回の「VID要求」でまとめて読み出し、変わる値だけを1フレームで送信する。
+        サーボの設定値はV-Sido CONNECTから読み出せないので、この接続で送信済みの値(Connect.get_servo_settings())と比べ、
+        変わるサーボだけを1フレームに入る限りまとめて送信する。
+        フラッシュへの書き込みはVID設定が変わった場合のみ行う。
+
+        Args:
+            connect(Connect): 接続済みのV-Sido CONNECTのインスタンス
+            write_flash(Optional[bool]): VID設定が変わった場合にフラッシュに書き込むかどうか(省略した場合は書き込む)
+            timeout(Optional[int/float]): 受信タイムアウトするまでの秒数(省略した場合は1秒)
+
+        Returns:
+            dict: 反映した変更の辞書データ
+                vid(tuple): 変更したVID設定の辞書データ
+                compliance(tuple): コンプライアンスを変更したサーボID
+                min_max(tuple): 最大・最小角を変更したサーボID
+                write_flash(bool): フラッシュに書き込んだかどうか
+
+        Raises:
+            ValueError: invalid argument
+            ConnectionError: V-Sido CONNECT is not connected
+            TimeoutError: V-Sido CONNECT response timeout
+        '''
+        if not isinstance(write_flash, bool):
+            raise ValueError('write_flash must be bool')
+        changes = {'vid':tuple(), 'compliance':tuple(), 'min_max':tuple(), 'write_flash':False}
+
+        # VID設定の差分
+        vid_set = self._get_vid_set()
+        if vid_set:
+            current_vid_values = {}
+            for vid_data in connect.get_vid_value(*vid_set, timeout=timeout):
+                current_vid_values[vid_data['vid']] = vid_data['vdt']
+            desired_vid_values = self._get_desired_vid_values(current_vid_values)
+            changed_vid_data_set = tuple({'vid':vid, 'vdt':desired_vid_values[vid]} for vid in vid_set if not desired_vid_values[vid] == current_vid_values[vid])
+            if changed_vid_data_set:
+                # PWM周期はConnectが保持する値も更新されるようにset_vid_pwm_cycle()で送る
+                other_vid_data_set = tuple(vid_data for vid_data in changed_vid_data_set if vid_data['vid'] not in _PWM_CYCLE_VID_SET)
+                if other_vid_data_set:
+                    connect.set_vid_value(*other_vid_data_set)
+                if len(other_vid_data_set) < len(changed_vid_data_set):
+                    connect.set_vid_pwm_cycle(self._pwm['cycle'])
+                changes['vid'] = changed_vid_data_set
+
+        # サーボの設定値の差分
+        known_settings = {}
+        for servo_settings in connect.get_servo_settings(*sorted(self._servos)):
+            known_settings[servo_settings['sid']] = servo_settings
+        compliance_data_set = []
+        min_max_data_set = []
+        for sid in sorted(self._servos):
+            servo = self._servos[sid]
+            known = known_settings.get(sid, {})
+            if 'compliance_cw' in servo:
+                if not (known.get('compliance_cw') == servo['compliance_cw'] and known.get('compliance_ccw') == servo['compliance_ccw']):
+                    compliance_data_set.append({'sid':sid, 'compliance_cw':servo['compliance_cw'], 'compliance_ccw':servo['compliance_ccw']})
+            if 'min' in servo:
+                if not (known.get('min') == servo['min'] and known.get('max') == servo['max']):
+                    min_max_data_set.append({'sid':sid, 'min':servo['min'], 'max':servo['max']})
+        for i in range(0, len(compliance_data_set), Connect._COMPLIANCE_PER_FRAME):
+            connect.set_servo_compliance(*compliance_data_set[i:i + Connect._COMPLIANCE_PER_FRAME])
+        for i in range(0, len(min_max_data_set), Connect._MIN_MAX_PER_FRAME):
+            connect.set_servo_min_max_angle(*min_max_data_set[i:i + Connect._MIN_MAX_PER_FRAME])
+        changes['compliance'] = tuple(compliance_data['sid'] for compliance_data in compliance_data_set)
+        changes['min_max'] = tuple(min_max_data['sid'] for min_max_data in min_max_data_set)
+
+        # フラッシュに保存されるのはVID設定だけなので、VID設定が変わった場合のみ書き込む
+        if changes['vid'] and write_flash:
+            connect.write_flash()
+            changes['write_flash'] = True
+        return changes
+
+    def _get_vid_set(self):
+        '''プロファイルで使うVIDのリスト
+        '''
+        vid_set = []
+        if self._io_mode:
+            vid_set.append(_VID_IO_MODE)
+        if 'use' in self._pwm:
+            vid_set.append(_VID_USE_PWM)
+        if 'cycle' in self._pwm:
+            vid_set.extend([_VID_PWM_CYCLE_HIGH, _VID_PWM_CYCLE_LOW])
+        return vid_set
+
+    def _get_desired_vid_values(self, current_vid_values):
+        '''プロファイルの設定を反映した後のVIDの値
+        '''
+        desired_vid_values = dict(current_vid_values)
+        if self._io_mode:
+            # set_vid_io_mode()と同じビット配置で、プロファイルに書かれたピンのビットだけを置き換える
+            mode_data = current_vid_values[_VID_IO_MODE]
+            for iid, mode in self._io_mode.items():
+                mode_data &= ~(2 ** (iid - 1))
+                mode_data |= (2 ** (iid - 1)) * mode
+            desired_vid_values[_VID_IO_MODE] = mode_data
+        if 'use' in self._pwm:
+            desired_vid_values[_VID_USE_PWM] = 1 if self._pwm['use'] else 0
+        if 'cycle' in self._pwm:
+            # set_vid_pwm_cycle()と同じ形式(ver.2.2時点の仕様に合わせたもの)
+            pwm_cycle_data = round(self._pwm['cycle'] / 4)
+            desired_vid_values[_VID_PWM_CYCLE_HIGH] = pwm_cycle_data // 256
+            desired_vid_values[_VID_PWM_CYCLE_LOW] = pwm_cycle_data % 256
+        return desired_vid_values
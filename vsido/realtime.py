@@ -0,0 +1,219 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ 送受信スレッドの実行設定と起床遅れの計測
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import collections
+import os
+import threading
+import time
+
+
+class ThreadPolicy(object):
+    '''スレッドのCPUアフィニティとリアルタイム優先度の設定
+
+    apply()を呼んだスレッドに、os.sched_setaffinity()で使うCPUを、os.sched_setscheduler()でSCHED_FIFOの優先度を設定する。
+    (Linuxではpid 0の指定は呼び出したスレッドだけを対象にする)
+    対応していないOSや権限がない場合(SCHED_FIFOは通常rootかCAP_SYS_NICEが必要)は、その設定を行わずに既定のまま動かす。
+
+    example:
+        policy = vsido.ThreadPolicy(cpu_set=(3,), priority=50)
+        vc = vsido.Connect(io_thread_policy=policy)
+        vc.connect('/dev/ttyUSB0')
+        print(vc.get_io_thread_status())
+    '''
+
+    def __init__(self, cpu_set=None, priority=None):
+        '''初期化処理
+
+        Args:
+            cpu_set(Optional[list/tuple/set]): 使うCPUの番号(省略した場合は変更しない)
+            priority(Optional[int]): SCHED_FIFOの優先度(範囲は1～99、省略した場合は変更しない)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if cpu_set is not None:
+            if not (isinstance(cpu_set, list) or isinstance(cpu_set, tuple) or isinstance(cpu_set, set)):
+                raise ValueError('cpu_set must be list, tuple or set')
+            if not cpu_set:
+                raise ValueError('cpu_set must not be empty')
+            for cpu in cpu_set:
+                if not isinstance(cpu, int):
+                    raise ValueError('cpu must be int')
+                if not cpu >= 0:
+                    raise ValueError('cpu must be 0 or more')
+            cpu_set = frozenset(cpu_set)
+        if priority is not None:
+            if not isinstance(priority, int):
+                raise ValueError('priority must be int')
+            if not 1 <= priority <= 99:
+                raise ValueError('priority must be 1 - 99')
+        self._cpu_set = cpu_set
+        self._priority = priority
+
+    def get_cpu_set(self):
+        '''使うCPUの番号を返す(指定していない場合はNone)
+        '''
+        return tuple(sorted(self._cpu_set)) if self._cpu_set is not None else None
+
+    def get_priority(self):
+        '''SCHED_FIFOの優先度を返す(指定していない場合はNone)
+        '''
+        return self._priority
+
+    def apply(self):
+        '''呼び出したスレッドに設定を適用する(失敗しても例外は発生させない)
+
+        Returns:
+            dict: 適用結果の辞書データ
+                affinity(str): CPUアフィニティの結果
+                priority(str): 優先度の結果
+                    'applied': 設定した
+                    'denied': 権限がないなどの理由で設定できなかった
+                    'unsupported': OSが対応していない
+                    None: 指定していない
+                error(str): 設定できなかった理由(設定できた場合はNone)
+        '''
+        result = {'affinity':None, 'priority':None, 'error':None}
+        if self._cpu_set is not None:
+            if not hasattr(os, 'sched_setaffinity'):
+                result['affinity'] = 'unsupported'
+            else:
+                try:
+                    os.sched_setaffinity(0, self._cpu_set)
+                    result['affinity'] = 'applied'
+                except OSError as error:
+                    result['affinity'] = 'denied'
+                    result['error'] = str(error)
+        if self._priority is not None:
+            if not (hasattr(os, 'sched_setscheduler') and hasattr(os, 'SCHED_FIFO')):
+                result['priority'] = 'unsupported'
+            else:
+                try:
+                    priority = min(self._priority, os.sched_get_priority_max(os.SCHED_FIFO))
+                    os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+                    result['priority'] = 'applied'
+                except OSError as error:
+                    # 権限がない場合は通常のスケジューリングのまま動かす
+                    result['priority'] = 'denied'
+                    result['error'] = str(error)
+        return result
+
+
+class JitterProbe(object):
+    '''スレッドの起床遅れ(予定した時刻から実際に動き出すまでの時間)を計測するクラス
+
+    attach()で登録した対象ごとに、次の値を上限のある両端キューに記録する。
+        Connect: 受信スレッドのシリアルポートの読み込みが、データがなくタイムアウトした時の、タイムアウト値からの超過時間
+        PeriodicTask: 周期処理の予定実行時刻から、実際に処理を始めた時刻までの遅れ
+    登録していない間は記録の処理を行わないので、計測のための負荷はない。
+
+    example:
+        probe = vsido.JitterProbe()
+        probe.attach(vc)
+        probe.attach(blender)
+        time.sleep(10)
+        print(probe.get_stats())
+    '''
+
+    def __init__(self, max_samples=10000):
+        '''初期化処理
+
+        Args:
+            max_samples(Optional[int]): 対象ごとに保持する記録の上限(省略した場合は10000件)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not isinstance(max_samples, int):
+            raise ValueError('max_samples must be int')
+        if not max_samples > 0:
+            raise ValueError('max_samples must be bigger than 0')
+        self._max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._targets = []
+
+    def attach(self, target, name=None):
+        '''計測対象を登録する
+
+        Args:
+            target(Connect/PeriodicTask): 計測対象
+            name(Optional[str]): 記録に付ける名前(省略した場合はConnectは'receiver'、周期処理はクラス名)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not hasattr(target, '_jitter_probe'):
+            raise ValueError('target must be Connect or PeriodicTask')
+        if name is None:
+            name = 'receiver' if hasattr(target, '_receiver') else type(target).__name__
+        if not isinstance(name, str):
+            raise ValueError('name must be str')
+        with self._lock:
+            if name not in self._samples:
+                self._samples[name] = collections.deque(maxlen=self._max_samples)
+            if not target in self._targets:
+                self._targets.append(target)
+        target._jitter_name = name
+        target._jitter_probe = self
+
+    def detach(self, *target_set):
+        '''計測対象の登録を解除する(記録は残す)
+
+        Args:
+            *target_set(Connect/PeriodicTask): 計測対象(省略した場合は全て)
+        '''
+        with self._lock:
+            if not target_set:
+                target_set = tuple(self._targets)
+            for target in target_set:
+                if target in self._targets:
+                    self._targets.remove(target)
+                    target._jitter_probe = None
+
+    def clear(self):
+        '''記録の消去
+        '''
+        with self._lock:
+            for samples in self._samples.values():
+                samples.clear()
+
+    def get_stats(self):
+        '''対象ごとの起床遅れの統計を返す
+
+        Returns:
+            dict: 名前をキーにした統計の辞書データ(時間は秒)
+                count(int): 記録数
+                p50(float): 中央値
+                p90(float): 90パーセンタイル
+                p99(float): 99パーセンタイル
+                max(float): 最大値
+        '''
+        with self._lock:
+            sample_set = dict((name, sorted(samples)) for name, samples in self._samples.items())
+        stats = {}
+        for name, samples in sample_set.items():
+            count = len(samples)
+            if count == 0:
+                stats[name] = {'count':0, 'p50':0.0, 'p90':0.0, 'p99':0.0, 'max':0.0}
+                continue
+            stats[name] = {
+                'count':count,
+                'p50':samples[min(count - 1, int(count * 0.5))],
+                'p90':samples[min(count - 1, int(count * 0.9))],
+                'p99':samples[min(count - 1, int(count * 0.99))],
+                'max':samples[-1],
+            }
+        return stats
+
+    def _record(self, name, lateness):
+        '''起床遅れを記録する(計測対象のスレッドから呼ばれる)
+        '''
+        samples = self._samples.get(name)
+        if samples is not None:
+            samples.append(max(0.0, lateness))
@@ -0,0 +1,354 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ ロボットの状態の共有メモリ公開
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from vsido.io_process import _attach_shared_memory
+
+# 共有メモリのレイアウト(全て固定位置、リトルエンディアン)
+#   ヘッダ: MAGIC(4Byte) VERSION(uint16) 予約(uint16) SEQ(uint64)
+#   サーボ情報: SID 0～254 ごとに 受信時刻(double) サーボ情報54Byte(+予約2Byte) アドレスごとの受信時刻(double×54)
+#   目標角度: SID 0～254 ごとに 送信時刻(double) 角度(double)
+#   IK情報: KID 0～15 ごとに 受信時刻(double) データの種類(uint16) x,y,z,rx,ry,rz,tx,ty,tz(int16) 予約(4Byte)
+#   加速度: 受信時刻(double) ax,ay,az(int16) 予約(2Byte)
+# SEQはseqlockのカウンタで、書き込み中は奇数になる。時刻が0のデータは未受信を表す。
+_MAGIC = b'VSID'
+_VERSION = 2
+_HEADER = struct.Struct('<4sHHQ')
+_SEQ_OFFSET = 8
+_SERVO_NUM = 255
+_SERVO_INFO_LENGTH = 54
+_SERVO = struct.Struct('<d56s54d')
+_SERVO_TIME_OFFSET = 64 # サーボ情報の記録の中での、アドレスごとの受信時刻の位置
+_ANGLE = struct.Struct('<dd')
+_KID_NUM = 16
+_IK = struct.Struct('<dH9h4x')
+_ACCELERATION = struct.Struct('<d3h2x')
+_SERVO_OFFSET = _HEADER.size
+_ANGLE_OFFSET = _SERVO_OFFSET + _SERVO.size * _SERVO_NUM
+_IK_OFFSET = _ANGLE_OFFSET + _ANGLE.size * _SERVO_NUM
+_ACCELERATION_OFFSET = _IK_OFFSET + _IK.size * _KID_NUM
+_SIZE = _ACCELERATION_OFFSET + _ACCELERATION.size
+_SEQ = struct.Struct('<Q')
+_IK_KEYS = ('x', 'y', 'z', 'rx', 'ry', 'rz', 'tx', 'ty', 'tz')
+# 読み出しで書き込みの終わりを待つ間、他のスレッドに譲らずに読み直す回数
+_READ_SPIN_COUNT = 100
+
+
+class StatePublisher(object):
+    '''ロボットの最新状態を名前付き共有メモリに書き込むクラス
+
+    Connect.publish_state()で作られ、受信したサーボ情報、IK情報、加速度と、送信した目標角度を書き込む。
+    同じプロセス内の複数スレッドからの書き込みはロックで順番に行う。
+    '''
+
+    def __init__(self, name=None):
+        '''初期化処理(共有メモリの作成)
+
+        Args:
+            name(Optional[str]): 共有メモリの名前(省略した場合は自動で決める)
+
+        Raises:
+            ValueError: invalid argument
+            FileExistsError: 同じ名前の共有メモリが既にある場合発生
+        '''
+        if name is not None and not isinstance(name, str):
+            raise ValueError('name must be str')
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=_SIZE)
+        self._buf = self._shm.buf
+        self._buf[0:_SIZE] = bytes(_SIZE)
+        _HEADER.pack_into(self._buf, 0, _MAGIC, _VERSION, 0, 0)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def get_name(self):
+        '''共有メモリの名前を返す
+        '''
+        return self._shm.name
+
+    def publish_servo(self, sid, address, data, received_time):
+        '''サーボ情報の書き込み
+
+        Args:
+            sid(int): サーボID
+            address(int): サーボ情報の先頭アドレス
+            data(bytes/list): サーボ情報
+            received_time(float): 受信時刻
+        '''
+        offset = _SERVO_OFFSET + _SERVO.size * sid
+        with self._lock:
+            if self._buf is None:
+                return
+            self._begin_write()
+            self._buf[offset + 8 + address:offset + 8 + address + len(data)] = bytes(data)
+            struct.pack_into('<d', self._buf, offset, received_time)
+            struct.pack_into('<%dd' % len(data), self._buf, offset + _SERVO_TIME_OFFSET + 8 * address, *([received_time] * len(data)))
+            self._end_write()
+
+    def publish_angle(self, sid, angle, sent_time):
+        '''目標角度の書き込み
+
+        Args:
+            sid(int): サーボID
+            angle(int/float): 目標角度
+            sent_time(float): 送信時刻
+        '''
+        with self._lock:
+            if self._buf is None:
+                return
+            self._begin_write()
+            _ANGLE.pack_into(self._buf, _ANGLE_OFFSET + _ANGLE.size * sid, sent_time, angle)
+            self._end_write()
+
+    def publish_angles(self, angle_data_set, sent_time):
+        '''複数サーボの目標角度の書き込み(set_servo_angle()の引数と同じ形式)
+        '''
+        with self._lock:
+            if self._buf is None:
+                return
+            self._begin_write()
+            for angle_data in angle_data_set:
+                _ANGLE.pack_into(self._buf, _ANGLE_OFFSET + _ANGLE.size * angle_data['sid'], sent_time, angle_data['angle'])
+            self._end_write()
+
+    def publish_ik(self, kid, kdt, received_time):
+        '''IK情報の書き込み
+
+        Args:
+            kid(int): IK部位の番号
+            kdt(dict): IK用設定データ
+            received_time(float): 受信時刻
+        '''
+        flags = 0
+        values = []
+        for i, key in enumerate(_IK_KEYS):
+            if key in kdt:
+                flags |= 1 << i
+                values.append(kdt[key])
+            else:
+                values.append(0)
+        with self._lock:
+            if self._buf is None:
+                return
+            self._begin_write()
+            _IK.pack_into(self._buf, _IK_OFFSET + _IK.size * kid, received_time, flags, *values)
+            self._end_write()
+
+    def publish_acceleration(self, ax, ay, az, received_time):
+        '''加速度の書き込み
+        '''
+        with self._lock:
+            if self._buf is None:
+                return
+            self._begin_write()
+            _ACCELERATION.pack_into(self._buf, _ACCELERATION_OFFSET, received_time, ax, ay, az)
+            self._end_write()
+
+    def close(self):
+        '''共有メモリの削除(閉じた後の書き込みは何もしない)
+        '''
+        with self._lock:
+            if self._buf is None:
+                return
+            self._buf = None
+            self._shm.close()
+            self._shm.unlink()
+
+    def _begin_write(self):
+        self._seq += 1
+        _SEQ.pack_into(self._buf, _SEQ_OFFSET, self._seq)
+
+    def _end_write(self):
+        self._seq += 1
+        _SEQ.pack_into(self._buf, _SEQ_OFFSET, self._seq)
+
+
+class StateReader(object):
+    '''StatePublisherが公開したロボットの状態を読み出すクラス
+
+    別のプロセスから共有メモリに接続し、システムコールなしで最新状態を読み出す。
+    書き込み中に読んだ場合はseqlockのカウンタで検出して読み直すので、読み出したデータが混ざることはない。
+    いくつのプロセスから同時に読み出してもよい。
+    公開側のプロセスが書き込みの途中で終了すると、カウンタが奇数のまま残り読み出しが完了しなくなる。
+    その場合はtimeout秒まで(他のスレッドに譲りながら)読み直し、それでも読めなければTimeoutErrorを発生させる。
+
+    example:
+        reader = vsido.StateReader('vsido_state')
+        print(reader.get_angle(1))
+    '''
+
+    def __init__(self, name, timeout=1, shared_tracker=False):
+        '''初期化処理(共有メモリへの接続)
+
+        Args:
+            name(str): 共有メモリの名前
+            timeout(Optional[int/float]): 書き込み中のデータの読み直しを諦めるまでの秒数(省略した場合は1秒)
+            shared_tracker(Optional[bool]): 公開したプロセスとresource_trackerを共有している
+                (公開したプロセスをspawnで起動した)プロセスで接続する場合はTrue
+
+        Raises:
+            ValueError: invalid argument
+            FileNotFoundError: 共有メモリがない場合発生
+        '''
+        if not isinstance(name, str):
+            raise ValueError('name must be str')
+        if not (isinstance(timeout, int) or isinstance(timeout, float)):
+            raise ValueError('timeout must be int or float')
+        if timeout <= 0:
+            raise ValueError('timeout must be bigger than 0')
+        self._timeout = timeout
+        self._shm = _attach_shared_memory(name, shared_tracker)
+        self._buf = self._shm.buf
+        magic, version, reserved, seq = _HEADER.unpack_from(self._buf, 0)
+        if not magic == _MAGIC or not version == _VERSION:
+            self.close()
+            raise ValueError('invalid shared memory layout')
+
+    def get_servo(self, sid):
+        '''サーボ情報の読み出し
+
+        Args:
+            sid(int): サーボID
+
+        Returns:
+            dict: サーボ情報の辞書データ(未受信の場合はNone)
+                sid(int): サーボID
+                data(bytes): サーボ情報(アドレス0～53)
+                time(float): 最後に受信した時刻
+
+        Raises:
+            ValueError: invalid argument
+            TimeoutError: 書き込みが終わらない場合発生(公開側のプロセスが書き込み中に終了した場合など)
+        '''
+        self._check_id(sid, _SERVO_NUM - 1, 'sid')
+        values = self._read(_SERVO, _SERVO_OFFSET + _SERVO.size * sid)
+        if values[0] == 0:
+            return None
+        return {'sid':sid, 'data':values[1][:_SERVO_INFO_LENGTH], 'time':values[0]}
+
+    def get_servo_mirror(self, sid):
+        '''サーボ情報の写しの読み出し(Connect.get_servo_mirror()と同じ形式)
+
+        Args:
+            sid(int): サーボID
+
+        Returns:
+            dict: サーボ情報の写しの辞書データ(未受信の場合はNone)
+                sid(int): サーボID
+                data(list): サーボ情報(アドレス0～53)
+                time(tuple): アドレスごとの受信時刻(未受信のアドレスは0)
+
+        Raises:
+            ValueError: invalid argument
+            TimeoutError: 書き込みが終わらない場合発生(公開側のプロセスが書き込み中に終了した場合など)
+        '''
+        self._check_id(sid, _SERVO_NUM - 1, 'sid')
+        values = self._read(_SERVO, _SERVO_OFFSET + _SERVO.size * sid)
+        if values[0] == 0:
+            return None
+        return {'sid':sid, 'data':list(values[1][:_SERVO_INFO_LENGTH]), 'time':values[2:]}
+
+    def get_angle(self, sid):
+        '''目標角度の読み出し
+
+        Args:
+            sid(int): サーボID
+
+        Returns:
+            dict: 目標角度の辞書データ(未送信の場合はNone)
+                example:
+                {'sid':1, 'angle':20.0, 'time':1437557212.52}
+
+        Raises:
+            ValueError: invalid argument
+            TimeoutError: 書き込みが終わらない場合発生(公開側のプロセスが書き込み中に終了した場合など)
+        '''
+        self._check_id(sid, _SERVO_NUM - 1, 'sid')
+        sent_time, angle = self._read(_ANGLE, _ANGLE_OFFSET + _ANGLE.size * sid)
+        if sent_time == 0:
+            return None
+        return {'sid':sid, 'angle':angle, 'time':sent_time}
+
+    def get_ik(self, kid):
+        '''IK情報の読み出し
+
+        Args:
+            kid(int): IK部位の番号
+
+        Returns:
+            dict: IK情報の辞書データ(未受信の場合はNone)
+                example:
+                {'kid':2, 'kdt':{'x':0, 'y':0, 'z':100}, 'time':1437557212.52}
+
+        Raises:
+            ValueError: invalid argument
+            TimeoutError: 書き込みが終わらない場合発生(公開側のプロセスが書き込み中に終了した場合など)
+        '''
+        self._check_id(kid, _KID_NUM - 1, 'kid')
+        values = self._read(_IK, _IK_OFFSET + _IK.size * kid)
+        if values[0] == 0:
+            return None
+        kdt = {}
+        for i, key in enumerate(_IK_KEYS):
+            if values[1] & (1 << i):
+                kdt[key] = values[2 + i]
+        return {'kid':kid, 'kdt':kdt, 'time':values[0]}
+
+    def get_acceleration(self):
+        '''加速度の読み出し
+
+        Returns:
+            dict: 加速度の辞書データ(未受信の場合はNone)
+                example:
+                {'ax': 125, 'ay': 158, 'az': 118, 'time':1437557212.52}
+
+        Raises:
+            TimeoutError: 書き込みが終わらない場合発生(公開側のプロセスが書き込み中に終了した場合など)
+        '''
+        received_time, ax, ay, az = self._read(_ACCELERATION, _ACCELERATION_OFFSET)
+        if received_time == 0:
+            return None
+        return {'ax':ax, 'ay':ay, 'az':az, 'time':received_time}
+
+    def close(self):
+        '''共有メモリからの切り離し
+        '''
+        self._buf = None
+        self._shm.close()
+
+    def _read(self, record, offset):
+        '''seqlockで一貫性を確認しながらデータを読み出す
+        '''
+        buf = self._buf
+        count = 0
+        deadline = None
+        while True:
+            seq_before = _SEQ.unpack_from(buf, _SEQ_OFFSET)[0]
+            if not seq_before & 1:
+                values = record.unpack_from(buf, offset)
+                if _SEQ.unpack_from(buf, _SEQ_OFFSET)[0] == seq_before:
+                    return values
+            count += 1
+            if count < _READ_SPIN_COUNT:
+                continue
+            # 書き込みがすぐに終わらない場合は、他のスレッドに譲りながら期限まで読み直す
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + self._timeout
+            elif now >= deadline:
+                raise TimeoutError('shared memory write did not finish')
+            time.sleep(0)
+
+    def _check_id(self, value, max_value, name):
+        if not isinstance(value, int):
+            raise ValueError(name + ' must be int')
+        if not 0 <= value <= max_value:
+            raise ValueError(name + ' must be 0 - ' + str(max_value))
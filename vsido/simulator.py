@@ -0,0 +1,350 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ シミュレーションの通信先
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import array
+import functools
+import operator
+import threading
+
+from vsido.clock import SYSTEM_CLOCK
+from vsido.opcodes import _decode_2bytes_array, _encode_2bytes_array
+
+_OP_ANGLE = 0x6f # 'o'
+_OP_COMPLIANCE = 0x63 # 'c'
+_OP_MIN_MAX = 0x6d # 'm'
+_OP_SERVO_INFO = 0x64 # 'd'
+_OP_FEEDBACK_ID = 0x66 # 'f'
+_OP_GET_FEEDBACK = 0x72 # 'r'
+_OP_SET_VID_VALUE = 0x73 # 's'
+_OP_GET_VID_VALUE = 0x67 # 'g'
+_OP_CHECK_SERVO = 0x6a # 'j'
+_OP_IK = 0x6b # 'k'
+_OP_WALK = 0x74 # 't'
+_OP_ACCELERATION = 0x61 # 'a'
+_SERVO_INFO_LENGTH = 54
+# IKの位置、姿勢、トルクのデータ(IKFのbit0～2が設定、bit3～5が返答の指定)
+_IK_KEYS = (('x', 'y', 'z'), ('rx', 'ry', 'rz'), ('tx', 'ty', 'tz'))
+
+
+class _SimulatedServo(object):
+    '''シミュレーションのサーボ
+
+    目標角度を受け取った時刻の角度から、cycle_timeかけて目標角度まで直線的に動く。角度は0.1度単位。
+    '''
+    __slots__ = ('sid', 'start_angle', 'target_angle', 'start_time', 'cycle_time', 'min_angle', 'max_angle', 'compliance', 'registers')
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.start_angle = 0
+        self.target_angle = 0
+        self.start_time = 0.0
+        self.cycle_time = 0.0
+        self.min_angle = -1800
+        self.max_angle = 1800
+        self.compliance = (0, 0)
+        self.registers = bytearray(_SERVO_INFO_LENGTH)
+
+    def get_angle(self, now):
+        '''時刻nowでの角度を返す
+        '''
+        if self.cycle_time <= 0 or now >= self.start_time + self.cycle_time:
+            return self.target_angle
+        if now <= self.start_time:
+            return self.start_angle
+        return round(self.start_angle + (self.target_angle - self.start_angle) * (now - self.start_time) / self.cycle_time)
+
+    def set_target(self, angle, cycle_time, now):
+        self.start_angle = self.get_angle(now)
+        self.target_angle = min(max(angle, self.min_angle), self.max_angle)
+        self.start_time = now
+        self.cycle_time = cycle_time
+
+
+class SimulatedBoard(object):
+    '''V-Sido CONNECTの代わりにコマンドに応答する、シリアルポート互換の通信先
+
+    Connect.connect()にシリアルポート文字列の代わりに渡して使う。
+    「目標角度設定」で受け取った角度にcycle_timeかけて直線的に移行するサーボを模擬し、
+    「サーボ情報要求」「フィードバック要求」にはangle_addressに現在角度を書いたサーボ情報で、
+    「IK設定」「IK取得」には最後に設定されたIKの値で、「加速度センサー値要求」にはset_acceleration()の値で応答する。
+    時刻は渡した時計から読むので、VirtualClockと組み合わせれば仮想時間で動く。
+    レスポンスは書き込みの時点で受信データに積む(通信時間は模擬しない)。
+
+    example:
+        clock = vsido.VirtualClock()
+        board = vsido.SimulatedBoard(clock, sid_set=range(1, 21))
+        vc = vsido.Connect(clock=clock)
+        vc.connect(board)
+    '''
+
+    def __init__(self, clock=None, sid_set=(), angle_address=19, firmware_version=0x22, timeout=1):
+        '''初期化処理
+
+        Args:
+            clock(Optional[SystemClock]): 時計(省略した場合は実時間)
+            sid_set(Optional[list/tuple/range]): 接続されているサーボID(省略した場合は目標角度を受け取ったサーボを追加する)
+            angle_address(Optional[int]): 現在角度を書くサーボ情報のアドレス(範囲は0～52、省略した場合は19)
+            firmware_version(Optional[int]): 「VID要求」でバージョン(VID 254)として返す値
+            timeout(Optional[int/float]): read()のタイムアウト(実時間の秒)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        for sid in sid_set:
+            if not isinstance(sid, int):
+                raise ValueError('sid must be int')
+            if not 1 <= sid <= 254:
+                raise ValueError('sid must be 1 - 254')
+        if not isinstance(angle_address, int):
+            raise ValueError('angle_address must be int')
+        if not 0 <= angle_address <= 52:
+            raise ValueError('angle_address must be 0 - 52')
+        if not isinstance(firmware_version, int):
+            raise ValueError('firmware_version must be int')
+        if not 0 <= firmware_version <= 254:
+            raise ValueError('firmware_version must be 0 - 254')
+        self.timeout = timeout
+        self.is_open = True
+        self._clock = clock if clock is not None else SYSTEM_CLOCK
+        self._angle_address = angle_address
+        self._fixed_servos = bool(sid_set)
+        self._servos = dict((sid, _SimulatedServo(sid)) for sid in sid_set)
+        self._feedback_sid_set = ()
+        self._vid_values = {254:firmware_version}
+        self._ik_values = {}
+        self._acceleration = (128, 128, 128)
+        self._walk = (0, 0)
+        self._received_count = {}
+        self._buffer = bytearray()
+        self._condition = threading.Condition()
+        self._cancelled = False
+
+    # シリアルポート互換のメソッド
+    def open(self):
+        '''開き直す(Connectのウォッチドッグの再接続で使われる)
+        '''
+        self.is_open = True
+
+    def close(self):
+        '''閉じる
+        '''
+        with self._condition:
+            self.is_open = False
+            self._condition.notify_all()
+
+    @property
+    def in_waiting(self):
+        '''読み出せるByte数
+        '''
+        return len(self._buffer)
+
+    def read(self, size=1):
+        '''レスポンスを読み出す(timeout秒までにデータがなければ空のデータを返す)
+        '''
+        with self._condition:
+            if not self._buffer and self.is_open and not self._cancelled:
+                self._condition.wait(self.timeout)
+            self._cancelled = False
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            return data
+
+    def cancel_read(self):
+        '''read()の待ちを抜けさせる
+        '''
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
+
+    def write(self, data):
+        '''コマンドを受け取って処理する
+        '''
+        data = bytes(data)
+        if len(data) >= 4 and data[0] == 0xff and data[2] == len(data) and functools.reduce(operator.xor, data) == 0:
+            op = data[1]
+            self._received_count[op] = self._received_count.get(op, 0) + 1
+            handler = SimulatedBoard._HANDLERS.get(op)
+            if handler is not None:
+                response_payload = handler(self, data[3:-1], self._clock.time())
+                if response_payload is not None:
+                    response_data = [0xff, op, len(response_payload) + 4] + list(response_payload) + [0]
+                    response_data[-1] = functools.reduce(operator.xor, response_data)
+                    with self._condition:
+                        self._buffer += bytes(response_data)
+                        self._condition.notify_all()
+        return len(data)
+
+    # 模擬の状態の操作
+    def get_angle(self, sid):
+        '''サーボの現在角度(度)を返す
+        '''
+        return self._get_servo(sid).get_angle(self._clock.time()) / 10
+
+    def set_angle(self, sid, angle):
+        '''サーボの角度(度)をすぐに変える(外力で動かされた場合などの模擬)
+        '''
+        self._get_servo(sid).set_target(round(angle * 10), 0.0, self._clock.time())
+
+    def get_sid_set(self):
+        '''模擬しているサーボIDを返す
+        '''
+        return tuple(sorted(self._servos))
+
+    def set_acceleration(self, ax, ay, az):
+        '''「加速度センサー値要求」で返す値を設定する(範囲は1～253)
+        '''
+        for value in (ax, ay, az):
+            if not isinstance(value, int):
+                raise ValueError('acceleration must be int')
+            if not 1 <= value <= 253:
+                raise ValueError('acceleration must be 1 - 253')
+        self._acceleration = (ax, ay, az)
+
+    def get_walk(self):
+        '''最後に受け取った「移動情報指定」の(forward, turn_cw)を返す
+        '''
+        return self._walk
+
+    def get_vid_values(self):
+        '''受け取ったVID設定を返す
+        '''
+        return dict(self._vid_values)
+
+    def get_received_count(self, op):
+        '''OPごとの受け取ったコマンドの数を返す
+        '''
+        return self._received_count.get(op, 0)
+
+    def _get_servo(self, sid):
+        servo = self._servos.get(sid)
+        if servo is None:
+            servo = _SimulatedServo(sid)
+            self._servos[sid] = servo
+        return servo
+
+    def _read_registers(self, sid, address, length, now):
+        '''現在角度を書き込んだサーボ情報を返す
+        '''
+        servo = self._servos[sid]
+        servo.registers[self._angle_address:self._angle_address + 2] = _encode_2bytes_array(array.array('h', [servo.get_angle(now)]))
+        return list(servo.registers[address:address + length])
+
+    # コマンドごとの処理(レスポンスのOP以降、SUMより前のデータを返す)
+    def _handle_angle(self, body, now):
+        cycle_time = body[0] * 0.01
+        # CYCの後にSID、角度の下位、上位の3Byteずつ並んでいる
+        count = (len(body) - 1) // 3
+        word_data = bytearray(count * 2)
+        word_data[0::2] = body[2:2 + count * 3:3]
+        word_data[1::2] = body[3:3 + count * 3:3]
+        angles = _decode_2bytes_array(bytes(word_data), True)
+        for sid, angle in zip(body[1::3], angles):
+            if self._fixed_servos and sid not in self._servos:
+                continue
+            self._get_servo(sid).set_target(angle, cycle_time, now)
+        return None
+
+    def _handle_compliance(self, body, now):
+        for i in range(0, len(body) - 2, 3):
+            if body[i] in self._servos:
+                self._servos[body[i]].compliance = (body[i + 1], body[i + 2])
+        return None
+
+    def _handle_min_max(self, body, now):
+        for i in range(0, len(body) - 4, 5):
+            if body[i] in self._servos:
+                servo = self._servos[body[i]]
+                servo.min_angle, servo.max_angle = _decode_2bytes_array(bytes(body[i + 1:i + 5]), True)
+        return None
+
+    def _handle_servo_info(self, body, now):
+        response_payload = []
+        for i in range(0, len(body) - 2, 3):
+            sid, address, length = body[i], body[i + 1], body[i + 2]
+            if sid in self._servos and address + length <= _SERVO_INFO_LENGTH:
+                response_payload.append(sid)
+                response_payload.extend(self._read_registers(sid, address, length, now))
+        return response_payload
+
+    def _handle_feedback_id(self, body, now):
+        self._feedback_sid_set = tuple(body)
+        return None
+
+    def _handle_get_feedback(self, body, now):
+        address, length = body[0], body[1]
+        if address + length > _SERVO_INFO_LENGTH:
+            return None
+        response_payload = []
+        for sid in self._feedback_sid_set:
+            if sid in self._servos:
+                response_payload.append(sid)
+                response_payload.extend(self._read_registers(sid, address, length, now))
+        return response_payload
+
+    def _handle_set_vid_value(self, body, now):
+        for i in range(0, len(body) - 1, 2):
+            self._vid_values[body[i]] = body[i + 1]
+        return None
+
+    def _handle_get_vid_value(self, body, now):
+        return [self._vid_values.get(vid, 0) for vid in body]
+
+    def _handle_check_servo(self, body, now):
+        response_payload = []
+        for sid in sorted(self._servos):
+            response_payload.extend((sid, 48))
+        return response_payload
+
+    def _handle_ik(self, body, now):
+        ikf = body[0]
+        kid_set = []
+        position = 1
+        while position < len(body):
+            kid = body[position]
+            position += 1
+            kid_values = self._ik_values.setdefault(kid, {})
+            for bit, keys in enumerate(_IK_KEYS):
+                if ikf & (1 << bit):
+                    for key, value in zip(keys, body[position:position + 3]):
+                        kid_values[key] = value
+                    position += 3
+            kid_set.append(kid)
+        if not ikf & 0b00111000:
+            return None
+        response_payload = [ikf & 0b00111000]
+        for kid in kid_set:
+            response_payload.append(kid)
+            kid_values = self._ik_values[kid]
+            for bit, keys in enumerate(_IK_KEYS):
+                if ikf & (1 << (bit + 3)):
+                    # KDTは-100～100を0～200で表す
+                    response_payload.extend(kid_values.get(key, 100) for key in keys)
+        return response_payload
+
+    def _handle_walk(self, body, now):
+        if len(body) >= 4:
+            self._walk = (body[2] - 100, body[3] - 100)
+        return None
+
+    def _handle_acceleration(self, body, now):
+        return list(self._acceleration)
+
+    _HANDLERS = {
+        _OP_ANGLE: _handle_angle,
+        _OP_COMPLIANCE: _handle_compliance,
+        _OP_MIN_MAX: _handle_min_max,
+        _OP_SERVO_INFO: _handle_servo_info,
+        _OP_FEEDBACK_ID: _handle_feedback_id,
+        _OP_GET_FEEDBACK: _handle_get_feedback,
+        _OP_SET_VID_VALUE: _handle_set_vid_value,
+        _OP_GET_VID_VALUE: _handle_get_vid_value,
+        _OP_CHECK_SERVO: _handle_check_servo,
+        _OP_IK: _handle_ik,
+        _OP_WALK: _handle_walk,
+        _OP_ACCELERATION: _handle_acceleration,
+    }
@@ -0,0 +1,209 @@
+# coding:utf-8
+'''Python3用V-Sido Connectライブラリ 処理段階ごとの時間計測
+
+Copyright (c) 2015 Daisuke IMAI
+
+This software is released under the MIT License.
+http://opensource.org/licenses/mit-license.php
+'''
+import collections
+import json
+import os
+import threading
+import time
+
+# 計測する公開メソッド(引数の検証から送信・レスポンスの解析までを含む)
+_API_METHODS = (
+    'set_servo_angle', 'set_servo_compliance', 'set_servo_min_max_angle', 'get_servo_info',
+    'set_feedback_id', 'get_servo_feedback', 'set_vid_value', 'get_vid_value', 'write_flash',
+    'set_gpio_value', 'set_pwm_pulse_width', 'check_connected_servo', 'set_ik', 'get_ik',
+    'walk', 'get_acceleration',
+)
+# 送信処理の段階(メソッド名、分類)
+_STAGE_METHODS = (
+    ('_write_command', 'queue'),
+    ('_transmit', 'write'),
+    ('_send_data_wait_response', 'wait'),
+    ('_dispatch_response', 'receive'),
+)
+
+
+class Tracer(object):
+    '''Connectの処理段階ごとの所要時間をナノ秒単位で記録するクラス
+
+    enable()でConnectのインスタンスのメソッドを計測用のラッパーで置き換え、disable()で元に戻す。
+    無効にしている間はラッパーがないので、計測のための負荷はない。
+    記録する段階は次のとおり(分類名はChromeのトレースイベントのcatになる)。
+        api: 公開メソッド全体(引数の検証を含む)
+        encode: 送信データの作成(_make_*_command)
+        queue: 送信レーンへの積み込み(_write_command)
+        write: シリアルポートへの書き込み(_transmit)
+        wait: 送信してからレスポンスを受け取るまで(_send_data_wait_response)
+        receive: 受信スレッドでのレスポンスの受け渡し(_dispatch_response)
+        parse: レスポンスの解析(_parse_*_response)
+        tick: trace_task()で登録した周期処理の1周期
+    記録は上限のある両端キューに積み、古いものから捨てる。
+    export_chrome_trace()でChromeのトレースイベント形式のJSONに書き出し、Perfettoなどで表示できる。
+
+    example:
+        tracer = vsido.Tracer(vc)
+        tracer.enable()
+        vc.set_servo_angle({'sid':2, 'angle':10})
+        tracer.disable()
+        tracer.export_chrome_trace('trace.json')
+    '''
+
+    def __init__(self, connect, max_events=100000):
+        '''初期化処理
+
+        Args:
+            connect(Connect): 計測するV-Sido CONNECTのインスタンス
+            max_events(Optional[int]): 保持する記録の上限(省略した場合は100000件)
+
+        Raises:
+            ValueError: invalid argument
+        '''
+        if not isinstance(max_events, int):
+            raise ValueError('max_events must be int')
+        if not max_events > 0:
+            raise ValueError('max_events must be bigger than 0')
+        self._connect = connect
+        self._events = collections.deque(maxlen=max_events)
+        self._wrapped = []
+        self._enabled = False
+
+    def enable(self):
+        '''計測の開始
+        '''
+        if self._enabled:
+            return
+        self._enabled = True
+        for name in dir(type(self._connect)):
+            if name.startswith('_make_') and name.endswith('_command'):
+                self._wrap(self._connect, name, 'encode')
+            elif name.startswith('_parse_') and name.endswith('_response'):
+                self._wrap(self._connect, name, 'parse')
+        for name in _API_METHODS:
+            self._wrap(self._connect, name, 'api')
+        for name, category in _STAGE_METHODS:
+            self._wrap(self._connect, name, category)
+
+    def disable(self):
+        '''計測の停止(置き換えたメソッドを元に戻す)
+        '''
+        self._enabled = False
+        for target, name in self._wrapped:
+            target.__dict__.pop(name, None)
+        self._wrapped = []
+
+    def is_enabled(self):
+        '''計測中かどうか
+        '''
+        return self._enabled
+
+    def trace_task(self, task, name=None):
+        '''周期処理(PeriodicTaskを継承したクラスのインスタンス)の1周期ごとの時間も記録する
+
+        disable()で元に戻る。enable()より後に呼ぶこと。
+
+        Args:
+            task(PeriodicTask): 周期処理のインスタンス
+            name(Optional[str]): 記録に付ける名前(省略した場合はクラス名)
+        '''
+        if not self._enabled:
+            return
+        self._wrap(task, '_tick', 'tick', name if name is not None else type(task).__name__)
+
+    def span(self, name, category='user'):
+        '''任意の区間を記録するコンテキストマネージャを返す(計測していない場合は何もしない)
+
+        example:
+            with tracer.span('control_loop'):
+                ...
+        '''
+        return _Span(self, name, category)
+
+    def clear(self):
+        '''記録の消去
+        '''
+        self._events.clear()
+
+    def get_events(self):
+        '''記録を返す
+
+        Returns:
+            list: 記録の辞書データのリスト
+                name(str): メソッド名
+                category(str): 分類名
+                thread(int): スレッドの識別子
+                start(int): 開始時刻(time.perf_counter_ns()の値)
+                duration(int): 所要時間(nsec)
+        '''
+        return [{'name':name, 'category':category, 'thread':thread, 'start':start, 'duration':end - start} for name, category, thread, start, end in list(self._events)]
+
+    def export_chrome_trace(self, path):
+        '''記録をChromeのトレースイベント形式のJSONファイルに書き出す
+
+        Args:
+            path(str): 書き出すファイルのパス
+        '''
+        with open(path, 'w') as trace_file:
+            json.dump(self.make_chrome_trace(), trace_file)
+
+    def make_chrome_trace(self):
+        '''記録をChromeのトレースイベント形式の辞書データにする
+        '''
+        pid = os.getpid()
+        events = list(self._events)
+        thread_names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        trace_events = []
+        for thread in sorted(set(event[2] for event in events)):
+            trace_events.append({'name':'thread_name', 'ph':'M', 'pid':pid, 'tid':thread, 'args':{'name':thread_names.get(thread, str(thread))}})
+        for name, category, thread, start, end in events:
+            # tsとdurはマイクロ秒単位
+            trace_events.append({'name':name, 'cat':category, 'ph':'X', 'pid':pid, 'tid':thread, 'ts':start / 1000, 'dur':(end - start) / 1000})
+        return {'traceEvents':trace_events, 'displayTimeUnit':'ns'}
+
+    def _wrap(self, target, name, category, label=None):
+        '''インスタンスのメソッドを計測用のラッパーで置き換える
+        '''
+        if name in target.__dict__:
+            return
+        method = getattr(target, name, None)
+        if method is None:
+            return
+        append = self._events.append
+        perf_counter_ns = time.perf_counter_ns
+        get_ident = threading.get_ident
+        label = label if label is not None else name
+
+        def traced(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                append((label, category, get_ident(), start, perf_counter_ns()))
+
+        setattr(target, name, traced)
+        self._wrapped.append((target, name))
+
+
+class _Span(object):
+    '''Tracer.span()で使う区間の記録
+    '''
+    __slots__ = ('tracer', 'name', 'category', 'start')
+
+    def __init__(self, tracer, name, category):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.tracer._enabled:
+            self.tracer._events.append((self.name, self.category, threading.get_ident(), self.start, time.perf_counter_ns()))
+        return False